@@ -1,38 +1,262 @@
-from django.contrib import admin
-from .models import Company, CustomUser, ApprovalRule, ApprovalStep, Expense, ExpenseApproval
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.http import HttpResponse
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+from .models import (
+    Company, CustomUser, ApprovalRule, ApprovalStep, Expense, ExpenseApproval, PolicyViolation, SpendPolicy, Task,
+    ArchivedExpense, ExpenseRollup,
+)
+from .provisioning import ProvisioningError, provision_users, read_rows, write_invites
+from .search import filter_expenses
+
+
+def estimate_table_rows(model, using='default'):
+    """
+    Cheap row estimate from planner statistics: ``pg_class.reltuples`` on
+    PostgreSQL, ``sqlite_stat1`` on SQLite. None until the table has been
+    analyzed (run ANALYZE periodically) or on other backends.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            # -1 means never analyzed.
+            return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # MAX(rowid) would be a high-water mark, not a count, once rows are
+            # archived or deleted. sqlite_stat1 starts each entry with the row count.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row and row[0] else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that stops counting at ``threshold`` rows.
+
+    Below the threshold the count is exact. Above it an unfiltered changelist
+    uses the table estimate instead of a full COUNT(*), so very large
+    changelists stay cheap to open. A whole-table estimate says nothing about a
+    filtered or searched list, so those report ``threshold + 1`` with
+    ``truncated`` set, and the changelist shows "more than <threshold>".
+
+    Past the threshold the count is not exact, so it does not bound the page
+    numbers: any page with rows is valid, and the changelist offers previous
+    and next links instead of a page range.
+    """
+    threshold = 10000
+    truncated = False
+    has_next_page = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        bounded = queryset.order_by().values('pk')[:self.threshold + 1].count()
+        if bounded <= self.threshold:
+            return bounded
+        estimate = None if queryset.query.has_filters() else estimate_table_rows(queryset.model, queryset.db)
+        if estimate is None or estimate < bounded:
+            self.truncated = True
+            return bounded
+        return estimate
+
+    @property
+    def open_ended(self):
+        return self.count > self.threshold
+
+    def validate_number(self, number):
+        if not self.open_ended:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        if not self.open_ended:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        # One row past the page tells whether there is a next one.
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        self.has_next_page = len(rows) > self.per_page
+        return self._get_page(rows[:self.per_page], number, self)
+
+
+class ScaleChangeList(ChangeList):
+    @property
+    def previous_page_url(self):
+        return self.get_query_string({PAGE_VAR: self.page_num - 1}) if self.page_num > 1 else None
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({PAGE_VAR: self.page_num + 1}) if self.paginator.has_next_page else None
+
+
+class ScaleModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skip the unfiltered "N total" COUNT(*) Django runs next to filtered results.
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return ScaleChangeList
+
+
+class ProvisionUsersForm(forms.Form):
+    file = forms.FileField(help_text='CSV with a header row or a JSON list: username, email, role, manager, '
+                                     'password, first_name, last_name. Users without a password get an invite link.')
+
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
-    list_display = ['name', 'country', 'currency', 'created_at']
+    list_display = ['name', 'country', 'currency', 'approval_sla_hours', 'created_at']
     search_fields = ['name', 'country']
+    actions = ['provision_users']
+
+    @admin.action(description='Provision users from a CSV/JSON file')
+    def provision_users(self, request, queryset):
+        if queryset.count() != 1:
+            self.message_user(request, 'Select exactly one company to provision users into.', messages.ERROR)
+            return None
+        company = queryset.get()
+
+        form = ProvisionUsersForm(request.POST if 'apply' in request.POST else None, request.FILES or None)
+        if form.is_valid():
+            try:
+                users = provision_users(company, read_rows(form.cleaned_data['file']))
+            except ProvisioningError as e:
+                form.add_error('file', [f'Row {row}: {message}' for row, message in e.errors[:20]])
+            except ValueError as e:
+                form.add_error('file', f'Could not read the file: {e}')
+            else:
+                response = HttpResponse(content_type='text/csv')
+                response['Content-Disposition'] = f'attachment; filename="invites-company-{company.id}.csv"'
+                write_invites(response, users, request.build_absolute_uri('/'))
+                return response
+
+        return TemplateResponse(request, 'admin/provision_users.html', {
+            **self.admin_site.each_context(request),
+            'title': f'Provision users into {company.name}',
+            'opts': self.model._meta,
+            'company': company,
+            'form': form,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
 
 @admin.register(CustomUser)
-class CustomUserAdmin(admin.ModelAdmin):
+class CustomUserAdmin(ScaleModelAdmin):
     list_display = ['username', 'email', 'role', 'company', 'manager']
     list_filter = ['role', 'company']
+    list_select_related = ['company', 'manager']
     search_fields = ['username', 'email']
+    autocomplete_fields = ['manager']
 
 @admin.register(ApprovalRule)
 class ApprovalRuleAdmin(admin.ModelAdmin):
     list_display = ['name', 'company', 'rule_type', 'is_manager_first', 'is_active']
     list_filter = ['rule_type', 'is_active', 'company']
+    list_select_related = ['company']
     search_fields = ['name']
+    autocomplete_fields = ['specific_approver']
 
 @admin.register(ApprovalStep)
 class ApprovalStepAdmin(admin.ModelAdmin):
     list_display = ['approval_rule', 'approver', 'sequence']
     list_filter = ['approval_rule']
+    list_select_related = ['approval_rule', 'approver']
     ordering = ['approval_rule', 'sequence']
+    autocomplete_fields = ['approver']
 
 @admin.register(Expense)
-class ExpenseAdmin(admin.ModelAdmin):
+class ExpenseAdmin(ScaleModelAdmin):
     list_display = ['employee', 'amount', 'currency', 'category', 'status', 'expense_date']
     list_filter = ['status', 'category', 'company']
-    search_fields = ['employee__username', 'description']
+    list_select_related = ['employee']
+    autocomplete_fields = ['employee']
+    raw_id_fields = ['company', 'approval_rule']
+    # Text search goes through the full-text index; only usernames use LIKE.
+    search_fields = ['^employee__username']
     date_hierarchy = 'expense_date'
 
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= filter_expenses(queryset, search_term)
+        return results, may_have_duplicates
+
 @admin.register(ExpenseApproval)
-class ExpenseApprovalAdmin(admin.ModelAdmin):
-    list_display = ['expense', 'approver', 'status', 'step_number', 'approved_at']
+class ExpenseApprovalAdmin(ScaleModelAdmin):
+    list_display = ['expense', 'approver', 'status', 'step_number', 'sla_started_at', 'approved_at']
     list_filter = ['status', 'step_number']
-    search_fields = ['expense__description', 'approver__username']
+    # __str__ on both models walks expense -> employee and approver.
+    list_select_related = ['expense__employee', 'approver']
+    search_fields = ['^approver__username']
+    autocomplete_fields = ['approver']
+    raw_id_fields = ['expense', 'escalated_from']
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(expense__in=filter_expenses(Expense.objects.all(), search_term))
+        return results, may_have_duplicates
+
+@admin.register(SpendPolicy)
+class SpendPolicyAdmin(admin.ModelAdmin):
+    list_display = ['name', 'company', 'category', 'period', 'limit_amount', 'is_active']
+    list_filter = ['is_active', 'period', 'category', 'company']
+    list_select_related = ['company']
+
+@admin.register(PolicyViolation)
+class PolicyViolationAdmin(ScaleModelAdmin):
+    list_display = ['expense', 'policy', 'period_start', 'period_total', 'limit_amount', 'created_at']
+    list_filter = ['policy']
+    list_select_related = ['expense__employee', 'policy']
+    raw_id_fields = ['expense']
+
+@admin.register(ArchivedExpense)
+class ArchivedExpenseAdmin(ScaleModelAdmin):
+    list_display = ['id', 'employee', 'amount', 'currency', 'category', 'status', 'expense_date', 'archived_at']
+    list_filter = ['status', 'category']
+    list_select_related = ['employee']
+    search_fields = ['=id', '^employee__username']
+    date_hierarchy = 'expense_date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ExpenseRollup)
+class ExpenseRollupAdmin(ScaleModelAdmin):
+    list_display = ['company', 'employee', 'category', 'status', 'month', 'count', 'total']
+    list_filter = ['status', 'category', 'company']
+    list_select_related = ['company', 'employee']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Task)
+class TaskAdmin(ScaleModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'updated_at']
+    list_filter = ['status', 'name']
+    search_fields = ['=idempotency_key']
+    readonly_fields = ['created_at', 'updated_at']
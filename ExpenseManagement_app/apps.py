@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate
+
+
+def install_search_index(sender, using, **kwargs):
+    from .search import install_search_index
+    install_search_index(connections[using])
 
 
 class ExpensemanagementAppConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
+    # A BigAutoField that keeps ids unique across shards (see sharding.py).
+    default_auto_field = 'ExpenseManagement_app.sharding.TenantAutoField'
     name = 'ExpenseManagement_app'
+
+    def ready(self):
+        # Parse the bundled country/currency file once per process, not per request.
+        from .countries import load_dataset
+        load_dataset()
+
+        # Importing the handlers registers them with the task queue.
+        from . import tasks  # noqa: F401
+
+        from . import changefeed, identity, sharding
+        changefeed.connect_signals()
+        identity.connect_signals()
+        sharding.connect_signals()
+
+        post_migrate.connect(install_search_index, sender=self)
@@ -0,0 +1,194 @@
+"""
+Hot/cold split for expenses.
+
+``archive_closed_expenses`` moves approved and rejected expenses that have not
+changed since a cutoff, with their approvals, policy violations, duplicate
+flags and receipt fingerprints, into the ``Archived*`` tables. Each batch is
+one short transaction: copy, fold into ``ExpenseRollup``, delete the hot rows.
+Ids are kept, so receipt URLs keep working, and receipt files are never
+touched. Flags that hot expenses hold against an archived one are pointed at
+its archived copy, so they survive and never hold an expense back.
+
+Reads that must cover both sides go through ``expense_history`` and
+``spend_summary`` here rather than the models.
+"""
+import heapq
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db.models import Count, F, Q, Sum, Value
+
+from . import changefeed, sharding
+from .models import (
+    ArchivedDuplicateFlag, ArchivedExpense, ArchivedExpenseApproval, ArchivedPolicyViolation,
+    ArchivedReceiptFingerprint, ChangeEvent, DuplicateFlag, Expense, ExpenseApproval, ExpenseRollup, PolicyViolation,
+    ReceiptFingerprint,
+)
+
+CLOSED_STATUSES = ('approved', 'rejected')
+
+EXPENSE_FIELDS = [
+    'id', 'employee_id', 'company_id', 'amount', 'currency', 'amount_in_company_currency', 'category',
+    'description', 'merchant_name', 'expense_date', 'receipt_image', 'receipt_thumbnail', 'ocr_text',
+    'status', 'approval_rule_id', 'current_step', 'created_at', 'updated_at',
+]
+APPROVAL_FIELDS = ['id', 'expense_id', 'approver_id', 'status', 'comments', 'step_number', 'approved_at']
+VIOLATION_FIELDS = ['id', 'expense_id', 'policy_id', 'period_start', 'limit_amount', 'period_total', 'created_at']
+FLAG_FIELDS = ['id', 'expense_id', 'duplicate_of_id', 'archived_duplicate_of_id', 'reason', 'distance', 'created_at']
+FINGERPRINT_FIELDS = ['id', 'expense_id', 'company_id', 'phash', 'band0', 'band1', 'band2', 'band3']
+HISTORY_FIELDS = [
+    'id', 'employee_id', 'amount', 'currency', 'amount_in_company_currency', 'category',
+    'merchant_name', 'expense_date', 'status',
+]
+
+
+def archivable_expenses(cutoff):
+    """Closed expenses untouched since ``cutoff``."""
+    return Expense.objects.filter(status__in=CLOSED_STATUSES, updated_at__lt=cutoff)
+
+
+def _add_to_rollups(expenses):
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for expense in expenses:
+        key = (
+            expense['company_id'], expense['employee_id'], expense['category'], expense['status'],
+            expense['expense_date'].replace(day=1),
+        )
+        deltas[key][0] += 1
+        deltas[key][1] += expense['amount_in_company_currency'] or 0
+
+    key_fields = ['company_id', 'employee_id', 'category', 'status', 'month']
+    ExpenseRollup.objects.bulk_create(
+        [ExpenseRollup(**dict(zip(key_fields, key))) for key in deltas], ignore_conflicts=True,
+    )
+    key_filter = Q()
+    for key in deltas:
+        key_filter |= Q(**dict(zip(key_fields, key)))
+    rollups = list(ExpenseRollup.objects.select_for_update().filter(key_filter))
+    for rollup in rollups:
+        count, total = deltas[(rollup.company_id, rollup.employee_id, rollup.category, rollup.status, rollup.month)]
+        rollup.count += count
+        rollup.total += total
+    ExpenseRollup.objects.bulk_update(rollups, ['count', 'total'])
+
+
+def archive_batch(cutoff, batch_size=500):
+    """Move one batch of archivable expenses to the archive. Returns the number moved."""
+    with sharding.atomic():
+        ids = list(
+            archivable_expenses(cutoff).select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+
+        expenses = list(Expense.objects.filter(id__in=ids).values(*EXPENSE_FIELDS))
+        approvals = list(ExpenseApproval.objects.filter(expense_id__in=ids).values(*APPROVAL_FIELDS))
+        violations = PolicyViolation.objects.filter(expense_id__in=ids).values(*VIOLATION_FIELDS)
+        flags = list(DuplicateFlag.objects.filter(expense_id__in=ids).values(*FLAG_FIELDS))
+        fingerprints = ReceiptFingerprint.objects.filter(expense_id__in=ids).values(*FINGERPRINT_FIELDS)
+        company_ids = {expense['id']: expense['company_id'] for expense in expenses}
+        ArchivedExpense.objects.bulk_create(
+            [ArchivedExpense(**expense) for expense in expenses], ignore_conflicts=True,
+        )
+        ArchivedExpenseApproval.objects.bulk_create(
+            [ArchivedExpenseApproval(**approval) for approval in approvals], ignore_conflicts=True,
+        )
+        ArchivedPolicyViolation.objects.bulk_create(
+            [ArchivedPolicyViolation(**violation) for violation in violations], ignore_conflicts=True,
+        )
+        for flag in flags:
+            flag['duplicate_of_id'] = flag['duplicate_of_id'] or flag['archived_duplicate_of_id']
+            del flag['archived_duplicate_of_id']
+        ArchivedDuplicateFlag.objects.bulk_create(
+            [ArchivedDuplicateFlag(**flag) for flag in flags], ignore_conflicts=True,
+        )
+        ArchivedReceiptFingerprint.objects.bulk_create(
+            [ArchivedReceiptFingerprint(**fingerprint) for fingerprint in fingerprints], ignore_conflicts=True,
+        )
+        # Flags other expenses hold against these now point at the archived copies.
+        DuplicateFlag.objects.filter(duplicate_of_id__in=ids).exclude(expense_id__in=ids).update(
+            duplicate_of=None, archived_duplicate_of=F('duplicate_of'),
+        )
+        _add_to_rollups(expenses)
+        # One 'archived' event per row instead of a 'deleted' event each.
+        ChangeEvent.objects.bulk_create(
+            [
+                ChangeEvent(company_id=expense['company_id'], entity='expense', object_id=expense['id'], action='archived')
+                for expense in expenses
+            ] + [
+                ChangeEvent(
+                    company_id=company_ids[approval['expense_id']], entity='approval',
+                    object_id=approval['id'], action='archived',
+                )
+                for approval in approvals
+            ]
+        )
+        # Cascades to the rows copied above and notifications.
+        # Files are shared by content hash and never deleted with the row.
+        with changefeed.muted():
+            Expense.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_closed_expenses(cutoff, batch_size=500, max_batches=None, on_batch=None):
+    """Archive in batches until nothing is left (or ``max_batches`` ran). Returns the total moved."""
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if on_batch:
+            on_batch(batches, count)
+    return moved
+
+
+def expense_history(user, limit=50, before=None):
+    """
+    Expenses visible to ``user`` across both tables, newest ``expense_date``
+    first, as dicts with an ``archived`` flag. ``before`` is the
+    ``(expense_date, id)`` of the last row of the previous page.
+    """
+    sides = []
+    for model, archived in ((Expense, False), (ArchivedExpense, True)):
+        queryset = user.get_visible_expenses(model)
+        if before is not None:
+            before_date, before_id = before
+            queryset = queryset.filter(
+                Q(expense_date__lt=before_date) | Q(expense_date=before_date, id__lt=before_id)
+            )
+        # Two bounded queries merged here: SQLite rejects LIMIT inside a UNION.
+        sides.append(
+            queryset.order_by('-expense_date', '-id')
+            .values(*HISTORY_FIELDS).annotate(archived=Value(archived))[:limit]
+        )
+    merged = heapq.merge(*sides, key=lambda row: (row['expense_date'], row['id']), reverse=True)
+    return list(islice(merged, limit))
+
+
+def spend_summary(company_id, **filters):
+    """
+    ``{(category, status): (count, total)}`` over a company's whole history:
+    hot rows are aggregated directly, archived ones come from the rollups.
+    ``filters`` may only use fields both share (employee, category, status).
+    """
+    summary = defaultdict(lambda: (0, Decimal(0)))
+    hot = (
+        Expense.objects.filter(company_id=company_id, **filters)
+        .values('category', 'status')
+        .annotate(count=Count('id'), total=Sum('amount_in_company_currency'))
+        .order_by()
+    )
+    cold = (
+        ExpenseRollup.objects.filter(company_id=company_id, **filters)
+        .values('category', 'status')
+        .annotate(count=Sum('count'), total=Sum('total'))
+        .order_by()
+    )
+    for row in list(hot) + list(cold):
+        count, total = summary[(row['category'], row['status'])]
+        summary[(row['category'], row['status'])] = (count + row['count'], total + (row['total'] or 0))
+    return dict(summary)
@@ -0,0 +1,125 @@
+"""
+Change feed for downstream sync (ERP / accounting).
+
+Every save or delete of an ``Expense`` or ``ExpenseApproval`` appends a
+``ChangeEvent`` holding a snapshot of the row. Event ids only grow, so a
+consumer keeps the last id it processed and asks for what came after it: a
+range read on (company, id) whose cost follows the change rate, not the size of
+the expense tables.
+
+Events younger than ``CHANGE_FEED_SETTLE_SECONDS`` are held back. Ids are
+assigned at insert but become visible at commit, so a slow transaction could
+otherwise commit a lower id after a consumer had already moved past it.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .models import ChangeEvent, Expense, ExpenseApproval
+
+MAX_PAGE_SIZE = 500
+
+SNAPSHOT_FIELDS = {
+    'expense': [
+        'id', 'employee_id', 'amount', 'currency', 'amount_in_company_currency', 'category',
+        'description', 'merchant_name', 'expense_date', 'status', 'current_step', 'updated_at',
+    ],
+    'approval': [
+        'id', 'expense_id', 'approver_id', 'status', 'comments', 'step_number', 'approved_at', 'sla_started_at',
+    ],
+}
+
+_muted = ContextVar('changefeed_muted', default=False)
+
+
+def _entity(instance):
+    return 'expense' if isinstance(instance, Expense) else 'approval'
+
+
+def _company_id(instance):
+    if isinstance(instance, Expense):
+        return instance.company_id
+    if ExpenseApproval.expense.is_cached(instance):
+        return instance.expense.company_id if instance.expense else None
+    return Expense.objects.filter(id=instance.expense_id).values_list('company_id', flat=True).first()
+
+
+def snapshot(instance):
+    data = {}
+    for name in SNAPSHOT_FIELDS[_entity(instance)]:
+        field = instance._meta.get_field(name)
+        # to_python normalises values still holding submitted strings (dates, decimals).
+        data[name] = field.to_python(getattr(instance, field.attname))
+    return data
+
+
+def _event(instance, action):
+    return ChangeEvent(
+        company_id=_company_id(instance),
+        entity=_entity(instance),
+        object_id=instance.pk,
+        action=action,
+        data=snapshot(instance) if action != 'deleted' else {},
+    )
+
+
+def record(instance, action):
+    event = _event(instance, action)
+    event.save()
+    return event
+
+
+def record_many(instances, action):
+    """Record rows written with bulk_create/bulk_update/update, which send no signals, in one insert."""
+    return ChangeEvent.objects.bulk_create([_event(instance, action) for instance in instances])
+
+
+@contextmanager
+def muted():
+    """Don't record per-row events inside the block (callers record their own in bulk)."""
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def _on_save(sender, instance, created, raw=False, **kwargs):
+    if not raw and not _muted.get():
+        record(instance, 'created' if created else 'updated')
+
+
+def _on_delete(sender, instance, **kwargs):
+    if not _muted.get():
+        record(instance, 'deleted')
+
+
+def connect_signals():
+    for model in (Expense, ExpenseApproval):
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'changefeed_save_{model.__name__}')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'changefeed_delete_{model.__name__}')
+
+
+def changes_since(company_id, cursor=0, limit=100):
+    """
+    Return ``(events, next_cursor, has_more)`` for a company's changes after
+    ``cursor``. Pass ``next_cursor`` back as ``cursor`` for the next page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    settle = timedelta(seconds=getattr(settings, 'CHANGE_FEED_SETTLE_SECONDS', 5))
+    events = list(
+        ChangeEvent.objects.filter(company_id=company_id, id__gt=cursor, created_at__lte=timezone.now() - settle)
+        .order_by('id')[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+    return events, (events[-1].id if events else cursor), has_more
+
+
+def prune(before):
+    """Delete events created before ``before``; consumers must have synced past them."""
+    return ChangeEvent.objects.filter(created_at__lt=before).delete()[0]
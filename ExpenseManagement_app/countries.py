@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import json
+from collections import namedtuple
+from pathlib import Path
+from types import MappingProxyType
+
+DATA_FILE = Path(__file__).resolve().parent / 'data' / 'countries.json'
+
+Country = namedtuple('Country', ['name', 'code', 'currencies'])
+
+# Built once by load_dataset() and shared read-only by every request.
+CountryDataset = namedtuple(
+    'CountryDataset',
+    ['version', 'countries', 'currencies', 'by_name', 'body', 'gzip_body', 'etag', 'gzip_etag'],
+)
+
+_dataset = None
+
+
+def dump_dataset(version, countries):
+    """Serialize countries the way DATA_FILE is stored: one country per line so refreshes diff cleanly."""
+    rows = ',\n'.join(
+        '  ' + json.dumps(country, ensure_ascii=False, sort_keys=True)
+        for country in sorted(countries, key=lambda c: c['name'])
+    )
+    return f'{{\n "version": {json.dumps(version)},\n "countries": [\n{rows}\n ]\n}}\n'
+
+
+def _build(raw):
+    countries = tuple(
+        Country(c['name'], c['code'], tuple(c['currencies']))
+        for c in raw['countries']
+    )
+    currencies = tuple(sorted({code for c in countries for code in c.currencies}))
+
+    payload = {
+        'version': raw['version'],
+        'countries': [c._asdict() for c in countries],
+        'currencies': list(currencies),
+    }
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    # mtime=0 keeps the compressed bytes identical across workers and restarts.
+    gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+    digest = hashlib.sha256(body).hexdigest()[:32]
+
+    return CountryDataset(
+        version=raw['version'],
+        countries=countries,
+        currencies=currencies,
+        by_name=MappingProxyType({c.name: c for c in countries}),
+        body=body,
+        gzip_body=gzip_body,
+        # Each encoding is its own representation, so each needs its own strong ETag.
+        etag=f'"{digest}"',
+        gzip_etag=f'"{digest}-gz"',
+    )
+
+
+def load_dataset(path=DATA_FILE):
+    """Return the bundled country/currency dataset, reading the file only on first use."""
+    global _dataset
+    if _dataset is None:
+        with open(path, encoding='utf-8') as f:
+            _dataset = _build(json.load(f))
+    return _dataset
+
+
+def reset_dataset():
+    global _dataset
+    _dataset = None
+
+
+def currency_for_country(name):
+    """Return the primary currency code for a country name, or None if unknown."""
+    country = load_dataset().by_name.get(name)
+    return country.currencies[0] if country and country.currencies else None
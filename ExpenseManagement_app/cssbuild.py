@@ -0,0 +1,482 @@
+"""
+Build-time stylesheet for the templates.
+
+The pages used to load the Tailwind "play" CDN, which ships the whole JIT
+compiler to every browser and builds the CSS there on each page load. This
+module does that work once, at build time: it scans ``templates/`` for class
+names, generates CSS for the Tailwind utilities actually used (same names,
+scales and palette as Tailwind v3), and writes one minified file to
+``static/css/app.css``. ``collectstatic`` then gives it a content hash and
+compressed variants (see ``storage.PrecompressedManifestStaticFilesStorage``).
+
+Only the utilities and variants the templates use are implemented; an unknown
+class is simply not emitted, exactly as Tailwind would ignore it. Run
+``manage.py build_css`` after changing classes in a template.
+"""
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+OUTPUT = Path('css') / 'app.css'
+
+# --- Theme (Tailwind v3 defaults) ---
+
+SHADES = ['50', '100', '200', '300', '400', '500', '600', '700', '800', '900', '950']
+PALETTE = {
+    'gray': '#f9fafb #f3f4f6 #e5e7eb #d1d5db #9ca3af #6b7280 #4b5563 #374151 #1f2937 #111827 #030712',
+    'red': '#fef2f2 #fee2e2 #fecaca #fca5a5 #f87171 #ef4444 #dc2626 #b91c1c #991b1b #7f1d1d #450a0a',
+    'amber': '#fffbeb #fef3c7 #fde68a #fcd34d #fbbf24 #f59e0b #d97706 #b45309 #92400e #78350f #451a03',
+    'yellow': '#fefce8 #fef9c3 #fef08a #fde047 #facc15 #eab308 #ca8a04 #a16207 #854d0e #713f12 #422006',
+    'green': '#f0fdf4 #dcfce7 #bbf7d0 #86efac #4ade80 #22c55e #16a34a #15803d #166534 #14532d #052e16',
+    'emerald': '#ecfdf5 #d1fae5 #a7f3d0 #6ee7b7 #34d399 #10b981 #059669 #047857 #065f46 #064e3b #022c22',
+    'teal': '#f0fdfa #ccfbf1 #99f6e4 #5eead4 #2dd4bf #14b8a6 #0d9488 #0f766e #115e59 #134e4a #042f2e',
+    'blue': '#eff6ff #dbeafe #bfdbfe #93c5fd #60a5fa #3b82f6 #2563eb #1d4ed8 #1e40af #1e3a8a #172554',
+    'indigo': '#eef2ff #e0e7ff #c7d2fe #a5b4fc #818cf8 #6366f1 #4f46e5 #4338ca #3730a3 #312e81 #1e1b4b',
+    'purple': '#faf5ff #f3e8ff #e9d5ff #d8b4fe #c084fc #a855f7 #9333ea #7e22ce #6b21a8 #581c87 #3b0764',
+    'rose': '#fff1f2 #ffe4e6 #fecdd3 #fda4af #fb7185 #f43f5e #e11d48 #be123c #9f1239 #881337 #4c0519',
+}
+COLORS = {'white': '#ffffff', 'black': '#000000'}
+for family, values in PALETTE.items():
+    COLORS.update({f'{family}-{shade}': value for shade, value in zip(SHADES, values.split())})
+
+SCREENS = {'sm': '640px', 'md': '768px', 'lg': '1024px', 'xl': '1280px'}
+FONT_SIZES = {
+    'xs': ('0.75rem', '1rem'), 'sm': ('0.875rem', '1.25rem'), 'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'), 'xl': ('1.25rem', '1.75rem'), '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'), '4xl': ('2.25rem', '2.5rem'), '5xl': ('3rem', '1'),
+}
+FONT_WEIGHTS = {'normal': '400', 'medium': '500', 'semibold': '600', 'bold': '700', 'extrabold': '800'}
+MAX_WIDTHS = {
+    'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem', '2xl': '42rem',
+    '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem', 'full': '100%',
+}
+RADII = {'': '0.25rem', 'sm': '0.125rem', 'md': '0.375rem', 'lg': '0.5rem', 'xl': '0.75rem',
+         '2xl': '1rem', '3xl': '1.5rem', 'full': '9999px', 'none': '0px'}
+SHADOWS = {
+    'sm': '0 1px 2px 0 rgb(0 0 0 / 0.05)',
+    '': '0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)',
+    '2xl': '0 25px 50px -12px rgb(0 0 0 / 0.25)',
+    'none': '0 0 #0000',
+}
+BLURS = {'sm': '4px', '': '8px', 'md': '12px', 'lg': '16px', 'xl': '24px'}
+GRADIENT_DIRECTIONS = {'t': 'top', 'tr': 'top right', 'r': 'right', 'br': 'bottom right',
+                       'b': 'bottom', 'bl': 'bottom left', 'l': 'left', 'tl': 'top left'}
+TRANSITIONS = {
+    '': 'color, background-color, border-color, text-decoration-color, fill, stroke, opacity, '
+        'box-shadow, transform, filter, backdrop-filter',
+    'all': 'all',
+    'colors': 'color, background-color, border-color, text-decoration-color, fill, stroke',
+    'opacity': 'opacity',
+    'shadow': 'box-shadow',
+    'transform': 'transform',
+}
+EASINGS = {'linear': 'linear', 'in': 'cubic-bezier(0.4, 0, 1, 1)', 'out': 'cubic-bezier(0, 0, 0.2, 1)',
+           'in-out': 'cubic-bezier(0.4, 0, 0.2, 1)'}
+ANIMATIONS = {
+    'spin': ('spin 1s linear infinite', '@keyframes spin{to{transform:rotate(360deg)}}'),
+    'pulse': ('pulse 2s cubic-bezier(0.4, 0, 0.6, 1) infinite', '@keyframes pulse{50%{opacity:.5}}'),
+    'bounce': (
+        'bounce 1s infinite',
+        '@keyframes bounce{0%,100%{transform:translateY(-25%);animation-timing-function:cubic-bezier(0.8,0,1,1)}'
+        '50%{transform:none;animation-timing-function:cubic-bezier(0,0,0.2,1)}}',
+    ),
+    # Flash messages in base.html.
+    'slide-down': (
+        'slideDown 0.3s ease-out',
+        '@keyframes slideDown{from{opacity:0;transform:translateY(-10px)}to{opacity:1;transform:translateY(0)}}',
+    ),
+}
+TRANSFORM = ('translate(var(--tw-translate-x), var(--tw-translate-y)) rotate(var(--tw-rotate)) '
+             'scaleX(var(--tw-scale-x)) scaleY(var(--tw-scale-y))')
+BOX_SHADOW = 'var(--tw-ring-offset-shadow, 0 0 #0000), var(--tw-ring-shadow, 0 0 #0000), var(--tw-shadow)'
+SIBLINGS = ' > :not([hidden]) ~ :not([hidden])'
+
+# A condensed Tailwind preflight plus the defaults the composable utilities rely on.
+BASE = """
+*,::before,::after{box-sizing:border-box;border-width:0;border-style:solid;border-color:#e5e7eb;
+--tw-translate-x:0;--tw-translate-y:0;--tw-rotate:0;--tw-scale-x:1;--tw-scale-y:1;
+--tw-ring-offset-width:0px;--tw-ring-offset-color:#fff;--tw-ring-color:rgb(59 130 246 / 0.5);
+--tw-ring-offset-shadow:0 0 #0000;--tw-ring-shadow:0 0 #0000;--tw-shadow:0 0 #0000}
+html{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;font-family:ui-sans-serif,system-ui,sans-serif,
+"Apple Color Emoji","Segoe UI Emoji","Segoe UI Symbol","Noto Color Emoji"}
+body{margin:0;line-height:inherit}
+hr{height:0;color:inherit;border-top-width:1px}
+h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}
+a{color:inherit;text-decoration:inherit}
+b,strong{font-weight:bolder}
+code,pre{font-family:ui-monospace,SFMono-Regular,Menlo,Monaco,Consolas,monospace;font-size:1em}
+table{text-indent:0;border-color:inherit;border-collapse:collapse}
+button,input,optgroup,select,textarea{font-family:inherit;font-size:100%;font-weight:inherit;line-height:inherit;
+color:inherit;margin:0;padding:0}
+button,select{text-transform:none}
+button,[type='button'],[type='reset'],[type='submit']{-webkit-appearance:button;background-color:transparent;
+background-image:none}
+blockquote,dl,dd,h1,h2,h3,h4,h5,h6,hr,figure,p,pre{margin:0}
+fieldset{margin:0;padding:0}
+legend{padding:0}
+ol,ul,menu{list-style:none;margin:0;padding:0}
+textarea{resize:vertical}
+input::placeholder,textarea::placeholder{opacity:1;color:#9ca3af}
+button,[role="button"]{cursor:pointer}
+:disabled{cursor:default}
+img,svg,video,canvas,audio,iframe,embed,object{display:block;vertical-align:middle}
+img,video{max-width:100%;height:auto}
+[hidden]{display:none}
+"""
+
+STATIC = {
+    'block': [('display', 'block')], 'inline': [('display', 'inline')],
+    'inline-block': [('display', 'inline-block')], 'flex': [('display', 'flex')],
+    'inline-flex': [('display', 'inline-flex')], 'grid': [('display', 'grid')],
+    'hidden': [('display', 'none')], 'table': [('display', 'table')],
+    'flex-1': [('flex', '1 1 0%')], 'flex-col': [('flex-direction', 'column')], 'flex-wrap': [('flex-wrap', 'wrap')],
+    'items-start': [('align-items', 'flex-start')], 'items-center': [('align-items', 'center')],
+    'items-end': [('align-items', 'flex-end')],
+    'justify-start': [('justify-content', 'flex-start')], 'justify-center': [('justify-content', 'center')],
+    'justify-end': [('justify-content', 'flex-end')], 'justify-between': [('justify-content', 'space-between')],
+    'static': [('position', 'static')], 'relative': [('position', 'relative')],
+    'absolute': [('position', 'absolute')], 'fixed': [('position', 'fixed')], 'sticky': [('position', 'sticky')],
+    'overflow-hidden': [('overflow', 'hidden')], 'overflow-auto': [('overflow', 'auto')],
+    'overflow-x-auto': [('overflow-x', 'auto')], 'overflow-y-auto': [('overflow-y', 'auto')],
+    'object-cover': [('object-fit', 'cover')], 'object-contain': [('object-fit', 'contain')],
+    'text-left': [('text-align', 'left')], 'text-center': [('text-align', 'center')],
+    'text-right': [('text-align', 'right')],
+    'italic': [('font-style', 'italic')], 'underline': [('text-decoration-line', 'underline')],
+    'uppercase': [('text-transform', 'uppercase')], 'lowercase': [('text-transform', 'lowercase')],
+    'capitalize': [('text-transform', 'capitalize')],
+    'truncate': [('overflow', 'hidden'), ('text-overflow', 'ellipsis'), ('white-space', 'nowrap')],
+    'whitespace-nowrap': [('white-space', 'nowrap')],
+    'antialiased': [('-webkit-font-smoothing', 'antialiased'), ('-moz-osx-font-smoothing', 'grayscale')],
+    'tracking-tight': [('letter-spacing', '-0.025em')], 'tracking-wide': [('letter-spacing', '0.025em')],
+    'tracking-wider': [('letter-spacing', '0.05em')],
+    'border-solid': [('border-style', 'solid')], 'border-dashed': [('border-style', 'dashed')],
+    'outline-none': [('outline', '2px solid transparent'), ('outline-offset', '2px')],
+    'transform': [('transform', TRANSFORM)],
+    'cursor-pointer': [('cursor', 'pointer')],
+    'resize-none': [('resize', 'none')],
+    'w-auto': [('width', 'auto')], 'h-auto': [('height', 'auto')],
+    'w-screen': [('width', '100vw')], 'h-screen': [('height', '100vh')],
+    'min-h-screen': [('min-height', '100vh')], 'min-w-full': [('min-width', '100%')],
+}
+
+# Template classes that are deliberately not styled (the Tailwind CDN never styled them either).
+UNSTYLED = {'font-inter'}
+
+# Utilities that must come after the ones they refine (as in Tailwind's property order);
+# everything else is ordered by name.
+LATE_PREFIXES = {'via-': 1, 'to-': 2, 'duration-': 1, 'ease-': 1}
+
+VARIANTS = {
+    'hover': ':hover', 'focus': ':focus', 'active': ':active', 'disabled': ':disabled',
+    'focus-within': ':focus-within', 'file': '::file-selector-button', 'placeholder': '::placeholder',
+}
+
+
+def _escape(name):
+    return re.sub(r'([^a-zA-Z0-9_-])', r'\\\1', name)
+
+
+def _spacing(value):
+    if value == 'px':
+        return '1px'
+    if value == '0':
+        return '0px'
+    if value == 'auto':
+        return 'auto'
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return f'{number / 4:g}rem'
+
+
+def _color(value):
+    """Resolve ``blue-600``, ``white/80`` or ``transparent`` to a CSS color."""
+    if value in ('transparent', 'current', 'inherit'):
+        return {'current': 'currentColor'}.get(value, value)
+    name, _, alpha = value.partition('/')
+    if name not in COLORS:
+        return None
+    hex_value = COLORS[name]
+    if not alpha:
+        return hex_value
+    r, g, b = (int(hex_value[i:i + 2], 16) for i in (1, 3, 5))
+    return f'rgb({r} {g} {b} / {int(alpha) / 100:g})'
+
+
+def _transparent(color):
+    if color.startswith('#'):
+        r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+        return f'rgb({r} {g} {b} / 0)'
+    return 'transparent'
+
+
+def _arbitrary(value):
+    if value.startswith('[') and value.endswith(']'):
+        return value[1:-1].replace('_', ' ')
+    return None
+
+
+SPACING_PROPERTIES = {
+    'p': ['padding'], 'px': ['padding-left', 'padding-right'], 'py': ['padding-top', 'padding-bottom'],
+    'pt': ['padding-top'], 'pr': ['padding-right'], 'pb': ['padding-bottom'], 'pl': ['padding-left'],
+    'm': ['margin'], 'mx': ['margin-left', 'margin-right'], 'my': ['margin-top', 'margin-bottom'],
+    'mt': ['margin-top'], 'mr': ['margin-right'], 'mb': ['margin-bottom'], 'ml': ['margin-left'],
+    'w': ['width'], 'h': ['height'], 'max-h': ['max-height'], 'min-h': ['min-height'],
+    'gap': ['gap'], 'gap-x': ['column-gap'], 'gap-y': ['row-gap'],
+    'inset': ['inset'], 'top': ['top'], 'right': ['right'], 'bottom': ['bottom'], 'left': ['left'],
+}
+COLOR_PROPERTIES = {
+    'bg': 'background-color', 'text': 'color', 'border': 'border-color',
+}
+
+
+def utility(name):
+    """
+    Return ``(declarations, selector_suffix, extra_css)`` for a utility without
+    variants, or None if it isn't one we generate.
+    """
+    negative = name.startswith('-')
+    base = name[1:] if negative else name
+
+    if base in STATIC and not negative:
+        return STATIC[base], '', ''
+
+    # Color utilities: everything after the first dash is the color (``bg-blue-600``, ``bg-white/80``).
+    head, _, rest = base.partition('-')
+    color = None if negative else _color(rest)
+    if color is not None:
+        if head in COLOR_PROPERTIES:
+            return [(COLOR_PROPERTIES[head], color)], '', ''
+        if head == 'divide':
+            return [('border-color', color)], SIBLINGS, ''
+        if head == 'ring':
+            return [('--tw-ring-color', color)], '', ''
+        if head == 'placeholder':
+            return [('color', color)], '::placeholder', ''
+        if head == 'from':
+            return [
+                ('--tw-gradient-from', color), ('--tw-gradient-to', _transparent(color)),
+                ('--tw-gradient-stops', 'var(--tw-gradient-from), var(--tw-gradient-to)'),
+            ], '', ''
+        if head == 'via':
+            return [
+                ('--tw-gradient-to', _transparent(color)),
+                ('--tw-gradient-stops', f'var(--tw-gradient-from), {color}, var(--tw-gradient-to)'),
+            ], '', ''
+        if head == 'to':
+            return [('--tw-gradient-to', color)], '', ''
+        return None
+
+    prefix, _, value = base.rpartition('-')
+    # Two-part prefixes such as max-w, gap-x, ring-offset, space-x.
+    for candidate in ('max-w', 'max-h', 'min-h', 'gap-x', 'gap-y', 'space-x', 'space-y', 'ring-offset',
+                      'grid-cols', 'bg-gradient-to', 'border-l', 'border-r', 'border-t', 'border-b'):
+        if base.startswith(candidate + '-'):
+            prefix, value = candidate, base[len(candidate) + 1:]
+            break
+
+    if prefix in SPACING_PROPERTIES:
+        if prefix in ('w', 'h', 'max-h', 'min-h') and value == 'full':
+            size = '100%'
+        else:
+            size = _spacing(value)
+        if size is None:
+            return None
+        if negative:
+            size = f'-{size}'
+        return [(prop, size) for prop in SPACING_PROPERTIES[prefix]], '', ''
+
+    if negative:
+        if prefix == 'z' and value.isdigit():
+            return [('z-index', f'-{value}')], '', ''
+        return None
+
+    if prefix in ('space-x', 'space-y'):
+        size = _spacing(value)
+        if size is None:
+            return None
+        return [('margin-left' if prefix == 'space-x' else 'margin-top', size)], SIBLINGS, ''
+    if prefix == 'max-w' and value in MAX_WIDTHS:
+        return [('max-width', MAX_WIDTHS[value])], '', ''
+    if prefix == 'grid-cols' and value.isdigit():
+        return [('grid-template-columns', f'repeat({value}, minmax(0, 1fr))')], '', ''
+    if prefix == 'z' and value.isdigit():
+        return [('z-index', value)], '', ''
+    if prefix == 'opacity' and value.isdigit():
+        return [('opacity', f'{int(value) / 100:g}')], '', ''
+    if prefix == 'duration' and value.isdigit():
+        return [('transition-duration', f'{value}ms')], '', ''
+    if prefix == 'ease' or base.startswith('ease-'):
+        easing = EASINGS.get(base[len('ease-'):])
+        return ([('transition-timing-function', easing)], '', '') if easing else None
+
+    if base == 'transition' or prefix == 'transition':
+        key = '' if base == 'transition' else value
+        if key not in TRANSITIONS:
+            return None
+        return [
+            ('transition-property', TRANSITIONS[key]),
+            ('transition-timing-function', 'cubic-bezier(0.4, 0, 0.2, 1)'),
+            ('transition-duration', '150ms'),
+        ], '', ''
+    # Animation names may contain dashes (``animate-slide-down``).
+    if base.startswith('animate-') and base[len('animate-'):] in ANIMATIONS:
+        animation, keyframes = ANIMATIONS[base[len('animate-'):]]
+        return [('animation', animation)], '', keyframes
+
+    if base == 'rounded' or prefix == 'rounded':
+        key = '' if base == 'rounded' else value
+        return ([('border-radius', RADII[key])], '', '') if key in RADII else None
+    if base == 'shadow' or prefix == 'shadow':
+        key = '' if base == 'shadow' else value
+        if key not in SHADOWS:
+            return None
+        return [('--tw-shadow', SHADOWS[key]), ('box-shadow', BOX_SHADOW)], '', ''
+    if base.startswith('backdrop-blur'):
+        key = base[len('backdrop-blur-'):] if base != 'backdrop-blur' else ''
+        return ([('backdrop-filter', f'blur({BLURS[key]})')], '', '') if key in BLURS else None
+
+    if prefix == 'text' and value in FONT_SIZES:
+        size, line_height = FONT_SIZES[value]
+        return [('font-size', size), ('line-height', line_height)], '', ''
+    if prefix == 'font':
+        if value in FONT_WEIGHTS:
+            return [('font-weight', FONT_WEIGHTS[value])], '', ''
+        family = _arbitrary(value)
+        return ([('font-family', family)], '', '') if family else None
+
+    if base == 'border':
+        return [('border-width', '1px')], '', ''
+    if prefix == 'border' and value.isdigit():
+        return [('border-width', f'{value}px')], '', ''
+    sides = {'border-l': 'left', 'border-r': 'right', 'border-t': 'top', 'border-b': 'bottom'}
+    if base in sides:
+        return [(f'border-{sides[base]}-width', '1px')], '', ''
+    if prefix in sides and value.isdigit():
+        return [(f'border-{sides[prefix]}-width', f'{value}px')], '', ''
+    if base in ('divide-y', 'divide-x'):
+        if base == 'divide-y':
+            return [('border-top-width', '1px'), ('border-bottom-width', '0')], SIBLINGS, ''
+        return [('border-left-width', '1px'), ('border-right-width', '0')], SIBLINGS, ''
+
+    if base == 'ring' or (prefix == 'ring' and value.isdigit()):
+        width = '3px' if base == 'ring' else f'{value}px'
+        return [
+            ('--tw-ring-offset-shadow', 'var(--tw-ring-inset,) 0 0 0 var(--tw-ring-offset-width) var(--tw-ring-offset-color)'),
+            ('--tw-ring-shadow', f'var(--tw-ring-inset,) 0 0 0 calc({width} + var(--tw-ring-offset-width)) var(--tw-ring-color)'),
+            ('box-shadow', BOX_SHADOW),
+        ], '', ''
+    if prefix == 'ring-offset' and value.isdigit():
+        return [('--tw-ring-offset-width', f'{value}px')], '', ''
+
+    if prefix == 'bg-gradient-to' and value in GRADIENT_DIRECTIONS:
+        return [('background-image', f'linear-gradient(to {GRADIENT_DIRECTIONS[value]}, var(--tw-gradient-stops))')], '', ''
+
+    if prefix == 'scale':
+        amount = _arbitrary(value) or (f'{int(value) / 100:g}' if value.isdigit() else None)
+        if amount is None:
+            return None
+        return [('--tw-scale-x', amount), ('--tw-scale-y', amount), ('transform', TRANSFORM)], '', ''
+    if prefix == 'rotate':
+        angle = _arbitrary(value) or (f'{value}deg' if value.isdigit() else None)
+        return ([('--tw-rotate', angle), ('transform', TRANSFORM)], '', '') if angle else None
+
+    return None
+
+
+def _split_variants(candidate):
+    parts, depth, current = [], 0, ''
+    for char in candidate:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == ':' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    return parts, current
+
+
+def rule(candidate):
+    """Return ``(sort_key, screen, css, keyframes)`` for one class name, or None."""
+    variants, name = _split_variants(candidate)
+    generated = utility(name)
+    if generated is None:
+        return None
+    declarations, suffix, extra = generated
+
+    media = None
+    pseudo = ''
+    for variant in variants:
+        if variant in SCREENS and media is None:
+            media = variant
+        elif variant in VARIANTS:
+            pseudo += VARIANTS[variant]
+        else:
+            return None
+    # Pseudo-elements (::file-selector-button) must follow pseudo-classes (:hover).
+    pseudo_classes = ''.join(p for p in re.findall(r'::?[a-z-]+', pseudo) if not p.startswith('::'))
+    pseudo_elements = ''.join(p for p in re.findall(r'::?[a-z-]+', pseudo) if p.startswith('::'))
+    if suffix.startswith('::'):
+        pseudo_elements += suffix
+        suffix = ''
+
+    selector = f'.{_escape(candidate)}{pseudo_classes}{pseudo_elements}{suffix}'
+    body = ';'.join(f'{prop}:{value}' for prop, value in declarations)
+    css = f'{selector}{{{body}}}'
+    screen_order = list(SCREENS).index(media) + 1 if media else 0
+    late = next((rank for prefix, rank in LATE_PREFIXES.items() if name.startswith(prefix)), 0)
+    return (screen_order, len(variants), late, candidate), media, css, extra
+
+
+_CANDIDATE_RE = re.compile(r"-?(?:[a-z0-9][a-z0-9:/.\-]*|\[[^\]\s]+\])(?:[a-z0-9:/.\-]+|\[[^\]\s]+\])*", re.I)
+
+
+def scan(paths):
+    """Every class-like token in the given files (class attributes, JS strings, template conditionals)."""
+    candidates = set()
+    for path in paths:
+        candidates.update(_CANDIDATE_RE.findall(Path(path).read_text(encoding='utf-8')))
+    return candidates
+
+
+def template_files():
+    files = []
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        # Admin overrides are styled by the admin theme and never load app.css.
+        files.extend(path for path in sorted(Path(directory).rglob('*.html'))
+                     if path.relative_to(directory).parts[0] != 'admin')
+    return files
+
+
+def build(paths=None):
+    """Return ``(css, class_names)`` for the templates (or ``paths``)."""
+    rules, keyframes = [], set()
+    for candidate in scan(paths if paths is not None else template_files()):
+        generated = rule(candidate)
+        if generated is not None:
+            sort_key, media, css, extra = generated
+            rules.append((sort_key, candidate, media, css))
+            if extra:
+                keyframes.add(extra)
+    rules.sort(key=lambda item: item[0])
+
+    # One @media block per breakpoint, after the unconditional rules.
+    blocks = {}
+    for _, _, media, css in rules:
+        blocks.setdefault(media, []).append(css)
+    output = [re.sub(r'\s*\n\s*', '', BASE.strip())] + sorted(keyframes) + blocks.pop(None, [])
+    for media, block in blocks.items():
+        output.append(f'@media (min-width:{SCREENS[media]}){{{"".join(block)}}}')
+    return ''.join(output) + '\n', sorted(candidate for _, candidate, _, _ in rules)
+
+
+def output_path():
+    return Path(settings.STATICFILES_DIRS[0]) / OUTPUT
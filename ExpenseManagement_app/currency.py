@@ -0,0 +1,58 @@
+import logging
+import re
+from decimal import Decimal, InvalidOperation
+
+from .http_client import OutboundHTTPError, aget_json, get_json
+
+logger = logging.getLogger(__name__)
+
+_CURRENCY_CODE_RE = re.compile(r'[A-Z]{3}')
+
+
+def _rates_path(currency):
+    # The code ends up in the provider URL, so nothing but an ISO 4217 code gets through.
+    if not isinstance(currency, str) or not _CURRENCY_CODE_RE.fullmatch(currency):
+        raise ValueError(f'Not a currency code: {currency!r}')
+    return f'/v4/latest/{currency}'
+
+
+def convert_currency_strict(amount, from_currency, to_currency):
+    """
+    Convert ``amount``, raising ``OutboundHTTPError`` if the provider has no
+    usable rate and ``ValueError`` for a malformed currency code.
+    """
+    if from_currency == to_currency:
+        return Decimal(amount)
+
+    data = get_json('exchange_rates', _rates_path(from_currency))
+    try:
+        rate = data['rates'][to_currency]
+        return Decimal(amount) * Decimal(str(rate))
+    except (KeyError, TypeError, AttributeError, InvalidOperation) as e:
+        raise OutboundHTTPError(f'No {from_currency} to {to_currency} rate in the provider response') from e
+
+
+def convert_currency(amount, from_currency, to_currency):
+    """Best-effort conversion for display: falls back to the unconverted amount."""
+    try:
+        return convert_currency_strict(amount, from_currency, to_currency)
+    except (OutboundHTTPError, ValueError) as e:
+        logger.warning('Could not convert %s to %s: %s', from_currency, to_currency, e)
+        return Decimal(amount)
+
+
+async def aconvert_currency(amount, from_currency, to_currency):
+    """
+    Async conversion for async views. Returns None instead of the unconverted
+    amount when the provider fails, so the task worker can convert it later.
+    """
+    if from_currency == to_currency:
+        return Decimal(amount)
+
+    try:
+        data = await aget_json('exchange_rates', _rates_path(from_currency))
+        rate = data['rates'][to_currency]
+        return Decimal(amount) * Decimal(str(rate))
+    except (OutboundHTTPError, KeyError, TypeError, AttributeError, InvalidOperation, ValueError) as e:
+        logger.warning('Could not convert %s to %s, deferring: %s', from_currency, to_currency, e)
+        return None
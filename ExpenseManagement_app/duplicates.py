@@ -0,0 +1,133 @@
+"""
+Double-claim detection.
+
+Two independent probes run when an expense is submitted:
+
+* ``check_same_details`` - another expense by the same employee with the same
+  date, amount and merchant (index ``expense_claim_probe_idx``).
+* ``fingerprint_receipt`` - a receipt image whose perceptual hash is within
+  ``MAX_DISTANCE`` bits of this one anywhere in the company, found through the
+  banded ``ReceiptFingerprint`` indexes rather than by comparing every receipt.
+  Archived receipts keep their fingerprints (``ArchivedReceiptFingerprint``)
+  and are searched the same way.
+
+Matches are stored as ``DuplicateFlag`` rows and shown to approvers.
+"""
+from django.db.models import Q
+
+from .models import ArchivedReceiptFingerprint, DuplicateFlag, Expense, ReceiptFingerprint
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+# Pigeonhole: with 4 bands, hashes differing in at most 3 bits share a band.
+MAX_DISTANCE = BANDS - 1
+
+
+def dhash(fileobj):
+    """64-bit difference hash: brightness gradient across a 9x8 greyscale thumbnail."""
+    from PIL import Image
+
+    with Image.open(fileobj) as image:
+        image.draft('L', (64, 64))
+        pixels = list(image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def to_signed(value):
+    """Fit an unsigned 64-bit hash into a signed BigIntegerField."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * i)) & mask for i in range(BANDS)]
+
+
+def hamming(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def find_similar(company_id, value, exclude_expense_id=None, max_distance=MAX_DISTANCE):
+    """
+    Return ``[(expense_id, distance)]`` for receipts within ``max_distance``
+    bits, hot or archived (both keep the expense's id).
+    """
+    matches = _similar(company_id, value, exclude_expense_id, max_distance)
+    return [(expense_id, distance) for expense_id, distance, _ in matches]
+
+
+def _similar(company_id, value, exclude_expense_id, max_distance):
+    condition = Q()
+    for i, band in enumerate(bands(value)):
+        condition |= Q(**{f'band{i}': band})
+
+    matches = []
+    for model, archived in ((ReceiptFingerprint, False), (ArchivedReceiptFingerprint, True)):
+        candidates = model.objects.filter(condition, company_id=company_id)
+        if exclude_expense_id is not None:
+            candidates = candidates.exclude(expense_id=exclude_expense_id)
+        for expense_id, phash in candidates.values_list('expense_id', 'phash'):
+            distance = hamming(value, phash)
+            if distance <= max_distance:
+                matches.append((expense_id, distance, archived))
+    return sorted(matches, key=lambda match: match[1])
+
+
+def fingerprint_receipt(expense):
+    """Hash ``expense``'s receipt, index it and flag near-identical receipts. Safe to re-run."""
+    if not expense.receipt_image:
+        return []
+
+    with expense.receipt_image.open('rb') as f:
+        value = dhash(f)
+
+    band_values = bands(value)
+    ReceiptFingerprint.objects.update_or_create(
+        expense=expense,
+        defaults={
+            'company_id': expense.company_id,
+            'phash': to_signed(value),
+            **{f'band{i}': band for i, band in enumerate(band_values)},
+        },
+    )
+
+    matches = _similar(expense.company_id, value, expense.id, MAX_DISTANCE)
+    for duplicate_id, distance, archived in matches:
+        DuplicateFlag.objects.get_or_create(
+            expense=expense, reason='similar_receipt', defaults={'distance': distance},
+            **{'archived_duplicate_of_id' if archived else 'duplicate_of_id': duplicate_id},
+        )
+    return [(duplicate_id, distance) for duplicate_id, distance, _ in matches]
+
+
+def check_same_details(expense):
+    """Flag earlier expenses with the same employee, date, amount and merchant."""
+    if not expense.employee_id:
+        return []
+
+    duplicate_ids = list(
+        Expense.objects.filter(
+            employee_id=expense.employee_id,
+            expense_date=expense.expense_date,
+            amount=expense.amount,
+            merchant_name__iexact=expense.merchant_name,
+            id__lt=expense.id,
+        ).values_list('id', flat=True)
+    )
+    for duplicate_id in duplicate_ids:
+        DuplicateFlag.objects.get_or_create(
+            expense=expense, duplicate_of_id=duplicate_id, reason='same_details',
+        )
+    return duplicate_ids
@@ -0,0 +1,152 @@
+"""
+Escalation of approvals that have waited longer than their company's SLA.
+
+A pending approval whose SLA clock (``sla_started_at``) is older than
+``Company.approval_sla_hours`` is marked 'escalated' and a new pending approval
+for the same step goes to the approver's manager or, failing that, to the
+rule's ``specific_approver``. The new row points back through
+``escalated_from`` and starts its own SLA clock, so a chain of absent
+approvers keeps moving up.
+
+Under a sequential rule a step's clock starts when the step before it is
+approved (``views.approve_expense``), and a step still waiting on an earlier
+one is not escalated. Such a row, or one with nobody to hand it to, has its
+clock restarted instead and is looked at again one SLA later.
+
+The scan walks the (status, sla_started_at) index from the oldest pending row
+up to the cutoff, one keyset batch at a time, once per distinct SLA value. It
+only reads overdue rows, and every row it reads leaves the overdue range, so a
+run's cost follows the overdue backlog rather than the table size.
+"""
+from datetime import timedelta
+
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from . import changefeed, sharding
+from .models import Company, ExpenseApproval
+from .notifications import notify_pending_approvals
+
+
+def overdue_approvals(sla_hours, now=None):
+    """Pending approvals in companies with this SLA whose clock started longer ago than it."""
+    cutoff = (now or timezone.now()) - timedelta(hours=sla_hours)
+    return ExpenseApproval.objects.filter(
+        status='pending', sla_started_at__lt=cutoff, expense__company__approval_sla_hours=sla_hours,
+    )
+
+
+def waiting_on_earlier_steps(approvals):
+    """Ids of the ``approvals`` that a sequential rule does not let their approver act on yet."""
+    sequential = {
+        approval.expense_id for approval in approvals
+        if approval.expense.approval_rule and approval.expense.approval_rule.rule_type == 'sequential'
+    }
+    # The lowest step that is neither approved nor replaced by an escalation, as in approve_expense.
+    first_open = dict(
+        ExpenseApproval.objects.filter(expense_id__in=sequential)
+        .exclude(status__in=['approved', 'escalated'])
+        .values('expense_id').annotate(step=Min('step_number')).values_list('expense_id', 'step')
+    ) if sequential else {}
+    return {
+        approval.id for approval in approvals
+        if approval.expense_id in first_open and approval.step_number > first_open[approval.expense_id]
+    }
+
+
+def escalation_target(approval):
+    """Who takes over ``approval``: the approver's manager, else the rule's specific approver."""
+    expense = approval.expense
+    rule = expense.approval_rule
+    candidates = [
+        approval.approver.manager_id if approval.approver else None,
+        rule.specific_approver_id if rule else None,
+    ]
+    for candidate in candidates:
+        # Never back to the same person, and never to the employee who claimed it.
+        if candidate and candidate not in (approval.approver_id, expense.employee_id):
+            return candidate
+    return None
+
+
+def escalate_batch(sla_hours, now=None, after=None, batch_size=500):
+    """
+    Escalate up to ``batch_size`` overdue approvals that sort after ``after``
+    (a ``(sla_started_at, id)`` cursor), and restart the clock of those that
+    cannot be escalated. Returns ``(scanned, escalated, cursor)``; ``scanned``
+    is 0 when the overdue range is exhausted.
+    """
+    now = now or timezone.now()
+    with sharding.atomic():
+        approvals = overdue_approvals(sla_hours, now)
+        if after is not None:
+            approvals = approvals.filter(
+                Q(sla_started_at__gt=after[0]) | Q(sla_started_at=after[0], id__gt=after[1])
+            )
+        approvals = list(
+            approvals.select_related('approver', 'expense__approval_rule')
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('sla_started_at', 'id')[:batch_size]
+        )
+        if not approvals:
+            return 0, 0, after
+
+        waiting = waiting_on_earlier_steps(approvals)
+        targets = {
+            approval.id: None if approval.id in waiting else escalation_target(approval) for approval in approvals
+        }
+        # (expense, approver, step) is unique: skip targets already on that step.
+        taken = set(
+            ExpenseApproval.objects.filter(
+                expense_id__in={approval.expense_id for approval in approvals},
+                approver_id__in={target for target in targets.values() if target},
+            ).values_list('expense_id', 'approver_id', 'step_number')
+        )
+
+        escalated, replacements, parked = [], [], []
+        for approval in approvals:
+            key = (approval.expense_id, targets[approval.id], approval.step_number)
+            if targets[approval.id] is None or key in taken:
+                parked.append(approval)
+                continue
+            taken.add(key)
+            approval.status = 'escalated'
+            escalated.append(approval)
+            replacements.append(ExpenseApproval(
+                expense=approval.expense,
+                approver_id=key[1],
+                step_number=approval.step_number,
+                escalated_from=approval,
+            ))
+
+        # The cursor is where this batch ended in (sla_started_at, id) order, before any clock restarts.
+        last = approvals[-1]
+        cursor = (last.sla_started_at, last.id)
+        for approval in parked:
+            approval.sla_started_at = now
+        ExpenseApproval.objects.bulk_update(escalated, ['status'])
+        ExpenseApproval.objects.filter(id__in=[approval.id for approval in parked]).update(sla_started_at=now)
+        ExpenseApproval.objects.bulk_create(replacements)
+        notify_pending_approvals(replacements)
+        changefeed.record_many(escalated + parked, 'updated')
+        changefeed.record_many(replacements, 'created')
+
+    return len(approvals), len(escalated), cursor
+
+
+def escalate_stale_approvals(now=None, batch_size=500, max_batches=None, on_batch=None):
+    """Escalate every overdue approval on the current shard. Returns the number escalated."""
+    now = now or timezone.now()
+    total = batches = 0
+    sla_values = Company.objects.values_list('approval_sla_hours', flat=True).distinct().order_by()
+    for sla_hours in sorted(sla_values):
+        after = None
+        while max_batches is None or batches < max_batches:
+            scanned, escalated, after = escalate_batch(sla_hours, now, after, batch_size)
+            if not scanned:
+                break
+            total += escalated
+            batches += 1
+            if on_batch:
+                on_batch(sla_hours, scanned, escalated)
+    return total
@@ -0,0 +1,326 @@
+"""
+Shared client for outbound HTTP calls.
+
+Every call to a third-party API goes through ``get_json`` so that it gets:
+
+* one pooled ``requests.Session`` per process (connections are reused),
+* per-endpoint connect/read timeouts,
+* bounded retries for idempotent requests on connection errors and 5xx,
+* a per-host circuit breaker that fails fast while a provider is down
+  (only timeouts, connection errors and 5xx count against it; a 4xx or an
+  unparseable body is the caller's problem, not a sign the host is down),
+* per-host latency/error metrics (``get_metrics``).
+
+``aget_json`` is the async counterpart used by async views. It shares the
+breakers and metrics and uses one pooled ``httpx.AsyncClient`` per event loop,
+closed when that loop shuts down; without httpx installed it falls back to
+running ``get_json`` in a thread.
+
+``requests`` and ``httpx`` are only imported when the first call is made.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINTS = {
+    'exchange_rates': {
+        'base_url': 'https://api.exchangerate-api.com',
+        'connect_timeout': 2.0,
+        'read_timeout': 5.0,
+    },
+    'restcountries': {
+        'base_url': 'https://restcountries.com',
+        'connect_timeout': 3.0,
+        'read_timeout': 15.0,
+    },
+}
+
+POOL_MAXSIZE = 20
+MAX_RETRIES = 2
+RETRY_BACKOFF_FACTOR = 0.2
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+
+class OutboundHTTPError(Exception):
+    """An outbound call failed: timeout, connection error, bad status or bad body."""
+
+
+class CircuitOpenError(OutboundHTTPError):
+    """The host has failed repeatedly and calls are being short-circuited."""
+
+
+class CircuitBreaker:
+    """Closed -> open after N consecutive failures; one trial call after the reset timeout."""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """Raise ``CircuitOpenError`` if the call must not be made; return True if it is the half-open trial."""
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self._trial_in_flight):
+                raise CircuitOpenError('circuit open')
+            if state == 'half-open':
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a trial call that said nothing about the host's health, so another call may try."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class HostMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.short_circuited = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = deque(maxlen=500)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.calls += 1
+            self.errors += 0 if ok else 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.recent.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self.recent)
+            p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'short_circuited': self.short_circuited,
+                'avg_ms': self.total_seconds / self.calls * 1000 if self.calls else 0.0,
+                'p95_ms': p95 * 1000,
+                'max_ms': self.max_seconds * 1000,
+            }
+
+
+_session = None
+_async_clients = weakref.WeakKeyDictionary()
+_breakers = {}
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _endpoint(name):
+    config = dict(DEFAULT_ENDPOINTS.get(name, {}))
+    config.update(getattr(settings, 'OUTBOUND_HTTP_ENDPOINTS', {}).get(name, {}))
+    return config
+
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(
+                    total=MAX_RETRIES,
+                    backoff_factor=RETRY_BACKOFF_FACTOR,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _host_state(host):
+    with _lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+            _metrics[host] = HostMetrics()
+        return _breakers[host], _metrics[host]
+
+
+def _server_error(error):
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
+
+
+def get_json(endpoint, path='', params=None, url=None):
+    """
+    GET ``path`` on a configured endpoint (or an absolute ``url``) and return the decoded JSON.
+
+    Raises ``OutboundHTTPError`` on any failure, ``CircuitOpenError`` without
+    touching the network while the host's breaker is open.
+    """
+    import requests
+
+    config = _endpoint(endpoint)
+    url = url or config['base_url'].rstrip('/') + path
+    host = urlsplit(url).netloc
+    breaker, metrics = _host_state(host)
+
+    try:
+        is_trial = breaker.before_call()
+    except CircuitOpenError:
+        with metrics._lock:
+            metrics.short_circuited += 1
+        raise CircuitOpenError(f'{host} is failing; not calling {url}')
+
+    started = time.monotonic()
+    try:
+        response = get_session().get(
+            url, params=params, timeout=(config['connect_timeout'], config['read_timeout'])
+        )
+        response.raise_for_status()
+        data = response.json()
+    except (requests.RequestException, ValueError) as e:
+        metrics.record(time.monotonic() - started, ok=False)
+        if isinstance(e, (requests.ConnectionError, requests.Timeout)) or _server_error(e):
+            breaker.record_failure()
+        logger.warning('Outbound call to %s failed: %s', url, e)
+        raise OutboundHTTPError(f'{url}: {e}') from e
+    else:
+        metrics.record(time.monotonic() - started, ok=True)
+        breaker.record_success()
+        return data
+    finally:
+        # Nothing to do after record_*; after a 4xx or an exception not caught
+        # above, the trial slot would otherwise stay taken and the breaker
+        # would never close again.
+        if is_trial:
+            breaker.release_trial()
+
+
+async def _close_on_loop_shutdown(client):
+    # Parked at the yield for the loop's lifetime. asyncio.run() (which is also
+    # how asgiref runs async views under WSGI) finalizes async generators
+    # before closing the loop, which runs this finally inside the loop.
+    try:
+        yield
+    finally:
+        await client.aclose()
+        _async_clients.pop(asyncio.get_running_loop(), None)
+
+
+async def _get_async_client():
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+            transport=httpx.AsyncHTTPTransport(retries=MAX_RETRIES),
+        )
+        closer = _close_on_loop_shutdown(client)
+        await closer.__anext__()
+        # The loop only holds async generators weakly; the entry keeps this one alive.
+        entry = _async_clients[loop] = (client, closer)
+    return entry[0]
+
+
+async def aget_json(endpoint, path='', params=None, url=None):
+    """Async ``get_json``: same timeouts, breaker and metrics, without blocking the event loop."""
+    try:
+        import httpx
+    except ImportError:
+        from asgiref.sync import sync_to_async
+        return await sync_to_async(get_json, thread_sensitive=False)(endpoint, path, params, url)
+
+    config = _endpoint(endpoint)
+    url = url or config['base_url'].rstrip('/') + path
+    host = urlsplit(url).netloc
+    breaker, metrics = _host_state(host)
+
+    try:
+        is_trial = breaker.before_call()
+    except CircuitOpenError:
+        with metrics._lock:
+            metrics.short_circuited += 1
+        raise CircuitOpenError(f'{host} is failing; not calling {url}')
+
+    timeout = httpx.Timeout(config['read_timeout'], connect=config['connect_timeout'])
+    started = time.monotonic()
+    try:
+        client = await _get_async_client()
+        response = await client.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        metrics.record(time.monotonic() - started, ok=False)
+        if isinstance(e, httpx.TransportError) or _server_error(e):
+            breaker.record_failure()
+        logger.warning('Outbound call to %s failed: %s', url, e)
+        raise OutboundHTTPError(f'{url}: {e}') from e
+    else:
+        metrics.record(time.monotonic() - started, ok=True)
+        breaker.record_success()
+        return data
+    finally:
+        # Also runs when the request is cancelled.
+        if is_trial:
+            breaker.release_trial()
+
+
+def get_metrics():
+    """Per-host call counts and latencies since process start."""
+    with _lock:
+        hosts = list(_metrics.items())
+    return {host: metrics.snapshot() for host, metrics in hosts}
+
+
+def reset():
+    """Drop the session, breakers and metrics (used by tests)."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _async_clients.clear()
+        _breakers.clear()
+        _metrics.clear()
@@ -0,0 +1,126 @@
+"""
+Cached identity for authenticated requests.
+
+``CachedIdentityBackend`` loads the session user together with their company
+and manager in one query and keeps that bundle in the cache, so views can read
+``request.user.company`` and ``request.user.manager`` without further queries,
+and a warm request needs none at all.
+
+Invalidation is by version: saving or deleting a user or a company stores a
+new random version under ``identity:v:<kind>:<id>``. A cached bundle remembers
+the versions of its user, company and manager and is discarded when any of
+them differs. ``IDENTITY_CACHE_TIMEOUT`` bounds how long an entry can outlive
+a change the signals cannot see (``QuerySet.update``).
+
+A local-memory cache is private to its process and never sees another
+process's invalidations, so with one the backend only caches when the
+``SINGLE_PROCESS`` setting is true, and otherwise loads the user every time.
+
+With several shards a login names no company, so ``authenticate`` first finds
+the shard that has the username (see sharding.py).
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import sharding
+from .models import Company, CustomUser
+
+
+def _cache():
+    return caches[getattr(settings, 'IDENTITY_CACHE_ALIAS', 'default')]
+
+
+def _cache_is_safe(cache):
+    return not isinstance(cache, LocMemCache) or getattr(settings, 'SINGLE_PROCESS', False)
+
+
+def _load_user(user_id):
+    return CustomUser._default_manager.select_related('company', 'manager').filter(pk=user_id).first()
+
+
+def _bundle_key(user_id):
+    return f'identity:user:{user_id}'
+
+
+def _version_key(kind, object_id):
+    return f'identity:v:{kind}:{object_id}'
+
+
+def _versions(cache, user_id, company_id, manager_id):
+    keys = [
+        _version_key('user', user_id),
+        _version_key('company', company_id) if company_id else None,
+        _version_key('user', manager_id) if manager_id else None,
+    ]
+    found = cache.get_many([key for key in keys if key])
+    return tuple(found.get(key) for key in keys)
+
+
+def bump(kind, object_id):
+    """Invalidate every cached identity that includes this user or company."""
+    # A random version, not a counter: a counter that was evicted would restart
+    # at a value some stale bundle may still carry.
+    _cache().set(_version_key(kind, object_id), uuid.uuid4().hex, None)
+
+
+class CachedIdentityBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if not sharding.is_sharded():
+            return super().authenticate(request, username, password, **kwargs)
+        lookup = username if username is not None else kwargs.get(CustomUser.USERNAME_FIELD)
+        user = sharding.find_user(**{CustomUser.USERNAME_FIELD: lookup}) if lookup else None
+        # An unknown username still goes through ModelBackend, which hashes the
+        # password anyway so the response takes as long as for a known one.
+        with sharding.using_shard(user._state.db if user else 'default'):
+            return super().authenticate(request, username, password, **kwargs)
+
+    def get_user(self, user_id):
+        cache = _cache()
+        if not _cache_is_safe(cache):
+            user = _load_user(user_id)
+            return user if user is not None and self.user_can_authenticate(user) else None
+
+        cached = cache.get(_bundle_key(user_id))
+        if cached is not None:
+            stamp, user = cached
+            if stamp == _versions(cache, user.pk, user.company_id, user.manager_id):
+                return user if self.user_can_authenticate(user) else None
+
+        user = _load_user(user_id)
+        if user is None:
+            return None
+        stamp = _versions(cache, user.pk, user.company_id, user.manager_id)
+        cache.set(_bundle_key(user_id), (stamp, user), getattr(settings, 'IDENTITY_CACHE_TIMEOUT', 300))
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
+
+
+def _invalidate(kind, object_id, using):
+    bump(kind, object_id)
+    # Signals fire before commit; bumping again afterwards keeps a concurrent
+    # request from caching the old row it read in between under the new version.
+    transaction.on_commit(lambda: bump(kind, object_id), using=using)
+
+
+def _on_user_change(sender, instance, using, **kwargs):
+    _invalidate('user', instance.pk, using)
+
+
+def _on_company_change(sender, instance, using, **kwargs):
+    _invalidate('company', instance.pk, using)
+
+
+def connect_signals():
+    post_save.connect(_on_user_change, sender=CustomUser, dispatch_uid='identity_user_save')
+    post_delete.connect(_on_user_change, sender=CustomUser, dispatch_uid='identity_user_delete')
+    post_save.connect(_on_company_change, sender=Company, dispatch_uid='identity_company_save')
+    post_delete.connect(_on_company_change, sender=Company, dispatch_uid='identity_company_delete')
@@ -0,0 +1,184 @@
+"""
+Concurrent submission load test: the same app under an ASGI and a WSGI server.
+
+Each run starts a local stub rate provider with a fixed latency, a scratch
+SQLite database, and one server process pointed at both through environment
+overrides (``EXPENSE_DB_NAME``, ``OUTBOUND_HTTP_ENDPOINTS``). Concurrent
+expense submissions are then driven through the real HTTP stack with httpx.
+
+uvicorn (ASGI), gunicorn (WSGI) and httpx are only needed to run this; they are
+imported or executed on demand.
+"""
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+USERNAME = 'loadtest'
+PASSWORD = 'loadtest-password'
+
+_SETUP_SCRIPT = """
+import django, os
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+django.setup()
+from django.core.management import call_command
+call_command('migrate', verbosity=0)
+from django.db import connection
+with connection.cursor() as cursor:
+    # Persistent: readers no longer block the writer, as on a server database.
+    cursor.execute('PRAGMA journal_mode=WAL')
+from ExpenseManagement_app.models import Company, CustomUser
+company = Company.objects.create(name='Load Test Ltd', country='India', currency='INR')
+CustomUser.objects.create_user({username!r}, password={password!r}, company=company, role='employee')
+"""
+
+
+class StubRateProvider(ThreadingHTTPServer):
+    """Stands in for the exchange-rate API, answering every request after ``latency`` seconds."""
+
+    daemon_threads = True
+
+    def __init__(self, latency):
+        self.latency = latency
+        super().__init__(('127.0.0.1', 0), _StubRateHandler)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class _StubRateHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = json.dumps({'base': self.path.rsplit('/', 1)[-1], 'rates': {'INR': 83.5, 'USD': 1.0}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _server_command(server, port, threads):
+    if server == 'asgi':
+        return [
+            sys.executable, '-m', 'uvicorn', 'ExpenseManagement_project.asgi:application',
+            '--host', '127.0.0.1', '--port', str(port), '--workers', '1', '--log-level', 'warning',
+        ]
+    return [
+        sys.executable, '-m', 'gunicorn', 'ExpenseManagement_project.wsgi:application',
+        '--bind', f'127.0.0.1:{port}', '--workers', '1', '--threads', str(threads),
+        '--worker-class', 'gthread', '--log-level', 'warning',
+    ]
+
+
+def _wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not listen on port {port} within {timeout:.0f}s')
+
+
+async def _drive(base_url, total, concurrency):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        await client.get('/')
+        response = await client.post('/', data={
+            'username': USERNAME, 'password': PASSWORD,
+            'csrfmiddlewaretoken': client.cookies['csrftoken'],
+        })
+        if 'sessionid' not in client.cookies:
+            raise RuntimeError(f'login failed ({response.status_code})')
+        headers = {'X-CSRFToken': client.cookies['csrftoken']}
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        failures = 0
+
+        async def submit(i):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post('/submit-expense/', headers=headers, data={
+                    'amount': '12.50', 'currency': 'USD', 'category': 'travel',
+                    'description': f'load test {i}', 'merchant_name': 'Stub Cabs',
+                    'expense_date': '2025-01-15',
+                })
+                if response.status_code == 302:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(submit(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'ok': len(latencies),
+        'failed': failures,
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0.0,
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000 if latencies else 0.0,
+    }
+
+
+def run_loadtest(server='asgi', total=200, concurrency=50, fx_latency=0.2, threads=8):
+    """Start the stub provider and one ``server`` process, drive ``total`` submissions and return the numbers."""
+    stub = StubRateProvider(fx_latency)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    port = _free_port()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+            EXPENSE_DB_NAME=os.path.join(tmp, 'loadtest.sqlite3'),
+            OUTBOUND_HTTP_ENDPOINTS=json.dumps({'exchange_rates': {'base_url': stub.base_url}}),
+        )
+        subprocess.run(
+            [sys.executable, '-c', _SETUP_SCRIPT.format(
+                settings_module=settings.SETTINGS_MODULE, username=USERNAME, password=PASSWORD,
+            )],
+            cwd=settings.BASE_DIR, env=env, check=True,
+        )
+        process = subprocess.Popen(_server_command(server, port, threads), cwd=settings.BASE_DIR, env=env)
+        try:
+            _wait_for_port(port, process)
+            result = asyncio.run(_drive(f'http://127.0.0.1:{port}', total, concurrency))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            stub.shutdown()
+            stub.server_close()
+
+    result.update(server=server, concurrency=concurrency, fx_latency_ms=fx_latency * 1000)
+    return result
@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.archive import archivable_expenses, archive_closed_expenses
+
+
+class Command(BaseCommand):
+    help = 'Move approved/rejected expenses older than a horizon, with their approvals, to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=365,
+                            help='Archive expenses closed (last updated) more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        if options['dry_run']:
+            count = sum(archivable_expenses(cutoff).count() for _ in sharding.each_shard())
+            self.stdout.write(f'{count} expenses would be archived')
+            return
+
+        def report(batch, count):
+            self.stdout.write(f'Batch {batch}: archived {count} expenses')
+
+        moved = 0
+        for _ in sharding.each_shard():
+            moved += archive_closed_expenses(
+                cutoff, batch_size=options['batch_size'], max_batches=options['max_batches'], on_batch=report,
+            )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} expenses closed before {cutoff:%Y-%m-%d}'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ExpenseManagement_app.startup_benchmark import (
+    FIRST_RESPONSE_BUDGET_MS, IMPORT_BUDGET_MS, run_benchmark,
+)
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and time to first response for a fresh WSGI worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/', help='URL path for the first request')
+        parser.add_argument('--runs', type=int, default=3)
+        parser.add_argument('--check', action='store_true', help='Fail if a budget is exceeded')
+
+    def handle(self, *args, **options):
+        result = run_benchmark(path=options['path'], runs=options['runs'])
+
+        self.stdout.write(f"Import time (sum of -X importtime self): {result['import_total_ms']:.1f} ms "
+                          f"(budget {IMPORT_BUDGET_MS} ms)")
+        self.stdout.write(f"First response {options['path']} ({result['status']}): "
+                          f"{result['first_response_ms']:.1f} ms in-process, "
+                          f"{result['process_ms']:.1f} ms including interpreter start "
+                          f"(budget {FIRST_RESPONSE_BUDGET_MS} ms)")
+        self.stdout.write('Slowest top-level imports:')
+        for cumulative_ms, name in result['top_imports']:
+            self.stdout.write(f'  {cumulative_ms:8.1f} ms  {name}')
+        if result['heavy_modules']:
+            self.stdout.write(self.style.WARNING(
+                f"Heavy modules loaded at startup: {', '.join(result['heavy_modules'])}"
+            ))
+
+        if options['check']:
+            failures = []
+            if result['import_total_ms'] > IMPORT_BUDGET_MS:
+                failures.append('import time')
+            if result['first_response_ms'] > FIRST_RESPONSE_BUDGET_MS:
+                failures.append('first response')
+            if result['heavy_modules']:
+                failures.append('heavy modules')
+            if failures:
+                raise CommandError(f"Startup budget exceeded: {', '.join(failures)}")
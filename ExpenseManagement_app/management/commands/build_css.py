@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ExpenseManagement_app.cssbuild import build, output_path
+
+
+class Command(BaseCommand):
+    help = 'Generate static/css/app.css from the utility classes used in templates/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if the committed stylesheet is out of date instead of writing it')
+
+    def handle(self, *args, **options):
+        css, names = build()
+        path = output_path()
+        if options['check']:
+            current = path.read_text(encoding='utf-8') if path.exists() else None
+            if current != css:
+                raise CommandError(f'{path} is out of date; run manage.py build_css')
+            self.stdout.write(self.style.SUCCESS(f'{path} is up to date'))
+            return
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(css, encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(names)} utilities, {len(css.encode())} bytes to {path}'))
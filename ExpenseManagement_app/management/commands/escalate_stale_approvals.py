@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.escalations import escalate_stale_approvals, overdue_approvals
+from ExpenseManagement_app.models import Company
+
+
+class Command(BaseCommand):
+    help = "Escalate pending approvals older than their company's SLA to the approver's manager or the rule's approver"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help='Only count overdue approvals')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for shard in sharding.each_shard():
+                sla_values = Company.objects.values_list('approval_sla_hours', flat=True).distinct().order_by()
+                for sla_hours in sorted(sla_values):
+                    self.stdout.write(
+                        f'{shard}: SLA {sla_hours}h: {overdue_approvals(sla_hours).count()} overdue approvals'
+                    )
+            return
+
+        def report(sla_hours, scanned, escalated):
+            self.stdout.write(f'SLA {sla_hours}h: scanned {scanned}, escalated {escalated}')
+
+        escalated = 0
+        for _ in sharding.each_shard():
+            escalated += escalate_stale_approvals(
+                batch_size=options['batch_size'], max_batches=options['max_batches'], on_batch=report,
+            )
+        self.stdout.write(self.style.SUCCESS(f'Escalated {escalated} approvals'))
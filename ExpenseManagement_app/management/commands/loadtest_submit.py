@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ExpenseManagement_app.loadtest import run_loadtest
+
+
+class Command(BaseCommand):
+    help = 'Drive concurrent expense submissions against one ASGI and/or WSGI server process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['asgi', 'wsgi', 'both'], default='both')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--fx-latency', type=float, default=0.2, help='Stub rate provider latency (seconds)')
+        parser.add_argument('--threads', type=int, default=8, help='gunicorn threads for the WSGI run')
+
+    def handle(self, *args, **options):
+        servers = ['asgi', 'wsgi'] if options['server'] == 'both' else [options['server']]
+        for server in servers:
+            result = run_loadtest(
+                server=server, total=options['requests'], concurrency=options['concurrency'],
+                fx_latency=options['fx_latency'], threads=options['threads'],
+            )
+            label = 'uvicorn (ASGI)' if server == 'asgi' else f"gunicorn gthread x{options['threads']} (WSGI)"
+            self.stdout.write(
+                f"{label:<28} {result['ok']} ok, {result['failed']} failed in {result['seconds']:.2f}s: "
+                f"{result['throughput']:.1f} submissions/s, p50 {result['p50_ms']:.0f} ms, "
+                f"p95 {result['p95_ms']:.0f} ms (FX latency {result['fx_latency_ms']:.0f} ms, "
+                f"{result['concurrency']} concurrent clients)"
+            )
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.models import Company
+from ExpenseManagement_app.provisioning import ProvisioningError, provision_users, read_rows, write_invites
+
+
+class Command(BaseCommand):
+    help = 'Create the users listed in a CSV or JSON file in one company'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with a header row, or a JSON list of objects')
+        parser.add_argument('--company', type=int, required=True, help='Company id')
+        parser.add_argument('--format', choices=['csv', 'json'], help='Defaults to the file extension')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes for password hashing (default: one per CPU)')
+        parser.add_argument('--invites-out', help='Write invite links here instead of to stdout')
+        parser.add_argument('--base-url', default='', help='Prefix for invite links, e.g. https://spend.example.com')
+
+    def handle(self, *args, **options):
+        with sharding.tenant(options['company']):
+            self.provision(options)
+
+    def provision(self, options):
+        try:
+            company = Company.objects.get(id=options['company'])
+        except Company.DoesNotExist:
+            raise CommandError(f'Company {options["company"]} does not exist')
+
+        started = time.perf_counter()
+        try:
+            with open(options['path'], encoding='utf-8-sig') as file:
+                rows = read_rows(file, options['format'])
+            users = provision_users(company, rows, workers=options['workers'])
+        except ProvisioningError as e:
+            for row, message in e.errors:
+                self.stderr.write(f'row {row}: {message}')
+            raise CommandError(f'{len(e.errors)} invalid rows; no users were created')
+        elapsed = time.perf_counter() - started
+
+        if options['invites_out']:
+            with open(options['invites_out'], 'w', newline='', encoding='utf-8') as out:
+                invited = write_invites(out, users, options['base_url'])
+        else:
+            invited = write_invites(self.stdout, users, options['base_url'])
+        self.stderr.write(self.style.SUCCESS(
+            f'Created {len(users)} users in {company.name} in {elapsed:.1f}s ({invited} to invite)'
+        ))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.changefeed import prune
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed events older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=30,
+                            help='Consumers that fall further behind than this must do a full resync')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        deleted = sum(prune(before) for _ in sharding.each_shard())
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} change events'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ExpenseManagement_app.rebalance import RebalanceError, count_rows, move_company
+from ExpenseManagement_app.sharding import directory_entry, shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Move a company and all its rows to another shard (see ExpenseManagement_app/rebalance.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('company', type=int, help='Company id')
+        parser.add_argument('shard', help='Target database alias, one of TENANT_SHARDS')
+        parser.add_argument('--drain-seconds', type=float, default=None,
+                            help='Wait after marking the company read-only (default: TENANT_DIRECTORY_TIMEOUT)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would move')
+
+    def handle(self, *args, **options):
+        company_id, target = options['company'], options['shard']
+        if options['dry_run']:
+            source, _ = directory_entry(company_id, cached=False)
+            self.stdout.write(f'Company {company_id} is on {source}; shards: {", ".join(shard_aliases())}')
+            for label, count in count_rows(company_id, source).items():
+                self.stdout.write(f'  {label}: {count}')
+            return
+
+        try:
+            copied = move_company(company_id, target, options['drain_seconds'], log=self.stdout.write)
+        except RebalanceError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Company {company_id} is on {target} ({sum(copied.values())} rows moved)'
+        ))
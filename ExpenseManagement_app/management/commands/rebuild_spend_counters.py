@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.policies import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute spend policy counters from expense history (backfill or repair)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employee', type=int, action='append', dest='employee_ids',
+                            help='Only rebuild this employee id (repeatable)')
+
+    def handle(self, *args, **options):
+        written = sum(rebuild_counters(options['employee_ids']) for _ in sharding.each_shard())
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} spend counters'))
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.models import Expense
+from ExpenseManagement_app.storage import receipt_storage
+
+
+def _mb(size):
+    return f'{size / (1024 * 1024):.2f} MB'
+
+
+class Command(BaseCommand):
+    help = 'Report receipt disk usage, deduplication savings and thumbnail vs original bytes'
+
+    def handle(self, *args, **options):
+        storage = receipt_storage()
+        sizes = {}
+
+        def size_of(name):
+            if name not in sizes:
+                sizes[name] = storage.size(name) if storage.exists(name) else 0
+            return sizes[name]
+
+        references = 0
+        referenced_bytes = 0
+        originals = set()
+        thumbnails = set()
+        paired_original_bytes = 0
+        paired_thumbnail_bytes = 0
+        paired = 0
+
+        # Every shard's receipts share one storage, so deduplication spans shards.
+        for _ in sharding.each_shard():
+            rows = (
+                Expense.objects.exclude(receipt_image='').exclude(receipt_image__isnull=True)
+                .values_list('receipt_image', 'receipt_thumbnail')
+                .iterator(chunk_size=2000)
+            )
+            for original, thumbnail in rows:
+                references += 1
+                referenced_bytes += size_of(original)
+                originals.add(original)
+                if thumbnail:
+                    thumbnails.add(thumbnail)
+                    paired += 1
+                    paired_original_bytes += size_of(original)
+                    paired_thumbnail_bytes += size_of(thumbnail)
+
+        stored_originals = sum(size_of(name) for name in originals)
+        stored_thumbnails = sum(size_of(name) for name in thumbnails)
+
+        self.stdout.write(f'Expenses with receipts:      {references}')
+        self.stdout.write(f'Distinct receipt files:      {len(originals)}')
+        self.stdout.write(f'Bytes without deduplication: {_mb(referenced_bytes)}')
+        self.stdout.write(f'Bytes stored (originals):    {_mb(stored_originals)}')
+        self.stdout.write(f'Saved by deduplication:      {_mb(referenced_bytes - stored_originals)}')
+        self.stdout.write(f'Bytes stored (thumbnails):   {_mb(stored_thumbnails)} in {len(thumbnails)} files')
+        if paired:
+            self.stdout.write(
+                f'Bytes served per receipt in list views: {paired_thumbnail_bytes / paired / 1024:.1f} KB '
+                f'(thumbnail) vs {paired_original_bytes / paired / 1024:.1f} KB (original), '
+                f'{100 * (1 - paired_thumbnail_bytes / max(paired_original_bytes, 1)):.1f}% less'
+            )
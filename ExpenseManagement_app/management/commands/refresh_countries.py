@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ExpenseManagement_app.countries import DATA_FILE, dump_dataset
+from ExpenseManagement_app.http_client import OutboundHTTPError, get_json
+
+
+class Command(BaseCommand):
+    help = 'Refresh the bundled country/currency dataset from restcountries.com'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Override the configured restcountries endpoint')
+
+    def handle(self, *args, **options):
+        try:
+            data = get_json(
+                'restcountries', '/v3.1/all', params={'fields': 'name,cca2,currencies'}, url=options['url'],
+            )
+        except OutboundHTTPError as e:
+            raise CommandError(f'Could not fetch countries: {e}')
+
+        countries = []
+        for entry in data:
+            # Keep the source's order: the first currency is the country's primary one.
+            currencies = list(entry.get('currencies') or {})
+            if not currencies:
+                continue
+            countries.append({
+                'name': entry['name']['common'],
+                'code': entry.get('cca2', ''),
+                'currencies': currencies,
+            })
+
+        if not countries:
+            raise CommandError('Source returned no countries; keeping the existing file.')
+
+        version = timezone.now().strftime('%Y.%m.%d')
+        # Write beside the target and rename so a running process never reads a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=DATA_FILE.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(dump_dataset(version, countries))
+        os.replace(tmp_path, DATA_FILE)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(countries)} countries (version {version}) to {DATA_FILE}. '
+            'Restart workers to serve the new data.'
+        ))
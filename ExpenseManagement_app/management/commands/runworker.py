@@ -0,0 +1,71 @@
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from ExpenseManagement_app import sharding
+from ExpenseManagement_app.taskqueue import claim, run
+
+
+class Command(BaseCommand):
+    help = 'Run background tasks from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of worker threads')
+        parser.add_argument('--batch-size', type=int, default=5, help='Tasks claimed per query')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when idle')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        base_id = f'{socket.gethostname()}:{os.getpid()}'
+        if options['concurrency'] <= 1:
+            self.stdout.write(f"Starting worker {base_id}")
+            try:
+                self.work(f'{base_id}:0', options)
+            except KeyboardInterrupt:
+                pass
+            return
+
+        threads = [
+            threading.Thread(target=self.work, args=(f'{base_id}:{n}', options), daemon=True)
+            for n in range(options['concurrency'])
+        ]
+        self.stdout.write(f"Starting {len(threads)} worker thread(s) as {base_id}")
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after current tasks...')
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self, worker_id, options):
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                idle = True
+                # Each shard keeps its own queue; handlers run with that shard current.
+                for _ in sharding.each_shard():
+                    claimed = claim(worker_id, limit=options['batch_size'])
+                    idle = idle and not claimed
+                    for task_obj in claimed:
+                        started = time.monotonic()
+                        status = run(task_obj)
+                        self.stdout.write(
+                            f'[{worker_id}] {task_obj} -> {status} in {(time.monotonic() - started) * 1000:.0f} ms'
+                        )
+                if idle:
+                    if options['once']:
+                        break
+                    self.stop.wait(options['poll_interval'])
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0002_alter_company_currency_alter_customuser_groups_and_more'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['company', 'role', 'username'], name='user_company_role_name_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0003_customuser_company_role_username_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='ocr_text',
+            field=models.TextField(blank=True),
+        ),
+    ]
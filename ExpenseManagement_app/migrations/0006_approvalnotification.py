@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0005_task'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApprovalNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('approval', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='ExpenseManagement_app.expenseapproval')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='approval_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['recipient', 'created_at'], name='notification_unsent_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:13
+
+import ExpenseManagement_app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0006_approvalnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=ExpenseManagement_app.storage.receipt_storage, upload_to='receipts/thumbs/'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_image',
+            field=models.ImageField(blank=True, null=True, storage=ExpenseManagement_app.storage.receipt_storage, upload_to='receipts/'),
+        ),
+    ]
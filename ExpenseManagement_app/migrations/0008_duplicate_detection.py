@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0007_receipt_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('similar_receipt', 'Similar receipt image'), ('same_details', 'Same employee, date, amount and merchant')], max_length=30)),
+                ('distance', models.IntegerField(blank=True, help_text='Hamming distance for similar receipts', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReceiptFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phash', models.BigIntegerField()),
+                ('band0', models.IntegerField()),
+                ('band1', models.IntegerField()),
+                ('band2', models.IntegerField()),
+                ('band3', models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['employee', 'expense_date', 'amount'], name='expense_claim_probe_idx'),
+        ),
+        migrations.AddField(
+            model_name='duplicateflag',
+            name='duplicate_of',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ExpenseManagement_app.expense'),
+        ),
+        migrations.AddField(
+            model_name='duplicateflag',
+            name='expense',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_flags', to='ExpenseManagement_app.expense'),
+        ),
+        migrations.AddField(
+            model_name='receiptfingerprint',
+            name='company',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='receipt_fingerprints', to='ExpenseManagement_app.company'),
+        ),
+        migrations.AddField(
+            model_name='receiptfingerprint',
+            name='expense',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='receipt_fingerprint', to='ExpenseManagement_app.expense'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='duplicateflag',
+            unique_together={('expense', 'duplicate_of', 'reason')},
+        ),
+        migrations.AddIndex(
+            model_name='receiptfingerprint',
+            index=models.Index(fields=['company', 'band0'], name='fingerprint_band0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receiptfingerprint',
+            index=models.Index(fields=['company', 'band1'], name='fingerprint_band1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receiptfingerprint',
+            index=models.Index(fields=['company', 'band2'], name='fingerprint_band2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receiptfingerprint',
+            index=models.Index(fields=['company', 'band3'], name='fingerprint_band3_idx'),
+        ),
+    ]
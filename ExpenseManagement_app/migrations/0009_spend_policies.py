@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0008_duplicate_detection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='spend_counted',
+            field=models.BooleanField(default=False, help_text="Included in the employee's SpendCounter totals"),
+        ),
+        migrations.CreateModel(
+            name='SpendPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('category', models.CharField(blank=True, choices=[('travel', 'Travel'), ('food', 'Food & Dining'), ('office', 'Office Supplies'), ('transport', 'Transportation'), ('accommodation', 'Accommodation'), ('entertainment', 'Entertainment'), ('other', 'Other')], help_text='Leave blank to limit total spend across all categories', max_length=50)),
+                ('period', models.CharField(choices=[('day', 'Per day'), ('week', 'Per week'), ('month', 'Per month'), ('year', 'Per year')], default='month', max_length=10)),
+                ('limit_amount', models.DecimalField(decimal_places=2, help_text='In the company currency, per employee', max_digits=12)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_policies', to='ExpenseManagement_app.company')),
+            ],
+            options={
+                'verbose_name_plural': 'Spend policies',
+            },
+        ),
+        migrations.CreateModel(
+            name='SpendCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(blank=True, max_length=50)),
+                ('period', models.CharField(choices=[('day', 'Per day'), ('week', 'Per week'), ('month', 'Per month'), ('year', 'Per year')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spend_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('employee', 'category', 'period', 'period_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PolicyViolation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField()),
+                ('limit_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('period_total', models.DecimalField(decimal_places=2, help_text='Spend in the period including this expense', max_digits=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='policy_violations', to='ExpenseManagement_app.expense')),
+                ('policy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='violations', to='ExpenseManagement_app.spendpolicy')),
+            ],
+            options={
+                'unique_together': {('expense', 'policy')},
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:28
+
+import ExpenseManagement_app.storage
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0009_spend_policies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedExpense',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(blank=True, max_length=10, null=True)),
+                ('amount_in_company_currency', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('category', models.CharField(choices=[('travel', 'Travel'), ('food', 'Food & Dining'), ('office', 'Office Supplies'), ('transport', 'Transportation'), ('accommodation', 'Accommodation'), ('entertainment', 'Entertainment'), ('other', 'Other')], max_length=50)),
+                ('description', models.TextField()),
+                ('merchant_name', models.CharField(blank=True, max_length=255)),
+                ('expense_date', models.DateField()),
+                ('receipt_image', models.ImageField(blank=True, null=True, storage=ExpenseManagement_app.storage.receipt_storage, upload_to='receipts/')),
+                ('receipt_thumbnail', models.ImageField(blank=True, null=True, storage=ExpenseManagement_app.storage.receipt_storage, upload_to='receipts/thumbs/')),
+                ('ocr_text', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected')], max_length=20)),
+                ('current_step', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('approval_rule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ExpenseManagement_app.approvalrule')),
+                ('company', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_expenses', to='ExpenseManagement_app.company')),
+                ('employee', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_expenses', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedExpenseApproval',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected')], max_length=20)),
+                ('comments', models.TextField(blank=True)),
+                ('step_number', models.IntegerField()),
+                ('approved_at', models.DateTimeField(blank=True, null=True)),
+                ('approver', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_expense_approvals', to=settings.AUTH_USER_MODEL)),
+                ('expense', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='approvals', to='ExpenseManagement_app.archivedexpense')),
+            ],
+            options={
+                'ordering': ['step_number'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExpenseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('travel', 'Travel'), ('food', 'Food & Dining'), ('office', 'Office Supplies'), ('transport', 'Transportation'), ('accommodation', 'Accommodation'), ('entertainment', 'Entertainment'), ('other', 'Other')], max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected')], max_length=20)),
+                ('month', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, help_text='In the company currency', max_digits=14)),
+                ('company', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to='ExpenseManagement_app.company')),
+                ('employee', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedexpense',
+            index=models.Index(fields=['employee', 'expense_date'], name='archived_expense_emp_date_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='expenserollup',
+            unique_together={('company', 'employee', 'category', 'status', 'month')},
+        ),
+    ]
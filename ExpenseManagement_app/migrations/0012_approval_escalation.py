@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_created_at(apps, schema_editor):
+    # Existing approvals are dated by their expense rather than by this migration,
+    # so ones that are already overdue get escalated on the first run.
+    Expense = apps.get_model('ExpenseManagement_app', 'Expense')
+    ExpenseApproval = apps.get_model('ExpenseManagement_app', 'ExpenseApproval')
+    db_alias = schema_editor.connection.alias
+    ExpenseApproval.objects.using(db_alias).filter(expense__isnull=False).update(
+        created_at=Subquery(Expense.objects.filter(id=OuterRef('expense_id')).values('created_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0011_change_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='approval_sla_hours',
+            field=models.PositiveIntegerField(default=48, help_text='Pending approvals older than this are escalated (see escalations.py)'),
+        ),
+        migrations.AddField(
+            model_name='expenseapproval',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='expenseapproval',
+            name='escalated_from',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='escalated_to', to='ExpenseManagement_app.expenseapproval'),
+        ),
+        migrations.AlterField(
+            model_name='archivedexpenseapproval',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('escalated', 'Escalated')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='expenseapproval',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('rejected', 'Rejected'), ('escalated', 'Escalated')], default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='expenseapproval',
+            index=models.Index(fields=['status', 'created_at'], name='approval_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0012_approval_escalation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdBlock',
+            fields=[
+                ('model', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('next_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TenantShard',
+            fields=[
+                ('company_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('alias', models.CharField(max_length=100)),
+                ('read_only', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='company_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
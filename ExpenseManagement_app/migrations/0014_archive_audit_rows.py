@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:23
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def merge_duplicate_rollups(apps, schema_editor):
+    # Rollups without a company or employee were added again on every archive
+    # run, since NULLs never conflicted. Fold each group into one row.
+    ExpenseRollup = apps.get_model('ExpenseManagement_app', 'ExpenseRollup')
+    rollups = ExpenseRollup.objects.using(schema_editor.connection.alias)
+    keep = {}
+    for rollup in rollups.filter(models.Q(company__isnull=True) | models.Q(employee__isnull=True)).order_by('id'):
+        key = (rollup.company_id, rollup.employee_id, rollup.category, rollup.status, rollup.month)
+        if key not in keep:
+            keep[key] = rollup
+            continue
+        keep[key].count += rollup.count
+        keep[key].total += rollup.total
+        keep[key].save(update_fields=['count', 'total'])
+        rollup.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0013_tenant_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDuplicateFlag',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('duplicate_of_id', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('similar_receipt', 'Similar receipt image'), ('same_details', 'Same employee, date, amount and merchant')], max_length=30)),
+                ('distance', models.IntegerField(blank=True, help_text='Hamming distance for similar receipts', null=True)),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPolicyViolation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('period_start', models.DateField()),
+                ('limit_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('period_total', models.DecimalField(decimal_places=2, help_text='Spend in the period including this expense', max_digits=14)),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(merge_duplicate_rollups, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='expenserollup',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('company', models.Value(0)), django.db.models.functions.comparison.Coalesce('employee', models.Value(0)), models.F('category'), models.F('status'), models.F('month'), name='expense_rollup_key'),
+        ),
+        migrations.AddField(
+            model_name='archivedduplicateflag',
+            name='expense',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duplicate_flags', to='ExpenseManagement_app.archivedexpense'),
+        ),
+        migrations.AddField(
+            model_name='archivedpolicyviolation',
+            name='expense',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='policy_violations', to='ExpenseManagement_app.archivedexpense'),
+        ),
+        migrations.AddField(
+            model_name='archivedpolicyviolation',
+            name='policy',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_violations', to='ExpenseManagement_app.spendpolicy'),
+        ),
+    ]
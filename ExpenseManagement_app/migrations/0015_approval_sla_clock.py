@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0014_archive_audit_rows'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='expenseapproval',
+            name='approval_status_created_idx',
+        ),
+        migrations.RenameField(
+            model_name='expenseapproval',
+            old_name='created_at',
+            new_name='sla_started_at',
+        ),
+        migrations.AddIndex(
+            model_name='expenseapproval',
+            index=models.Index(fields=['status', 'sla_started_at'], name='approval_status_sla_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ExpenseManagement_app', '0015_approval_sla_clock'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='duplicateflag',
+            unique_together={('expense', 'duplicate_of', 'reason')},
+        ),
+        migrations.AddField(
+            model_name='duplicateflag',
+            name='archived_duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ExpenseManagement_app.archivedexpense'),
+        ),
+        migrations.AlterField(
+            model_name='duplicateflag',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ExpenseManagement_app.expense'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='duplicateflag',
+            unique_together={('expense', 'archived_duplicate_of', 'reason'), ('expense', 'duplicate_of', 'reason')},
+        ),
+        migrations.CreateModel(
+            name='ArchivedReceiptFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phash', models.BigIntegerField()),
+                ('band0', models.IntegerField()),
+                ('band1', models.IntegerField()),
+                ('band2', models.IntegerField()),
+                ('band3', models.IntegerField()),
+                ('company', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_receipt_fingerprints', to='ExpenseManagement_app.company')),
+                ('expense', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='receipt_fingerprint', to='ExpenseManagement_app.archivedexpense')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'band0'], name='archived_fingerprint_band0_idx'), models.Index(fields=['company', 'band1'], name='archived_fingerprint_band1_idx'), models.Index(fields=['company', 'band2'], name='archived_fingerprint_band2_idx'), models.Index(fields=['company', 'band3'], name='archived_fingerprint_band3_idx')],
+            },
+        ),
+    ]
@@ -1,12 +1,20 @@
 from django.db import models
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser, Group, Permission
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 
+from .storage import receipt_storage
+
 # --- Company Model ---
 class Company(models.Model):
     name = models.CharField(max_length=255)
     country = models.CharField(max_length=100)
     currency = models.CharField(max_length=10, null=True, blank=True)
+    approval_sla_hours = models.PositiveIntegerField(
+        default=48, help_text="Pending approvals older than this are escalated (see escalations.py)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -50,6 +58,12 @@ class CustomUser(AbstractUser):
         blank=True,
         related_name='subordinates'
     )
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Backs prefix search on managers within a company (see views.manager_autocomplete).
+            models.Index(fields=['company', 'role', 'username'], name='user_company_role_name_idx'),
+        ]
     
     def __str__(self):
         return f"{self.username} ({self.get_role_display()})"
@@ -64,6 +78,19 @@ class CustomUser(AbstractUser):
             return Expense.objects.filter(company=self.company)
         return Expense.objects.none()
     
+    def get_visible_expenses(self, model=None):
+        """
+        Return every expense this user may look at: own, team (manager) or company (admin).
+        Pass ``model=ArchivedExpense`` to apply the same rule to the archive.
+        """
+        from .models import Expense
+        model = model or Expense
+        if self.role == 'admin':
+            return model.objects.filter(company=self.company)
+        elif self.role == 'manager':
+            return model.objects.filter(Q(employee=self) | Q(employee__manager=self))
+        return model.objects.filter(employee=self)
+
     def get_pending_approvals(self):
         """Return expenses pending for this user’s approval."""
         from .models import ExpenseApproval
@@ -139,7 +166,10 @@ class Expense(models.Model):
     description = models.TextField()
     merchant_name = models.CharField(max_length=255, blank=True)
     expense_date = models.DateField()
-    receipt_image = models.ImageField(upload_to='receipts/', null=True, blank=True)
+    receipt_image = models.ImageField(upload_to='receipts/', storage=receipt_storage, null=True, blank=True)
+    receipt_thumbnail = models.ImageField(upload_to='receipts/thumbs/', storage=receipt_storage, null=True, blank=True)
+    ocr_text = models.TextField(blank=True)
+    spend_counted = models.BooleanField(default=False, help_text="Included in the employee's SpendCounter totals")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     approval_rule = models.ForeignKey(ApprovalRule, on_delete=models.SET_NULL, null=True, blank=True)
     current_step = models.IntegerField(default=0)
@@ -148,6 +178,10 @@ class Expense(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Exact double-claim probe: same employee, date and amount (see duplicates.py).
+            models.Index(fields=['employee', 'expense_date', 'amount'], name='expense_claim_probe_idx'),
+        ]
     
     def __str__(self):
         username = self.employee.username if self.employee else "Unknown"
@@ -159,6 +193,7 @@ class ExpenseApproval(models.Model):
         ('pending', 'Pending'),
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
+        ('escalated', 'Escalated'),
     ]
     
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='approvals', null=True)
@@ -167,10 +202,22 @@ class ExpenseApproval(models.Model):
     comments = models.TextField(blank=True)
     step_number = models.IntegerField()
     approved_at = models.DateTimeField(null=True, blank=True)
+    # When this step's approver could first act on it: creation, or the approval
+    # of the step before under a sequential rule. The escalation scan restarts
+    # it for overdue rows it could not hand on (see escalations.py).
+    sla_started_at = models.DateTimeField(default=timezone.now)
+    # Set on the approval that took over when an overdue one was escalated.
+    escalated_from = models.OneToOneField(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='escalated_to'
+    )
     
     class Meta:
         ordering = ['step_number']
         unique_together = ['expense', 'approver', 'step_number']
+        indexes = [
+            # The stale-approval scan reads only the overdue end of the pending range.
+            models.Index(fields=['status', 'sla_started_at'], name='approval_status_sla_idx'),
+        ]
     
     def __str__(self):
         approver_name = self.approver.username if self.approver else "Unknown"
@@ -180,3 +227,368 @@ class ExpenseApproval(models.Model):
         if self.status in ['approved', 'rejected'] and not self.approved_at:
             self.approved_at = timezone.now()
         super().save(*args, **kwargs)
+
+
+
+# --- Duplicate Detection ---
+class ReceiptFingerprint(models.Model):
+    """
+    64-bit perceptual hash (dHash) of a receipt, split into four 16-bit bands.
+
+    Two hashes within Hamming distance 3 must agree on at least one band, so a
+    near-duplicate lookup is four indexed equality probes instead of a scan.
+    """
+    expense = models.OneToOneField(Expense, on_delete=models.CASCADE, related_name='receipt_fingerprint')
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='receipt_fingerprints', null=True)
+    phash = models.BigIntegerField()
+    band0 = models.IntegerField()
+    band1 = models.IntegerField()
+    band2 = models.IntegerField()
+    band3 = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'band0'], name='fingerprint_band0_idx'),
+            models.Index(fields=['company', 'band1'], name='fingerprint_band1_idx'),
+            models.Index(fields=['company', 'band2'], name='fingerprint_band2_idx'),
+            models.Index(fields=['company', 'band3'], name='fingerprint_band3_idx'),
+        ]
+
+    def __str__(self):
+        return f"Fingerprint of expense {self.expense_id}"
+
+
+class DuplicateFlag(models.Model):
+    REASON_CHOICES = [
+        ('similar_receipt', 'Similar receipt image'),
+        ('same_details', 'Same employee, date, amount and merchant'),
+    ]
+
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='duplicate_flags')
+    duplicate_of = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    # Set instead of duplicate_of when the earlier expense is (or has since been) archived.
+    archived_duplicate_of = models.ForeignKey(
+        'ArchivedExpense', on_delete=models.CASCADE, related_name='+', null=True, blank=True,
+    )
+    reason = models.CharField(max_length=30, choices=REASON_CHOICES)
+    distance = models.IntegerField(null=True, blank=True, help_text="Hamming distance for similar receipts")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [['expense', 'duplicate_of', 'reason'], ['expense', 'archived_duplicate_of', 'reason']]
+
+    @property
+    def original(self):
+        return self.duplicate_of or self.archived_duplicate_of
+
+    def __str__(self):
+        return f"Expense {self.expense_id} ~ {self.duplicate_of_id or self.archived_duplicate_of_id} ({self.reason})"
+
+
+# --- Spend Policies ---
+class SpendPolicy(models.Model):
+    PERIOD_CHOICES = [
+        ('day', 'Per day'),
+        ('week', 'Per week'),
+        ('month', 'Per month'),
+        ('year', 'Per year'),
+    ]
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='spend_policies')
+    name = models.CharField(max_length=255)
+    category = models.CharField(
+        max_length=50, choices=Expense.CATEGORY_CHOICES, blank=True,
+        help_text="Leave blank to limit total spend across all categories",
+    )
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, default='month')
+    limit_amount = models.DecimalField(max_digits=12, decimal_places=2, help_text="In the company currency, per employee")
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Spend policies"
+
+    def __str__(self):
+        return f"{self.name} ({self.limit_amount} {self.get_period_display().lower()})"
+
+
+class SpendCounter(models.Model):
+    """
+    Running total of one employee's spend in one category ('' for all
+    categories) for one calendar period, maintained as expenses are submitted.
+    """
+    employee = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='spend_counters')
+    category = models.CharField(max_length=50, blank=True)
+    period = models.CharField(max_length=10, choices=SpendPolicy.PERIOD_CHOICES)
+    period_start = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['employee', 'category', 'period', 'period_start']
+
+    def __str__(self):
+        return f"{self.employee_id} {self.category or 'all'} {self.period} from {self.period_start}: {self.total}"
+
+
+class PolicyViolation(models.Model):
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='policy_violations')
+    policy = models.ForeignKey(SpendPolicy, on_delete=models.CASCADE, related_name='violations')
+    period_start = models.DateField()
+    limit_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    period_total = models.DecimalField(max_digits=14, decimal_places=2, help_text="Spend in the period including this expense")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['expense', 'policy']
+
+    def __str__(self):
+        return f"Expense {self.expense_id} exceeds {self.policy}"
+
+
+# --- Archive ---
+class ArchivedExpense(models.Model):
+    """
+    A closed expense moved out of the hot ``Expense`` table by ``archive_expenses``.
+    Keeps the original id, so receipt URLs and references stay valid.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    employee = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='archived_expenses', null=True)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='archived_expenses', null=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=10, null=True, blank=True)
+    amount_in_company_currency = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    category = models.CharField(max_length=50, choices=Expense.CATEGORY_CHOICES)
+    description = models.TextField()
+    merchant_name = models.CharField(max_length=255, blank=True)
+    expense_date = models.DateField()
+    receipt_image = models.ImageField(upload_to='receipts/', storage=receipt_storage, null=True, blank=True)
+    receipt_thumbnail = models.ImageField(upload_to='receipts/thumbs/', storage=receipt_storage, null=True, blank=True)
+    ocr_text = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=Expense.STATUS_CHOICES)
+    approval_rule = models.ForeignKey(ApprovalRule, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    current_step = models.IntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['employee', 'expense_date'], name='archived_expense_emp_date_idx'),
+        ]
+
+    def __str__(self):
+        username = self.employee.username if self.employee else "Unknown"
+        return f"{username} - {self.amount} {self.currency} - {self.category} (archived)"
+
+
+class ArchivedExpenseApproval(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(ArchivedExpense, on_delete=models.CASCADE, related_name='approvals')
+    approver = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='archived_expense_approvals', null=True)
+    status = models.CharField(max_length=20, choices=ExpenseApproval.STATUS_CHOICES)
+    comments = models.TextField(blank=True)
+    step_number = models.IntegerField()
+    approved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['step_number']
+
+    def __str__(self):
+        approver_name = self.approver.username if self.approver else "Unknown"
+        return f"Archived expense {self.expense_id} - {approver_name} ({self.status})"
+
+
+class ArchivedReceiptFingerprint(models.Model):
+    """An archived receipt's ``ReceiptFingerprint``, still searched by ``duplicates.find_similar``."""
+    expense = models.OneToOneField(ArchivedExpense, on_delete=models.CASCADE, related_name='receipt_fingerprint')
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, related_name='archived_receipt_fingerprints', null=True,
+    )
+    phash = models.BigIntegerField()
+    band0 = models.IntegerField()
+    band1 = models.IntegerField()
+    band2 = models.IntegerField()
+    band3 = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'band0'], name='archived_fingerprint_band0_idx'),
+            models.Index(fields=['company', 'band1'], name='archived_fingerprint_band1_idx'),
+            models.Index(fields=['company', 'band2'], name='archived_fingerprint_band2_idx'),
+            models.Index(fields=['company', 'band3'], name='archived_fingerprint_band3_idx'),
+        ]
+
+    def __str__(self):
+        return f"Fingerprint of archived expense {self.expense_id}"
+
+
+class ArchivedPolicyViolation(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(ArchivedExpense, on_delete=models.CASCADE, related_name='policy_violations')
+    policy = models.ForeignKey(SpendPolicy, on_delete=models.CASCADE, related_name='archived_violations')
+    period_start = models.DateField()
+    limit_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    period_total = models.DecimalField(max_digits=14, decimal_places=2, help_text="Spend in the period including this expense")
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived expense {self.expense_id} exceeds {self.policy}"
+
+
+class ArchivedDuplicateFlag(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(ArchivedExpense, on_delete=models.CASCADE, related_name='duplicate_flags')
+    # Hot or archived; both keep the same ids, so this is a plain id.
+    duplicate_of_id = models.BigIntegerField()
+    reason = models.CharField(max_length=30, choices=DuplicateFlag.REASON_CHOICES)
+    distance = models.IntegerField(null=True, blank=True, help_text="Hamming distance for similar receipts")
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Archived expense {self.expense_id} ~ {self.duplicate_of_id} ({self.reason})"
+
+
+class ExpenseRollup(models.Model):
+    """
+    Monthly totals of archived expenses per company, employee, category and
+    status, so reports over the full history never read the archive rows.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='expense_rollups', null=True)
+    employee = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='expense_rollups', null=True)
+    category = models.CharField(max_length=50, choices=Expense.CATEGORY_CHOICES)
+    status = models.CharField(max_length=20, choices=Expense.STATUS_CHOICES)
+    month = models.DateField()
+    count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="In the company currency")
+
+    class Meta:
+        constraints = [
+            # Coalesced so rows without a company or employee still collide:
+            # NULLs are distinct in a plain unique index.
+            models.UniqueConstraint(
+                Coalesce('company', Value(0)), Coalesce('employee', Value(0)), 'category', 'status', 'month',
+                name='expense_rollup_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.company_id} {self.employee_id} {self.category} {self.status} {self.month:%Y-%m}: {self.total}"
+
+
+# --- Change Feed ---
+class ChangeEvent(models.Model):
+    """Append-only log of Expense and ExpenseApproval changes; ``id`` is the feed cursor."""
+    ENTITY_CHOICES = [
+        ('expense', 'Expense'),
+        ('approval', 'Expense approval'),
+    ]
+    ACTION_CHOICES = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+        ('archived', 'Archived'),
+    ]
+
+    # The database's own sequence, never shard-wide id blocks (sharding.py): a
+    # cursor needs ids that grow in commit order, and a process holding an older
+    # block could insert below one a consumer has already passed.
+    id = models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='change_events', null=True)
+    entity = models.CharField(max_length=20, choices=ENTITY_CHOICES)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    data = models.JSONField(default=dict, encoder=DjangoJSONEncoder, help_text="Row snapshot after the change")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            # Consumers read WHERE company_id = ? AND id > cursor ORDER BY id.
+            models.Index(fields=['company', 'id'], name='change_event_cursor_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.entity} {self.object_id} {self.action}"
+
+
+# --- Notifications ---
+class ApprovalNotification(models.Model):
+    approval = models.ForeignKey(ExpenseApproval, on_delete=models.CASCADE, related_name='notifications')
+    recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='approval_notifications')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # Digest runs only ever read the unsent backlog.
+            models.Index(
+                fields=['recipient', 'created_at'],
+                condition=Q(sent_at__isnull=True),
+                name='notification_unsent_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Approval {self.approval_id} -> {self.recipient_id} ({'sent' if self.sent_at else 'pending'})"
+
+
+# --- Background Tasks ---
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # The tenant whose request queued it, so rebalance_company can move it along.
+    company_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at']
+        indexes = [
+            # Workers claim the oldest due row: WHERE status = 'queued' AND run_at <= now.
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+
+# --- Sharding ---
+class TenantShard(models.Model):
+    """Directory entry: which database alias holds a company's rows. Lives in 'default' only."""
+    # Not a ForeignKey: the company row is on the shard, not next to this one.
+    company_id = models.BigIntegerField(primary_key=True)
+    alias = models.CharField(max_length=100)
+    # Set while rebalance_company copies the company; writes are refused meanwhile.
+    read_only = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Company {self.company_id} -> {self.alias}{' (read-only)' if self.read_only else ''}"
+
+
+class IdBlock(models.Model):
+    """Next unleased primary key per model, so ids stay unique across shards. Lives in 'default' only."""
+    model = models.CharField(max_length=100, primary_key=True)
+    next_id = models.BigIntegerField()
+
+    def __str__(self):
+        return f"{self.model}: {self.next_id}"
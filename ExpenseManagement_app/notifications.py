@@ -0,0 +1,133 @@
+"""
+Approver notifications, delivered as periodic digests.
+
+Each new pending approval records an ``ApprovalNotification`` and makes sure a
+digest task is queued for the end of the current window. When that task runs,
+every approver with unsent notifications gets one email, and all emails in a
+batch go out over a single SMTP connection.
+
+Only approvals still pending are announced; notifications for approvals that
+were decided or escalated in the meantime are retired unsent. A notification
+is marked sent only once its digest was delivered; undelivered ones stay in
+the backlog for the next window's run.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import ApprovalNotification
+from .taskqueue import enqueue
+
+logger = logging.getLogger(__name__)
+
+DIGEST_BATCH_SIZE = 1000
+
+
+def digest_window():
+    return timedelta(minutes=getattr(settings, 'APPROVAL_DIGEST_WINDOW_MINUTES', 60))
+
+
+def _window_end(now):
+    window = int(digest_window().total_seconds())
+    epoch = int(now.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % window + window, tz=dt_timezone.utc)
+
+
+def schedule_digest(now=None):
+    """Queue the digest run for the current window; repeated calls share one task."""
+    run_at = _window_end(now or timezone.now())
+    return enqueue(
+        'notifications.send_approval_digests',
+        idempotency_key=f'approval-digest:{run_at:%Y%m%dT%H%M%S}',
+        run_at=run_at,
+    )
+
+
+def notify_pending_approvals(approvals):
+    """Record that each approval in ``approvals`` is waiting on its approver."""
+    notifications = [
+        ApprovalNotification(approval=approval, recipient_id=approval.approver_id)
+        for approval in approvals
+        if approval.approver_id
+    ]
+    if notifications:
+        ApprovalNotification.objects.bulk_create(notifications)
+        schedule_digest()
+
+
+def _build_digest(recipient, notifications):
+    lines = []
+    for notification in notifications:
+        expense = notification.approval.expense
+        employee = expense.employee.username if expense.employee else 'Unknown'
+        lines.append(
+            f"- {employee}: {expense.amount} {expense.currency or ''} "
+            f"({expense.get_category_display()}) {expense.description[:80]}"
+        )
+    count = len(notifications)
+    subject = f"{count} expense{'s' if count != 1 else ''} awaiting your approval"
+    body = (
+        f"Hi {recipient.username},\n\n"
+        f"The following expenses are waiting for your review:\n\n"
+        + '\n'.join(lines)
+        + "\n\nOpen your manager dashboard to approve or reject them.\n"
+    )
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient.email])
+
+
+def send_approval_digests(batch_size=DIGEST_BATCH_SIZE):
+    """Send one digest per approver with unsent notifications; returns emails sent."""
+    sent = undelivered = 0
+    backlog = ApprovalNotification.objects.filter(sent_at__isnull=True)
+    backlog.exclude(approval__status='pending').update(sent_at=timezone.now())
+    unsent = backlog.filter(approval__status='pending')
+    last_recipient_id = None
+    while True:
+        # Batch by approver so one person's backlog never spans two emails.
+        # Keyset on the recipient so undelivered digests aren't picked up again this run.
+        candidates = unsent if last_recipient_id is None else unsent.filter(recipient_id__gt=last_recipient_id)
+        recipient_ids = list(
+            candidates.order_by('recipient_id').values_list('recipient_id', flat=True).distinct()[:batch_size]
+        )
+        if not recipient_ids:
+            break
+        last_recipient_id = recipient_ids[-1]
+
+        batch = list(
+            unsent.filter(recipient_id__in=recipient_ids)
+            .select_related('recipient', 'approval__expense__employee')
+            .order_by('recipient_id', 'created_at')
+        )
+        done_ids, digests = [], []
+        for recipient_id, group in groupby(batch, key=lambda n: n.recipient_id):
+            group = list(group)
+            recipient = group[0].recipient
+            # Approvers without an address are marked sent so they don't block the backlog.
+            if recipient.email:
+                digests.append((_build_digest(recipient, group), group))
+            else:
+                done_ids.extend(n.id for n in group)
+
+        try:
+            if digests:
+                # One connection, opened once, for every digest in the batch;
+                # sent one at a time so each delivery is known.
+                with get_connection() as connection:
+                    for message, group in digests:
+                        if connection.send_messages([message]):
+                            sent += 1
+                            done_ids.extend(n.id for n in group)
+                        else:
+                            undelivered += 1
+        finally:
+            # Whatever went out is recorded even if the connection fails part way.
+            ApprovalNotification.objects.filter(id__in=done_ids).update(sent_at=timezone.now())
+
+    if undelivered:
+        logger.warning('%d approval digests were not delivered; retrying next window', undelivered)
+        schedule_digest()
+    return sent
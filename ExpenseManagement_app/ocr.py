@@ -0,0 +1,49 @@
+"""
+Receipt OCR.
+
+Pillow and pytesseract are heavy to import and only the OCR endpoint needs
+them, so they are loaded on first use rather than when views are imported.
+
+Under ASGI, ``aimage_to_text`` runs tesseract on a small dedicated thread pool
+so OCR never blocks the event loop and can't starve other work of threads.
+"""
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# The scanned text comes back to the server in a hidden form field, so it is
+# client-controlled: keep printable text only and no more than a receipt holds.
+OCR_TEXT_MAX_LENGTH = 4000
+_CONTROL_RE = re.compile(r'[\x00-\x08\x0b-\x1f\x7f]')
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'OCR_MAX_WORKERS', 2), thread_name_prefix='ocr',
+        )
+    return _executor
+
+
+def clean_ocr_text(text):
+    """Strip control characters and cap length before OCR text is stored and indexed."""
+    return _CONTROL_RE.sub(' ', text or '')[:OCR_TEXT_MAX_LENGTH].strip()
+
+
+def image_to_text(fileobj):
+    """Run tesseract over an uploaded receipt image and return the raw text."""
+    import pytesseract
+    from PIL import Image
+
+    with Image.open(fileobj) as image:
+        return pytesseract.image_to_string(image)
+
+
+async def aimage_to_text(fileobj):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), image_to_text, fileobj)
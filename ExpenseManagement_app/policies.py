@@ -0,0 +1,165 @@
+"""
+Spend policies checked at submission time.
+
+Every counted expense adds its company-currency amount to ``SpendCounter`` rows
+keyed by (employee, category, period, period start): one for its own category
+and one for all categories ('') in each period. Checking a policy is then a
+read of the counter for the expense's period, never a SUM over the employee's
+expense history. Periods are calendar buckets of ``expense_date`` (ISO weeks
+start on Monday).
+
+``Expense.spend_counted`` records whether an expense is included, so counting
+is safe to repeat and rejection releases the amount exactly once.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from . import sharding
+from .models import Expense, PolicyViolation, SpendCounter, SpendPolicy
+
+ALL_CATEGORIES = ''
+PERIODS = [period for period, _ in SpendPolicy.PERIOD_CHOICES]
+
+
+def period_start(period, day):
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    raise ValueError(f'Unknown period {period!r}')
+
+
+def _expense_day(expense):
+    # A freshly created expense still holds the submitted string.
+    return Expense._meta.get_field('expense_date').to_python(expense.expense_date)
+
+
+def _counter_keys(expense):
+    day = _expense_day(expense)
+    return [
+        (category, period, period_start(period, day))
+        for category in (expense.category, ALL_CATEGORIES)
+        for period in PERIODS
+    ]
+
+
+def _apply(expense, amount, count):
+    """Add ``amount``/``count`` to the expense's counters and return ``{(category, period): total}``."""
+    keys = _counter_keys(expense)
+    SpendCounter.objects.bulk_create(
+        [
+            SpendCounter(employee_id=expense.employee_id, category=category, period=period, period_start=start)
+            for category, period, start in keys
+        ],
+        ignore_conflicts=True,
+    )
+    key_filter = Q()
+    for category, period, start in keys:
+        key_filter |= Q(category=category, period=period, period_start=start)
+    counters = list(
+        SpendCounter.objects.select_for_update().filter(key_filter, employee_id=expense.employee_id)
+    )
+
+    now = timezone.now()
+    for counter in counters:
+        counter.total += amount
+        counter.count += count
+        counter.updated_at = now
+    SpendCounter.objects.bulk_update(counters, ['total', 'count', 'updated_at'])
+    return {(counter.category, counter.period): counter.total for counter in counters}
+
+
+def record_spend(expense):
+    """
+    Count a submitted expense against its employee's counters and record any
+    policy it takes over the limit. Returns the new ``PolicyViolation`` rows.
+
+    Does nothing until the company-currency amount is known, or if the expense
+    was already counted.
+    """
+    if expense.amount_in_company_currency is None or not expense.employee_id:
+        return []
+
+    with sharding.atomic():
+        if not Expense.objects.filter(id=expense.id, spend_counted=False).update(spend_counted=True):
+            return []
+        expense.spend_counted = True
+        totals = _apply(expense, Decimal(expense.amount_in_company_currency), 1)
+
+        policies = SpendPolicy.objects.filter(
+            company_id=expense.company_id, is_active=True,
+            category__in=[expense.category, ALL_CATEGORIES],
+        )
+        violations = [
+            PolicyViolation(
+                expense=expense,
+                policy=policy,
+                period_start=period_start(policy.period, _expense_day(expense)),
+                limit_amount=policy.limit_amount,
+                period_total=totals[(policy.category, policy.period)],
+            )
+            for policy in policies
+            if totals[(policy.category, policy.period)] > policy.limit_amount
+        ]
+        return PolicyViolation.objects.bulk_create(violations, ignore_conflicts=True)
+
+
+def release_spend(expense):
+    """Take a rejected expense back out of its employee's counters."""
+    with sharding.atomic():
+        if not Expense.objects.filter(id=expense.id, spend_counted=True).update(spend_counted=False):
+            return
+        expense.spend_counted = False
+        _apply(expense, -Decimal(expense.amount_in_company_currency or 0), -1)
+
+
+def rebuild_counters(employee_ids=None):
+    """
+    Recompute counters from scratch with a single grouped aggregate (for
+    backfills or after bulk edits). Counts every non-rejected expense with a known
+    company-currency amount. Returns the number of counter rows written.
+    """
+    expenses = Expense.objects.exclude(status='rejected').filter(
+        employee__isnull=False, amount_in_company_currency__isnull=False,
+    )
+    rejected = Expense.objects.filter(status='rejected', spend_counted=True)
+    counters = SpendCounter.objects.all()
+    if employee_ids is not None:
+        expenses = expenses.filter(employee_id__in=employee_ids)
+        rejected = rejected.filter(employee_id__in=employee_ids)
+        counters = counters.filter(employee_id__in=employee_ids)
+
+    totals = {}
+    rows = expenses.values('employee_id', 'category', 'expense_date').annotate(
+        total=Sum('amount_in_company_currency'), count=Count('id'),
+    ).order_by()
+    for row in rows.iterator(chunk_size=2000):
+        for period in PERIODS:
+            start = period_start(period, row['expense_date'])
+            for category in (row['category'], ALL_CATEGORIES):
+                key = (row['employee_id'], category, period, start)
+                total, count = totals.get(key, (Decimal(0), 0))
+                totals[key] = (total + row['total'], count + row['count'])
+
+    with sharding.atomic():
+        counters.delete()
+        SpendCounter.objects.bulk_create(
+            [
+                SpendCounter(
+                    employee_id=employee_id, category=category, period=period,
+                    period_start=start, total=total, count=count,
+                )
+                for (employee_id, category, period, start), (total, count) in totals.items()
+            ],
+            batch_size=1000,
+        )
+        expenses.filter(spend_counted=False).update(spend_counted=True)
+        rejected.update(spend_counted=False)
+    return len(totals)
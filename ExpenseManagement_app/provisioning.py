@@ -0,0 +1,223 @@
+"""
+Bulk user provisioning for onboarding a company.
+
+Rows come from a CSV or JSON file (``read_rows``) with ``username`` and
+optional ``email``, ``role``, ``manager``, ``password``, ``first_name`` and
+``last_name``. ``manager`` is a username, either an existing manager in the
+company or a manager created by the same file. Passwords given in the file
+must pass ``AUTH_PASSWORD_VALIDATORS``.
+
+Password hashing is deliberately slow (hundreds of milliseconds per password
+with the default PBKDF2 settings), so passwords are hashed in a process pool.
+Rows without a password get an unusable password instead, and
+``invite_links`` gives each of them a one-time link to choose their own. That
+is the fast path: no hashing at all. Users are then inserted with
+``bulk_create``; in-batch manager references are filled in with one
+``bulk_update``.
+"""
+import csv
+import io
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from django.utils.module_loading import import_string
+
+from . import sharding
+from .models import CustomUser
+
+FIELDS = ['username', 'email', 'role', 'manager', 'password', 'first_name', 'last_name']
+ROLES = [role for role, _ in CustomUser.ROLE_CHOICES]
+BATCH_SIZE = 500
+# Below this many passwords a pool costs more to start than it saves.
+MIN_POOL_PASSWORDS = 8
+
+
+class InviteTokenGenerator(PasswordResetTokenGenerator):
+    """
+    One-time invite tokens. Like reset tokens they stop working once the user
+    has set a password, and expire after ``PASSWORD_RESET_TIMEOUT``; the
+    separate salt keeps them from being accepted as reset tokens.
+    """
+    key_salt = 'ExpenseManagement_app.provisioning.InviteTokenGenerator'
+
+
+invite_token_generator = InviteTokenGenerator()
+
+
+class ProvisioningError(ValueError):
+    """The file has invalid rows; nothing was created. ``errors`` lists ``(row_number, message)``."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f'row {row}: {message}' for row, message in errors[:10]))
+
+
+def read_rows(file, format=None):
+    """Parse a CSV (header row) or JSON (list of objects) file, text or binary, into dicts."""
+    name = getattr(file, 'name', '') or ''
+    format = format or ('json' if name.lower().endswith('.json') else 'csv')
+    text = file.read()
+    if isinstance(text, bytes):
+        text = text.decode('utf-8-sig')
+    if format == 'json':
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ProvisioningError([(0, 'expected a JSON list of objects')])
+        errors = [
+            (number, 'expected an object') for number, row in enumerate(rows, start=1) if not isinstance(row, dict)
+        ]
+        if errors:
+            raise ProvisioningError(errors)
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    return [
+        {field: str(row.get(field) or '').strip() for field in FIELDS}
+        for row in rows
+    ]
+
+
+def _hash_chunk(hasher_path, passwords):
+    # Runs in a worker process: only the hasher class is needed, not settings.
+    hasher = import_string(hasher_path)()
+    return [hasher.encode(password, hasher.salt()) for password in passwords]
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash ``passwords`` with the default hasher, spread over ``workers`` processes."""
+    hasher = get_hasher('default')
+    hasher_path = f'{type(hasher).__module__}.{type(hasher).__qualname__}'
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < MIN_POOL_PASSWORDS:
+        return _hash_chunk(hasher_path, passwords)
+
+    # A few chunks per worker keeps them all busy without one task per password.
+    size = math.ceil(len(passwords) / (workers * 4))
+    chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        hashed = pool.map(_hash_chunk, [hasher_path] * len(chunks), chunks)
+        return [encoded for chunk in hashed for encoded in chunk]
+
+
+def _validate(company, rows):
+    errors = []
+    seen = {}
+    for number, row in enumerate(rows, start=1):
+        username = row['username']
+        if not username:
+            errors.append((number, 'username is required'))
+        elif username in seen:
+            errors.append((number, f'username "{username}" repeats row {seen[username]}'))
+        seen.setdefault(username, number)
+        if (row['role'] or 'employee') not in ROLES:
+            errors.append((number, f'unknown role "{row["role"]}"'))
+        if row['password']:
+            # The similarity validator compares against the user's own attributes.
+            user = CustomUser(
+                username=username, email=row['email'], first_name=row['first_name'], last_name=row['last_name'],
+            )
+            try:
+                validate_password(row['password'], user)
+            except ValidationError as e:
+                errors.append((number, ' '.join(e.messages)))
+
+    usernames = list(seen)
+    existing = set()
+    # Usernames are unique across shards, not just within the company's.
+    for alias in sharding.shard_aliases():
+        for start in range(0, len(usernames), BATCH_SIZE):
+            existing.update(
+                CustomUser.objects.using(alias).filter(username__in=usernames[start:start + BATCH_SIZE])
+                .values_list('username', flat=True)
+            )
+    errors.extend((seen[username], f'username "{username}" already exists') for username in sorted(existing))
+
+    batch_managers = {row['username'] for row in rows if row['role'] == 'manager'}
+    references = {row['manager'] for row in rows if row['manager']} - batch_managers
+    existing_managers = dict(
+        CustomUser.objects.filter(company=company, role='manager', username__in=references)
+        .values_list('username', 'id')
+    )
+    for number, row in enumerate(rows, start=1):
+        if not row['manager']:
+            continue
+        if (row['role'] or 'employee') != 'employee':
+            errors.append((number, 'only employees can have a manager'))
+        elif row['manager'] not in batch_managers and row['manager'] not in existing_managers:
+            errors.append((number, f'manager "{row["manager"]}" is not a manager in {company.name}'))
+    if errors:
+        raise ProvisioningError(sorted(errors))
+    return existing_managers
+
+
+def provision_users(company, rows, workers=None):
+    """
+    Create one user in ``company`` per row, on the current shard (the
+    company's; see ``sharding.tenant``). All rows are validated first and
+    either all users are created or none. Returns the created users.
+    """
+    rows = [
+        {**row, 'username': CustomUser.normalize_username(row['username']),
+         'manager': CustomUser.normalize_username(row['manager'])}
+        for row in rows
+    ]
+    existing_managers = _validate(company, rows)
+
+    with_password = [index for index, row in enumerate(rows) if row['password']]
+    hashed = dict(zip(with_password, hash_passwords([rows[i]['password'] for i in with_password], workers)))
+
+    users = []
+    for index, row in enumerate(rows):
+        user = CustomUser(
+            username=row['username'],
+            email=CustomUser.objects.normalize_email(row['email']),
+            first_name=row['first_name'],
+            last_name=row['last_name'],
+            role=row['role'] or 'employee',
+            company=company,
+            manager_id=existing_managers.get(row['manager']),
+        )
+        if index in hashed:
+            user.password = hashed[index]
+        else:
+            user.set_unusable_password()
+        users.append(user)
+
+    with sharding.atomic():
+        CustomUser.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        by_username = {user.username: user for user in users}
+        pending = []
+        for user, row in zip(users, rows):
+            if row['manager'] and user.manager_id is None:
+                user.manager = by_username[row['manager']]
+                pending.append(user)
+        CustomUser.objects.bulk_update(pending, ['manager'], batch_size=BATCH_SIZE)
+    return users
+
+
+def invite_path(user):
+    uidb64 = urlsafe_base64_encode(force_bytes(user.pk))
+    return reverse('accept_invite', args=[uidb64, invite_token_generator.make_token(user)])
+
+
+def invite_links(users):
+    """``[(user, path)]`` for each user who still has to choose a password."""
+    return [(user, invite_path(user)) for user in users if not user.has_usable_password()]
+
+
+def write_invites(out, users, base_url=''):
+    """Write ``username,email,invite_url`` CSV rows for users still to be invited. Returns the count."""
+    links = invite_links(users)
+    writer = csv.writer(out)
+    writer.writerow(['username', 'email', 'invite_url'])
+    for user, path in links:
+        writer.writerow([user.username, user.email, base_url.rstrip('/') + path])
+    return len(links)
@@ -0,0 +1,185 @@
+"""
+Moving a company to another shard.
+
+``move_company`` copies every row that belongs to the company (the tables in
+``TENANT_TABLES``) to the target database with the same ids, points the
+directory at the target and deletes the originals. Rows are written the way
+``loaddata`` writes them, as raw saves, so ``auto_now`` timestamps are kept and
+no change-feed events are recorded for the copy.
+
+While it runs the company is read-only: the router raises ``TenantReadOnly``
+for writes that name it. Routers read the directory through a cache, so after
+setting the flag the move waits ``drain_seconds`` (``TENANT_DIRECTORY_TIMEOUT``
+by default) for every process to see it. The copy then runs in a transaction
+on the source; with SQLite's immediate transactions that holds the source's
+write lock until the originals are gone, so a worker cannot slip in a write
+that would be left behind. On other backends, stop the workers during a move.
+
+Change events are the one table whose ids change. Feed cursors need ids that
+grow with time, so ``ChangeEvent`` uses each database's own sequence, and the
+company's events are renumbered above anything on the target and anything a
+consumer of the company can have seen. Consumers therefore get the retained
+events again once after a move, which a feed of row snapshots tolerates.
+
+The copy, the directory switch and the delete are separate commits. A move
+that stops half way can simply be run again: rows left on the target by an
+unfinished copy are cleared first, and once the directory points at the
+target a re-run only deletes what is left on the other shards.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+
+from . import changefeed
+from .models import (
+    ApprovalNotification, ApprovalRule, ApprovalStep, ArchivedDuplicateFlag, ArchivedExpense,
+    ArchivedExpenseApproval, ArchivedPolicyViolation, ArchivedReceiptFingerprint, ChangeEvent, Company, CustomUser,
+    DuplicateFlag, Expense, ExpenseApproval, ExpenseRollup, PolicyViolation, ReceiptFingerprint, SpendCounter,
+    SpendPolicy, Task,
+)
+from .sharding import assign_shard, directory_entry, shard_aliases
+
+BATCH_SIZE = 500
+
+# Every table holding a company's rows, parents first, with the lookup from it to the company id.
+TENANT_TABLES = [
+    (Company, 'id'),
+    (CustomUser, 'company'),
+    (ApprovalRule, 'company'),
+    (ApprovalStep, 'approval_rule__company'),
+    (SpendPolicy, 'company'),
+    (Expense, 'company'),
+    (ArchivedExpense, 'company'),
+    (ExpenseApproval, 'expense__company'),
+    (ApprovalNotification, 'approval__expense__company'),
+    (ReceiptFingerprint, 'expense__company'),
+    (DuplicateFlag, 'expense__company'),
+    (SpendCounter, 'employee__company'),
+    (PolicyViolation, 'expense__company'),
+    (ArchivedExpenseApproval, 'expense__company'),
+    (ArchivedReceiptFingerprint, 'expense__company'),
+    (ArchivedPolicyViolation, 'expense__company'),
+    (ArchivedDuplicateFlag, 'expense__company'),
+    (ExpenseRollup, 'company'),
+    (ChangeEvent, 'company'),
+    (Task, 'company_id'),
+]
+
+
+class RebalanceError(Exception):
+    pass
+
+
+def _rows(model, lookup, company_id, alias):
+    return model._base_manager.using(alias).filter(**{lookup: company_id})
+
+
+def count_rows(company_id, alias):
+    """``{model label: rows}`` for the company on ``alias``."""
+    return {model._meta.label: _rows(model, lookup, company_id, alias).count() for model, lookup in TENANT_TABLES}
+
+
+def _check_memberships(company_id, alias):
+    # Group and permission ids are per database; the app doesn't use them, so
+    # rather than remap them a move refuses to drop them silently.
+    for field in ('groups', 'user_permissions'):
+        through = getattr(CustomUser, field).through
+        if through.objects.using(alias).filter(customuser__company_id=company_id).exists():
+            raise RebalanceError(f'Users of company {company_id} have {field}; remove them before moving it')
+
+
+def _first_event_id(company_id, source, target):
+    return 1 + max(
+        ChangeEvent.objects.using(target).aggregate(top=Max('id'))['top'] or 0,
+        _rows(ChangeEvent, 'company', company_id, source).aggregate(top=Max('id'))['top'] or 0,
+    )
+
+
+def _copy(model, lookup, company_id, source, target):
+    rows = _rows(model, lookup, company_id, source).order_by('pk')
+    renumber_from = _first_event_id(company_id, source, target) if model is ChangeEvent else None
+    copied = 0
+    last = None
+    while True:
+        batch = list((rows if last is None else rows.filter(pk__gt=last))[:BATCH_SIZE])
+        if not batch:
+            return copied
+        last = batch[-1].pk
+        if renumber_from is None:
+            taken = list(model._base_manager.using(target).filter(pk__in=[obj.pk for obj in batch])
+                         .values_list('pk', flat=True)[:5])
+            if taken:
+                raise RebalanceError(f'{model._meta.label} ids {taken} already exist on {target}')
+        for index, obj in enumerate(batch):
+            if renumber_from is not None:
+                obj.pk = renumber_from + copied + index
+            obj.save_base(raw=True, force_insert=True, using=target)
+        copied += len(batch)
+
+
+def _reset_sequences(alias):
+    # Explicit ids don't advance a PostgreSQL sequence; SQLite needs nothing.
+    connection = connections[alias]
+    statements = connection.ops.sequence_reset_sql(no_style(), [model for model, _ in TENANT_TABLES])
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def _purge(company_id, alias):
+    """Delete the company's rows on ``alias``, children first. Returns the number deleted."""
+    deleted = 0
+    with changefeed.muted():
+        for model, lookup in reversed(TENANT_TABLES):
+            deleted += _rows(model, lookup, company_id, alias).delete()[0]
+    return deleted
+
+
+def move_company(company_id, target, drain_seconds=None, log=None):
+    """
+    Move company ``company_id`` with all its rows to shard ``target``.
+    Returns ``{model label: rows copied}``.
+    """
+    log = log or (lambda message: None)
+    if target not in shard_aliases():
+        raise RebalanceError(f'"{target}" is not one of TENANT_SHARDS {shard_aliases()}')
+
+    source, _ = directory_entry(company_id, cached=False)
+    if source == target:
+        for alias in shard_aliases():
+            if alias != target and (deleted := _purge(company_id, alias)):
+                log(f'Deleted {deleted} rows left on {alias} by an earlier move')
+        log(f'Company {company_id} is on {target}')
+        return {}
+    if not Company.objects.using(source).filter(pk=company_id).exists():
+        raise RebalanceError(f'Company {company_id} is not on {source}')
+    _check_memberships(company_id, source)
+
+    if drain_seconds is None:
+        drain_seconds = getattr(settings, 'TENANT_DIRECTORY_TIMEOUT', 30)
+    assign_shard(company_id, source, read_only=True)
+    switched = False
+    try:
+        log(f'Company {company_id} is read-only; waiting {drain_seconds}s for cached directory entries to expire')
+        time.sleep(drain_seconds)
+
+        copied = {}
+        with transaction.atomic(using=source):
+            with transaction.atomic(using=target):
+                if deleted := _purge(company_id, target):
+                    log(f'Deleted {deleted} rows left on {target} by an unfinished move')
+                for model, lookup in TENANT_TABLES:
+                    copied[model._meta.label] = _copy(model, lookup, company_id, source, target)
+                    log(f'{model._meta.label}: copied {copied[model._meta.label]}')
+                _reset_sequences(target)
+            assign_shard(company_id, target)
+            switched = True
+            log(f'Deleted {_purge(company_id, source)} rows from {source}')
+    except BaseException:
+        if not switched:
+            assign_shard(company_id, source)
+        raise
+    return copied
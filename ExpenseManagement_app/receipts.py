@@ -0,0 +1,45 @@
+"""
+Receipt derivatives.
+
+A small compressed thumbnail is generated once per upload (by the task worker)
+so list and review pages never need to load the full-size original.
+"""
+import io
+import posixpath
+
+from django.core.files.base import ContentFile
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 70
+
+
+def _encode_thumbnail(fileobj):
+    # Pillow is only needed here; keep it out of web-process start-up.
+    from PIL import Image, features
+
+    with Image.open(fileobj) as image:
+        image.draft('RGB', THUMBNAIL_SIZE)
+        image = image.convert('RGB')
+        image.thumbnail(THUMBNAIL_SIZE)
+        out = io.BytesIO()
+        if features.check('webp'):
+            image.save(out, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+            extension = '.webp'
+        else:
+            image.save(out, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+            extension = '.jpg'
+    return out.getvalue(), extension
+
+
+def generate_thumbnail(expense):
+    """Create ``expense.receipt_thumbnail`` from its receipt if it does not exist yet."""
+    if not expense.receipt_image or expense.receipt_thumbnail:
+        return False
+
+    with expense.receipt_image.open('rb') as original:
+        data, extension = _encode_thumbnail(original)
+
+    stem = posixpath.splitext(posixpath.basename(expense.receipt_image.name))[0]
+    expense.receipt_thumbnail.save(f'{stem}{extension}', ContentFile(data), save=False)
+    expense.save(update_fields=['receipt_thumbnail', 'updated_at'])
+    return True
@@ -0,0 +1,149 @@
+"""
+Full-text search over expense description, merchant name and OCR text.
+
+SQLite uses an external-content FTS5 table kept in sync by triggers; PostgreSQL
+uses a GIN expression index over the same columns. Other backends fall back to
+``icontains`` filters.
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Expense
+
+FTS_TABLE = 'expense_fts'
+SEARCH_COLUMNS = ('description', 'merchant_name', 'ocr_text')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_PG_VECTOR = (
+    "to_tsvector('simple', coalesce(description, '') || ' ' || "
+    "coalesce(merchant_name, '') || ' ' || coalesce(ocr_text, ''))"
+)
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text or '')[:10]
+
+
+def _sqlite_match(text):
+    # Quote every token so user input can never be parsed as FTS5 syntax; each
+    # token is a prefix match and all of them must be present.
+    return ' '.join(f'"{token}"*' for token in _tokens(text))
+
+
+def _pg_tsquery(text):
+    return ' & '.join(f'{token}:*' for token in _tokens(text))
+
+
+def install_search_index(conn=connection):
+    """Create the FTS table/triggers (SQLite) or GIN index (PostgreSQL) if missing."""
+    table = Expense._meta.db_table
+    if table not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+            )
+            created = cursor.fetchone() is None
+            columns = ', '.join(SEARCH_COLUMNS)
+            new_values = ', '.join(f'new.{c}' for c in SEARCH_COLUMNS)
+            old_values = ', '.join(f'old.{c}' for c in SEARCH_COLUMNS)
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{columns}, content='{table}', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            # Triggers are re-created on every migrate because SQLite table
+            # rebuilds (AlterField and friends) silently drop them.
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old_values}); END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old_values}); "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+            )
+            if created:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS expense_search_gin ON "{table}" USING GIN ({_PG_VECTOR})'
+            )
+
+
+def matching_ids(text, using='default'):
+    """Return a RawSQL subquery of expense ids matching ``text``, or None if unsupported."""
+    conn = connections[using]
+    if conn.vendor == 'sqlite':
+        match = _sqlite_match(text)
+        if match:
+            return RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+    elif conn.vendor == 'postgresql':
+        query = _pg_tsquery(text)
+        if query:
+            return RawSQL(
+                f'SELECT id FROM "{Expense._meta.db_table}" '
+                f"WHERE {_PG_VECTOR} @@ to_tsquery('simple', %s)",
+                [query],
+            )
+    return None
+
+
+def filter_expenses(queryset, text):
+    """Restrict ``queryset`` to expenses matching ``text`` (unranked)."""
+    if not _tokens(text):
+        return queryset.none()
+    subquery = matching_ids(text, queryset.db)
+    if subquery is not None:
+        return queryset.filter(id__in=subquery)
+    condition = Q()
+    for column in SEARCH_COLUMNS:
+        condition |= Q(**{f'{column}__icontains': text})
+    return queryset.filter(condition)
+
+
+def search_expenses(queryset, text, limit=50):
+    """
+    Return up to ``limit`` expenses from ``queryset`` matching ``text``, best match first.
+
+    ``queryset`` carries the caller's visibility rules; it is applied inside the
+    ranked query so hidden expenses never take up a slot in the result page.
+    """
+    if not _tokens(text):
+        return []
+
+    visible_sql, visible_params = queryset.order_by().values('id').query.sql_with_params()
+    conn = connections[queryset.db]
+    if conn.vendor == 'sqlite':
+        sql = (
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid IN ({visible_sql}) ORDER BY rank LIMIT %s'
+        )
+        params = [_sqlite_match(text), *visible_params, limit]
+    elif conn.vendor == 'postgresql':
+        sql = (
+            f'SELECT id FROM "{Expense._meta.db_table}", to_tsquery(\'simple\', %s) query '
+            f'WHERE {_PG_VECTOR} @@ query AND id IN ({visible_sql}) '
+            f'ORDER BY ts_rank({_PG_VECTOR}, query) DESC LIMIT %s'
+        )
+        params = [_pg_tsquery(text), *visible_params, limit]
+    else:
+        return list(filter_expenses(queryset, text)[:limit])
+
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+
+    expenses = queryset.model.objects.using(queryset.db).select_related('employee').in_bulk(ids)
+    return [expenses[expense_id] for expense_id in ids if expense_id in expenses]
@@ -0,0 +1,112 @@
+"""
+Hand protected files to the front-end server after the view has checked access.
+
+``RECEIPT_SENDFILE_BACKEND`` selects how bytes are delivered:
+
+* ``'nginx'``  - empty response with ``X-Accel-Redirect: <RECEIPT_ACCEL_PREFIX><name>``;
+  nginx serves the file from an ``internal`` location.
+* ``'apache'`` - empty response with ``X-Sendfile: <absolute path>`` (mod_xsendfile).
+* ``None``     - Django streams the file itself, honouring single ``Range`` requests.
+  Meant for development only.
+
+Receipts are uploaded by users and never validated, so only the image and PDF
+types in ``INLINE_CONTENT_TYPES`` are shown inline. Anything else (HTML, SVG,
+...) is sent as an ``application/octet-stream`` attachment. Every response
+carries ``X-Content-Type-Options: nosniff``, so a browser never renders an
+uploaded file as same-origin markup.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+# Files are content-addressed, so a given name never changes.
+RECEIPT_MAX_AGE = 60 * 60 * 24 * 30
+
+INLINE_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'application/pdf'}
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _file_chunks(path, start, length, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _ranged_response(request, path, size, content_type):
+    match = _RANGE_RE.match(request.headers.get('Range', '').strip())
+    if not match or not any(match.groups()):
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        # Syntactically invalid, so the header is ignored (RFC 9110 14.2).
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the final N bytes.
+        start = max(size - int(last), 0)
+        end = size - 1
+
+    if start >= size or start > end:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    length = end - start + 1
+    response = StreamingHttpResponse(_file_chunks(path, start, length), status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(length)
+    return response
+
+
+def serve_protected(request, storage, name):
+    """Return a response delivering ``name`` from ``storage``; the caller has already authorised it."""
+    if not name or not storage.exists(name):
+        raise Http404('File not found')
+
+    etag = '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(name)[0]
+        inline = content_type in INLINE_CONTENT_TYPES
+        if not inline:
+            content_type = 'application/octet-stream'
+        backend = getattr(settings, 'RECEIPT_SENDFILE_BACKEND', None)
+        if backend == 'nginx':
+            response = HttpResponse(content_type=content_type)
+            prefix = getattr(settings, 'RECEIPT_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + name)
+        elif backend == 'apache':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = storage.path(name)
+        else:
+            path = storage.path(name)
+            response = _ranged_response(request, path, os.path.getsize(path), content_type)
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = 'inline' if inline else (
+            'attachment; filename="%s"' % posixpath.basename(name)
+        )
+
+    response['ETag'] = etag
+    response['X-Content-Type-Options'] = 'nosniff'
+    patch_cache_control(response, private=True, max_age=RECEIPT_MAX_AGE)
+    return response
@@ -0,0 +1,290 @@
+"""
+Company-based tenant sharding.
+
+Each company's rows (the company itself, its users, rules, expenses, approvals
+and everything hanging off them, plus the tasks its requests queue) live
+together on one database alias from ``TENANT_SHARDS``, so foreign keys never
+cross databases. ``TenantShard`` rows in 'default' map a company to its alias;
+a company without one lives on 'default', which is where everything was before
+sharding, so turning it on needs no backfill.
+
+``TenantRouter`` picks the database for each query:
+
+* an instance loaded from a shard stays there, and a new instance with a
+  ``company_id`` (or a ``Company`` with an id) goes to that company's shard;
+* anything else goes to the current shard, which ``TenantMiddleware`` sets
+  from the session for each request and ``tenant()`` / ``using_shard()`` set
+  for commands and workers;
+* the directory tables and sessions always use 'default'.
+
+Transactions around tenant writes use ``atomic()`` (``transaction.atomic`` on
+the current shard), and jobs that cover every company loop over
+``each_shard()``. Logins and invite links name no company, so ``find_user``
+looks the user up on each shard in turn.
+
+Once more than one shard is configured, primary keys of the app's models come
+from ``IdBlock`` leases in 'default' instead of each database's own sequence.
+Ids then never repeat across shards, and ``rebalance_company`` can move a
+company with its ids, and so its URLs and receipt links, intact. (Change
+events keep per-database ids; see rebalance.py.)
+
+With ``TENANT_SHARDS = ['default']`` (the default) the router has no opinion
+and none of this costs a query.
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Max
+
+# Always in 'default' and created nowhere else: sessions and the directory tables.
+GLOBAL_MODELS = {'sessions.session', 'ExpenseManagement_app.tenantshard', 'ExpenseManagement_app.idblock'}
+COMPANY_SESSION_KEY = '_tenant_company_id'
+SHARD_SESSION_KEY = '_tenant_shard'
+# Ids leased per model and process at a time; a restart skips at most this many.
+ID_BLOCK_SIZE = 100
+
+_current = ContextVar('tenant_shard', default=(None, None))
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+class TenantReadOnly(Exception):
+    """The company is being moved to another shard; writes are refused until the move finishes."""
+
+
+def shard_aliases():
+    return list(getattr(settings, 'TENANT_SHARDS', ['default']))
+
+
+def is_sharded():
+    return len(shard_aliases()) > 1
+
+
+def current_shard():
+    return _current.get()[0] or 'default'
+
+
+def current_company_id():
+    return _current.get()[1]
+
+
+@contextmanager
+def using_shard(alias, company_id=None):
+    """Send queries without another routing hint to ``alias`` inside the block."""
+    token = _current.set((alias, company_id))
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def tenant(company_id):
+    """Send queries inside the block to ``company_id``'s shard."""
+    return using_shard(shard_for(company_id), company_id)
+
+
+def each_shard():
+    """Yield every shard alias, with it as the current shard while the caller's loop body runs."""
+    for alias in shard_aliases():
+        with using_shard(alias):
+            yield alias
+
+
+def atomic(savepoint=True):
+    """``transaction.atomic`` on the current shard."""
+    return transaction.atomic(using=current_shard(), savepoint=savepoint)
+
+
+# --- Directory ---
+
+def _directory_key(company_id):
+    return f'sharding:company:{company_id}'
+
+
+def directory_entry(company_id, cached=True):
+    """``(alias, read_only)`` for a company. Cached for ``TENANT_DIRECTORY_TIMEOUT`` seconds."""
+    if not is_sharded():
+        return 'default', False
+    key = _directory_key(company_id)
+    entry = cache.get(key) if cached else None
+    if entry is None:
+        TenantShard = apps.get_model('ExpenseManagement_app', 'TenantShard')
+        row = TenantShard.objects.filter(company_id=company_id).values_list('alias', 'read_only').first()
+        entry = tuple(row) if row else ('default', False)
+        cache.set(key, entry, getattr(settings, 'TENANT_DIRECTORY_TIMEOUT', 30))
+    return entry
+
+
+def shard_for(company_id):
+    return directory_entry(company_id)[0]
+
+
+def assign_shard(company_id, alias, read_only=False):
+    """Point the directory entry for ``company_id`` at ``alias``."""
+    TenantShard = apps.get_model('ExpenseManagement_app', 'TenantShard')
+    TenantShard.objects.update_or_create(company_id=company_id, defaults={'alias': alias, 'read_only': read_only})
+    cache.delete(_directory_key(company_id))
+
+
+def place_new_company():
+    """Shard for a new company: ``TENANT_NEW_COMPANY_SHARD`` if set, else the one with the fewest companies."""
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    configured = getattr(settings, 'TENANT_NEW_COMPANY_SHARD', None)
+    if configured:
+        return configured
+    Company = apps.get_model('ExpenseManagement_app', 'Company')
+    return min(aliases, key=lambda alias: Company.objects.using(alias).count())
+
+
+def find_user(**lookup):
+    """The first user matching ``lookup`` on any shard, or None."""
+    User = get_user_model()
+    for alias in shard_aliases():
+        user = User._default_manager.using(alias).filter(**lookup).first()
+        if user is not None:
+            return user
+    return None
+
+
+# --- Routing ---
+
+def _company_of(instance):
+    if instance._meta.label_lower == 'ExpenseManagement_app.company':
+        return instance.pk
+    return getattr(instance, 'company_id', None)
+
+
+class TenantRouter:
+    """Routes tenant rows to their company's shard and the directory and sessions to 'default'."""
+
+    def _route(self, model, hints):
+        if model._meta.label_lower in GLOBAL_MODELS:
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None:
+            if instance._state.db:
+                return instance._state.db
+            company_id = _company_of(instance)
+            if company_id:
+                return shard_for(company_id)
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded():
+            return None
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded():
+            return None
+        if model._meta.label_lower not in GLOBAL_MODELS:
+            instance = hints.get('instance')
+            company_id = (_company_of(instance) if instance is not None else None) or current_company_id()
+            if company_id and directory_entry(company_id)[1]:
+                raise TenantReadOnly(f'Company {company_id} is being moved to another shard; try again shortly')
+        return self._route(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name and f'{app_label}.{model_name}' in GLOBAL_MODELS:
+            return db == 'default'
+        return None
+
+
+class TenantMiddleware:
+    """Makes the signed-in user's shard current for the request. Goes right after SessionMiddleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_sharded():
+            return self.get_response(request)
+        # The company, not the alias, so a session survives its company being moved.
+        company_id = request.session.get(COMPANY_SESSION_KEY)
+        if company_id:
+            context = tenant(company_id)
+        else:
+            context = using_shard(request.session.get(SHARD_SESSION_KEY, 'default'))
+        with context:
+            return self.get_response(request)
+
+
+def _remember_tenant(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        request.session[COMPANY_SESSION_KEY] = user.company_id
+        request.session[SHARD_SESSION_KEY] = user._state.db or 'default'
+
+
+def connect_signals():
+    user_logged_in.connect(_remember_tenant, dispatch_uid='sharding_remember_tenant')
+
+
+# --- Ids ---
+
+def _lease(model):
+    # Also above the highest id on any shard, in case a lease was rolled back
+    # after ids from it had been committed elsewhere.
+    floor = 1 + max(
+        model._base_manager.using(alias).aggregate(top=Max('pk'))['top'] or 0
+        for alias in shard_aliases()
+    )
+    IdBlock = apps.get_model('ExpenseManagement_app', 'IdBlock')
+    with transaction.atomic(using='default'):
+        block, _ = IdBlock.objects.select_for_update().get_or_create(
+            model=model._meta.label_lower, defaults={'next_id': floor},
+        )
+        start = max(block.next_id, floor)
+        block.next_id = start + ID_BLOCK_SIZE
+        block.save(update_fields=['next_id'])
+    return [start, start + ID_BLOCK_SIZE]
+
+
+def allocate_id(model):
+    """A primary key for ``model`` that no shard has used or will hand out."""
+    label = model._meta.label_lower
+    with _blocks_lock:
+        block = _blocks.get(label)
+        if block is None or block[0] >= block[1]:
+            block = _blocks[label] = _lease(model)
+        block[0] += 1
+        return block[0] - 1
+
+
+def _no_default():
+    return None
+
+
+class TenantAutoField(models.BigAutoField):
+    """
+    ``BigAutoField`` whose values come from ``allocate_id`` when sharded. The
+    column is the same, so it deconstructs as ``BigAutoField`` and needs no
+    migration.
+    """
+
+    @property
+    def default(self):
+        # With a pk default, save() inserts a new row straight away instead of
+        # first trying an UPDATE with the allocated id. Unsharded there is no
+        # allocated id, and an explicit pk must still update an existing row.
+        return _no_default if is_sharded() else self._default
+
+    @default.setter
+    def default(self, value):
+        self._default = value
+
+    def get_pk_value_on_save(self, instance):
+        return allocate_id(instance._meta.concrete_model) if is_sharded() else None
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop('default', None)
+        return name, 'django.db.models.BigAutoField', args, kwargs
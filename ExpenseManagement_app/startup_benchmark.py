@@ -0,0 +1,101 @@
+"""
+Cold-start measurements for the web process.
+
+Each measurement runs in a fresh interpreter so nothing already imported by the
+caller (test runner, manage.py) hides the real cost a new WSGI worker pays.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+# Budgets are deliberately generous: they catch a heavy import sneaking back
+# into module scope, not a few milliseconds of noise.
+IMPORT_BUDGET_MS = 1500
+FIRST_RESPONSE_BUDGET_MS = 3000
+
+# Modules that must only be imported by the code paths that need them.
+HEAVY_MODULES = ('pytesseract', 'PIL.Image', 'requests')
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (.*)$')
+
+_WORKER_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+from ExpenseManagement_project.wsgi import application
+loaded = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {{'PATH_INFO': {path!r}, 'REQUEST_METHOD': 'GET'}}
+setup_testing_defaults(environ)
+statuses = []
+body = b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+done = time.perf_counter()
+print(json.dumps({{
+    'status': statuses[0],
+    'load_ms': (loaded - start) * 1000,
+    'first_response_ms': (done - start) * 1000,
+    'heavy_modules': sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def _run(args):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    return subprocess.run(
+        [sys.executable, *args], cwd=settings.BASE_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+
+
+def measure_import_time(path='/'):
+    """Return the summed ``-X importtime`` self time (ms) of a fresh worker plus its top imports."""
+    script = _WORKER_SCRIPT.format(
+        settings_module=settings.SETTINGS_MODULE, path=path, heavy=HEAVY_MODULES,
+    )
+    result = _run(['-X', 'importtime', '-c', script])
+
+    total_us = 0
+    cumulative = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            total_us += int(self_us)
+            if not name.startswith(' '):
+                cumulative.append((int(cumulative_us) / 1000, name.strip()))
+
+    cumulative.sort(reverse=True)
+    return {'total_ms': total_us / 1000, 'top': cumulative[:10]}
+
+
+def measure_first_response(path='/'):
+    """Boot a fresh WSGI worker, serve one GET for ``path`` and report timings."""
+    script = _WORKER_SCRIPT.format(
+        settings_module=settings.SETTINGS_MODULE, path=path, heavy=HEAVY_MODULES,
+    )
+    started = time.perf_counter()
+    result = _run(['-c', script])
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    # Includes interpreter start-up, which an autoscaled worker also pays.
+    report['process_ms'] = (time.perf_counter() - started) * 1000
+    return report
+
+
+def run_benchmark(path='/', runs=3):
+    """Median of ``runs`` cold starts for both measurements."""
+    imports = [measure_import_time(path) for _ in range(runs)]
+    responses = [measure_first_response(path) for _ in range(runs)]
+    return {
+        'import_total_ms': statistics.median(r['total_ms'] for r in imports),
+        'top_imports': imports[-1]['top'],
+        'first_response_ms': statistics.median(r['first_response_ms'] for r in responses),
+        'process_ms': statistics.median(r['process_ms'] for r in responses),
+        'status': responses[-1]['status'],
+        'heavy_modules': responses[-1]['heavy_modules'],
+    }
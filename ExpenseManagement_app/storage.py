@@ -0,0 +1,137 @@
+"""
+Storage backends.
+
+Receipt files are named after the SHA-256 of their content, so uploading the same
+receipt twice stores it once. Uploads are streamed to disk chunk by chunk while
+being hashed, never held whole in memory. The partial file is written to
+``temp_dir``, outside the storage root so it is never reachable by URL, and
+renamed into place once complete. Because names are shared between expenses,
+a receipt file must not be deleted just because one expense that references
+it is.
+
+The static files storage adds compressed copies of the hashed assets
+``collectstatic`` writes.
+"""
+import errno
+import gzip
+import hashlib
+import os
+import posixpath
+import shutil
+import tempfile
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage, storages
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def __init__(self, *args, temp_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._temp_dir = temp_dir
+
+    @property
+    def temp_dir(self):
+        # A sibling of the root by default, so the final rename stays on one filesystem.
+        return self._temp_dir or os.path.normpath(self.location) + '.tmp'
+
+    def get_available_name(self, name, max_length=None):
+        # Identical names mean identical content, so there is nothing to avoid.
+        return name
+
+    def hashed_name(self, name, digest):
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    def _save(self, name, content):
+        os.makedirs(self.temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            final_name = self.hashed_name(name, digest.hexdigest())
+            final_path = self.path(final_name)
+            if os.path.exists(final_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                try:
+                    os.replace(temp_path, final_path)
+                except OSError as e:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    # temp_dir was configured on another filesystem.
+                    shutil.move(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return final_name
+
+
+def receipt_storage():
+    """Storage used for receipt originals and thumbnails (``STORAGES['receipts']``)."""
+    return storages['receipts']
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Content-hashed static files (``app.3f2a9c1b.css``) plus ``.gz`` and, when
+    the ``brotli`` package is installed, ``.br`` siblings, so the web server can
+    send them as-is (nginx ``gzip_static``/``brotli_static``) with far-future
+    cache headers. A changed file gets a new name, so caches never go stale.
+    """
+    compress_extensions = ('.css', '.js', '.svg', '.json', '.txt', '.map')
+    min_compress_size = 512
+    # Collected files missing from the manifest are hashed on demand; files that
+    # were never collected still raise, so a skipped collectstatic is not hidden.
+    manifest_strict = False
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run=dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if not dry_run:
+            for hashed_name in sorted(hashed_names):
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        """Write compressed siblings of ``name``. Returns the suffixes written."""
+        if not name.endswith(self.compress_extensions):
+            return []
+        with self.open(name) as source:
+            content = source.read()
+        if len(content) < self.min_compress_size:
+            return []
+
+        variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        brotli = _brotli()
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content, quality=11)
+        written = []
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(content):
+                with open(self.path(name + suffix), 'wb') as out:
+                    out.write(compressed)
+                written.append(suffix)
+        return written
@@ -0,0 +1,149 @@
+"""
+A small database-backed task queue.
+
+Tasks are rows in ``Task``. Workers (``manage.py runworker``) claim due rows with
+``SELECT ... FOR UPDATE SKIP LOCKED`` where the backend supports it, and with a
+conditional ``UPDATE`` (compare-and-set on status) everywhere else, e.g. SQLite.
+
+With several shards each one has its own queue: a task is stored on the shard
+that was current when it was queued, next to the rows it works on, and runs
+with that shard current. ``run_pending`` and the worker drain every shard.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, connections
+from django.utils import timezone
+
+from . import sharding
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 60 * 60
+# A running task whose worker has not finished within this window is assumed lost.
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+_registry = {}
+
+
+def task(name):
+    """Register a function as the handler for tasks called ``name``."""
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, idempotency_key=None, run_at=None, max_attempts=5):
+    """
+    Queue ``name`` to run with ``payload`` as keyword arguments.
+
+    Enqueueing twice with the same ``idempotency_key`` returns the existing task
+    instead of creating a second one. Call this inside the transaction that
+    writes the data the task needs so the two commit together.
+    """
+    fields = {
+        'name': name,
+        'payload': payload or {},
+        'run_at': run_at or timezone.now(),
+        'max_attempts': max_attempts,
+        'company_id': sharding.current_company_id(),
+    }
+    if idempotency_key is None:
+        return Task.objects.create(**fields)
+    try:
+        with sharding.atomic():
+            return Task.objects.create(idempotency_key=idempotency_key, **fields)
+    except IntegrityError:
+        return Task.objects.get(idempotency_key=idempotency_key)
+
+
+def _release_stale_locks(now):
+    Task.objects.filter(status='running', locked_at__lt=now - LOCK_TIMEOUT).update(
+        status='queued', locked_by='', locked_at=None,
+    )
+
+
+def claim(worker_id, limit=1):
+    """Mark up to ``limit`` due tasks on the current shard as running for ``worker_id`` and return them."""
+    now = timezone.now()
+    _release_stale_locks(now)
+    due = Task.objects.filter(status='queued', run_at__lte=now).order_by('run_at')
+
+    if connections[sharding.current_shard()].features.has_select_for_update_skip_locked:
+        with sharding.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Task.objects.filter(id__in=ids).update(status='running', locked_by=worker_id, locked_at=now)
+    else:
+        ids = []
+        for task_id in due.values_list('id', flat=True)[:limit]:
+            # Only one worker can flip a given row from queued to running.
+            if Task.objects.filter(id=task_id, status='queued').update(
+                status='running', locked_by=worker_id, locked_at=now,
+            ):
+                ids.append(task_id)
+
+    return list(Task.objects.filter(id__in=ids, locked_by=worker_id))
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def run(task_obj):
+    """
+    Execute a claimed task and record the outcome, rescheduling it on failure.
+
+    Returns the new status, or 'lost' if the task ran past ``LOCK_TIMEOUT``,
+    was released and has been claimed again; the other worker's outcome then
+    stands and this one is discarded.
+    """
+    task_obj.attempts += 1
+    handler = _registry.get(task_obj.name)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for task "{task_obj.name}"')
+        handler(**task_obj.payload)
+    except Exception:
+        task_obj.last_error = traceback.format_exc()
+        if task_obj.attempts >= task_obj.max_attempts or handler is None:
+            task_obj.status = 'failed'
+            logger.error('Task %s failed permanently', task_obj, exc_info=True)
+        else:
+            task_obj.status = 'queued'
+            task_obj.run_at = timezone.now() + backoff(task_obj.attempts)
+            logger.warning('Task %s failed, retrying at %s', task_obj, task_obj.run_at, exc_info=True)
+    else:
+        task_obj.status = 'done'
+        task_obj.last_error = ''
+
+    # Only the holder of this claim may finish the task.
+    finished = Task.objects.filter(
+        id=task_obj.id, status='running', locked_by=task_obj.locked_by, locked_at=task_obj.locked_at,
+    ).update(
+        status=task_obj.status, attempts=task_obj.attempts, run_at=task_obj.run_at,
+        last_error=task_obj.last_error, locked_by='', locked_at=None, updated_at=timezone.now(),
+    )
+    if not finished:
+        logger.warning('Task %s lost its lock to another worker; discarding this run', task_obj)
+        return 'lost'
+    task_obj.locked_by = ''
+    task_obj.locked_at = None
+    return task_obj.status
+
+
+def run_pending(worker_id='inline', limit=100):
+    """Claim and run due tasks on every shard until none are left or ``limit`` were run; returns the count."""
+    processed = 0
+    for _ in sharding.each_shard():
+        while processed < limit:
+            claimed = claim(worker_id, limit=min(10, limit - processed))
+            if not claimed:
+                break
+            for task_obj in claimed:
+                run(task_obj)
+                processed += 1
+    return processed
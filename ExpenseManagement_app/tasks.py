@@ -0,0 +1,72 @@
+"""Handlers for work deferred from request/response cycles (see taskqueue)."""
+from . import sharding
+from .currency import convert_currency_strict
+from .duplicates import check_same_details, fingerprint_receipt
+from .escalations import escalate_stale_approvals
+from .models import Expense, ExpenseApproval
+from .notifications import notify_pending_approvals, send_approval_digests
+from .policies import record_spend
+from .receipts import generate_thumbnail
+from .taskqueue import task
+
+
+@task('expenses.process_submitted')
+def process_submitted_expense(expense_id):
+    """Convert the amount, open the first approval step and check spend policies for a new expense. Safe to re-run."""
+    expense = Expense.objects.select_related('company', 'employee').filter(id=expense_id).first()
+    if expense is None:
+        return
+
+    update_fields = []
+    if expense.amount_in_company_currency is None:
+        # Network call stays outside the transaction so no row lock is held while
+        # waiting. A provider failure raises, so the queue retries with backoff
+        # instead of storing the unconverted amount.
+        expense.amount_in_company_currency = convert_currency_strict(
+            expense.amount, expense.currency, expense.company.currency
+        )
+        update_fields.append('amount_in_company_currency')
+
+    with sharding.atomic():
+        manager_id = expense.employee.manager_id if expense.employee else None
+        if manager_id:
+            approval, created = ExpenseApproval.objects.get_or_create(
+                expense=expense,
+                approver_id=manager_id,
+                step_number=1,
+                defaults={'status': 'pending'},
+            )
+            if created:
+                notify_pending_approvals([approval])
+            if expense.current_step == 0:
+                expense.current_step = 1
+                update_fields.append('current_step')
+        if update_fields:
+            expense.save(update_fields=update_fields + ['updated_at'])
+
+    record_spend(expense)
+    check_same_details(expense)
+
+
+@task('receipts.generate_thumbnail')
+def generate_receipt_thumbnail(expense_id):
+    expense = Expense.objects.filter(id=expense_id).first()
+    if expense is not None:
+        generate_thumbnail(expense)
+
+
+@task('receipts.fingerprint')
+def fingerprint_expense_receipt(expense_id):
+    expense = Expense.objects.filter(id=expense_id).first()
+    if expense is not None:
+        fingerprint_receipt(expense)
+
+
+@task('notifications.send_approval_digests')
+def send_approval_digests_task():
+    send_approval_digests()
+
+
+@task('approvals.escalate_stale')
+def escalate_stale_approvals_task():
+    escalate_stale_approvals()
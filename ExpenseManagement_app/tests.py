@@ -1,3 +1,1623 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.paginator import EmptyPage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import cssbuild, http_client, sharding
+from .views import can_view_expense, create_submitted_expense
+from .admin import EstimatedCountPaginator
+from .duplicates import MAX_DISTANCE, bands, check_same_details, dhash, find_similar, fingerprint_receipt, to_signed
+from .currency import aconvert_currency, convert_currency, convert_currency_strict
+from .archive import archive_closed_expenses, expense_history, spend_summary
+from .changefeed import changes_since
+from .countries import load_dataset
+from .escalations import escalate_stale_approvals, overdue_approvals
+from .identity import CachedIdentityBackend
+from .models import (
+    ApprovalNotification, ApprovalRule, ArchivedExpense, ArchivedExpenseApproval, ChangeEvent, Company, CustomUser,
+    DuplicateFlag, Expense, ExpenseApproval, ExpenseRollup, PolicyViolation, ReceiptFingerprint, SpendCounter,
+    SpendPolicy, Task, TenantShard,
+)
+from .notifications import notify_pending_approvals, send_approval_digests
+from .policies import rebuild_counters, release_spend
+from .ocr import OCR_TEXT_MAX_LENGTH, clean_ocr_text
+from .search import filter_expenses, search_expenses
+from .provisioning import ProvisioningError, invite_links, provision_users, read_rows
+from .rebalance import count_rows
+from .startup_benchmark import (
+    FIRST_RESPONSE_BUDGET_MS, IMPORT_BUDGET_MS, measure_first_response, measure_import_time,
+)
+from .receipts import generate_thumbnail
+from .storage import CHUNK_SIZE, ContentAddressedStorage, PrecompressedManifestStaticFilesStorage
+from .taskqueue import LOCK_TIMEOUT, _registry, backoff, claim, enqueue, run, run_pending
+
+# Pages link their {% static %} files, and the manifest storage only resolves
+# those after collectstatic; tests that render pages use plain names instead.
+uncollected_static = override_settings(STORAGES={
+    **settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+
+
+class CountriesEndpointTests(SimpleTestCase):
+    url = '/api/countries/'
+
+    def test_gzip_is_negotiated_with_its_own_etag(self):
+        dataset = load_dataset()
+        gzipped = self.client.get(self.url, HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzipped['ETag'], dataset.gzip_etag)
+        self.assertEqual(json.loads(gzip.decompress(gzipped.content))['version'], dataset.version)
+
+        for header in ('', 'gzip;q=0', 'identity, gzip; q=0.0'):
+            plain = self.client.get(self.url, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(plain.has_header('Content-Encoding'), header)
+            self.assertEqual(plain['ETag'], dataset.etag)
+            self.assertEqual(plain.content, dataset.body)
+        self.assertNotEqual(dataset.etag, dataset.gzip_etag)
+
+    def test_conditional_get_matches_the_negotiated_representation(self):
+        dataset = load_dataset()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=dataset.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=dataset.etag, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=dataset.gzip_etag, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_versioned_url_is_immutable(self):
+        dataset = load_dataset()
+        pinned = self.client.get(self.url, {'v': dataset.version})
+        self.assertIn('immutable', pinned['Cache-Control'])
+        self.assertIn(f'max-age={60 * 60 * 24 * 365}', pinned['Cache-Control'])
+        for params in ({}, {'v': 'stale'}):
+            response = self.client.get(self.url, params)
+            self.assertNotIn('immutable', response['Cache-Control'])
+            self.assertIn(f'max-age={60 * 60 * 24}', response['Cache-Control'])
+
+
+    def test_refresh_keeps_the_source_currency_order(self):
+        data = [
+            {'name': {'common': 'Bhutan'}, 'cca2': 'BT', 'currencies': {'INR': {}, 'BTN': {}}},
+            {'name': {'common': 'Nowhere'}, 'cca2': 'XX', 'currencies': {}},
+        ]
+        command = 'ExpenseManagement_app.management.commands.refresh_countries'
+        with tempfile.TemporaryDirectory() as directory:
+            data_file = Path(directory) / 'countries.json'
+            with mock.patch(f'{command}.get_json', return_value=data), mock.patch(f'{command}.DATA_FILE', data_file):
+                call_command('refresh_countries', stdout=io.StringIO())
+            countries = json.loads(data_file.read_text())['countries']
+        self.assertEqual(countries, [{'code': 'BT', 'currencies': ['INR', 'BTN'], 'name': 'Bhutan'}])
+
+class ManagerSelectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.other = Company.objects.create(name='Other', country='India', currency='INR')
+        cls.admin_user = CustomUser.objects.create_user('root', password=None, company=cls.company, role='admin')
+        for name in ('alice', 'alan', 'bob'):
+            CustomUser.objects.create_user(name, password=None, company=cls.company, role='manager')
+        CustomUser.objects.create_user('alex', password=None, company=cls.company, role='employee')
+        cls.foreign = CustomUser.objects.create_user('albert', password=None, company=cls.other, role='manager')
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def test_autocomplete_lists_only_the_callers_company_managers(self):
+        response = self.client.get(reverse('manager_autocomplete'), {'q': 'al'})
+        self.assertEqual([row['username'] for row in response.json()['results']], ['alan', 'alice'])
+        self.assertIsNone(response.json()['next'])
+
+        with mock.patch('ExpenseManagement_app.views.MANAGER_AUTOCOMPLETE_LIMIT', 1):
+            first = self.client.get(reverse('manager_autocomplete')).json()
+            second = self.client.get(reverse('manager_autocomplete'), {'after': first['next']}).json()
+        self.assertEqual([row['username'] for row in first['results'] + second['results']], ['alan', 'alice'])
+
+        self.client.force_login(self.foreign)
+        response = self.client.get(reverse('manager_autocomplete'), {'q': 'al'})
+        self.assertEqual([row['username'] for row in response.json()['results']], ['albert'])
+
+    def test_foreign_or_stale_manager_is_rejected_without_creating_the_user(self):
+        for manager_id in (self.foreign.id, 999999, 'abc'):
+            response = self.client.post(reverse('create_employee'), {
+                'username': 'newbie', 'email': '', 'password': 'pw', 'role': 'employee', 'manager_id': manager_id,
+            })
+            self.assertRedirects(response, reverse('create_employee'), fetch_redirect_response=False)
+            self.assertFalse(CustomUser.objects.filter(username='newbie').exists())
+
+        alice = CustomUser.objects.get(username='alice')
+        self.client.post(reverse('create_employee'), {
+            'username': 'newbie', 'email': '', 'password': 'pw', 'role': 'employee', 'manager_id': alice.id,
+        })
+        self.assertEqual(CustomUser.objects.get(username='newbie').manager, alice)
+
+    @uncollected_static
+    def test_rejected_signup_keeps_the_pinned_countries_url(self):
+        version = load_dataset().version
+        for username, role in (('newcomer', 'owner'), ('alice', 'employee')):
+            response = self.client.post(reverse('signup'), {
+                'username': username, 'email': '', 'password': 'pw', 'company_name': 'New', 'country': 'India',
+                'role': role,
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['countries_version'], version)
+
+
+class ExpenseSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.other = Company.objects.create(name='Other', country='India', currency='INR')
+        cls.manager = CustomUser.objects.create_user('boss', password=None, company=cls.company, role='manager')
+        cls.alice = CustomUser.objects.create_user(
+            'alice', password=None, company=cls.company, role='employee', manager=cls.manager,
+        )
+        cls.bob = CustomUser.objects.create_user('bob', password=None, company=cls.company, role='employee')
+        cls.outsider = CustomUser.objects.create_user('eve', password=None, company=cls.other, role='employee')
+
+    def add(self, employee, description, merchant_name='', ocr_text=''):
+        return Expense.objects.create(
+            employee=employee, company_id=employee.company_id, amount=10, currency='INR', category='travel',
+            description=description, merchant_name=merchant_name, ocr_text=ocr_text, expense_date=date(2025, 1, 1),
+        )
+
+    def ids(self, queryset, text):
+        return [expense.id for expense in search_expenses(queryset, text)]
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        expense = self.add(self.alice, 'Taxi to airport', ocr_text='Receipt no 4711')
+        everything = Expense.objects.all()
+        self.assertEqual(self.ids(everything, 'taxi'), [expense.id])
+        self.assertEqual(self.ids(everything, '4711'), [expense.id])
+
+        expense.description = 'Hotel night'
+        expense.save()
+        self.assertEqual(self.ids(everything, 'taxi'), [])
+        self.assertEqual(self.ids(everything, 'hot'), [expense.id])
+        self.assertEqual(list(filter_expenses(everything, 'hotel')), [expense])
+
+        expense.delete()
+        self.assertEqual(self.ids(everything, 'hotel'), [])
+
+    def test_better_matches_rank_first(self):
+        weak = self.add(self.alice, 'Lunch with a client, parking nearby')
+        strong = self.add(self.alice, 'Parking parking garage', merchant_name='City Parking')
+        self.add(self.alice, 'Dinner')
+        self.assertEqual(self.ids(Expense.objects.all(), 'parking'), [strong.id, weak.id])
+
+    def test_results_stay_inside_the_visible_queryset(self):
+        own = self.add(self.alice, 'Conference ticket')
+        colleague = self.add(self.bob, 'Conference hotel')
+        foreign = self.add(self.outsider, 'Conference dinner')
+
+        self.assertEqual(self.ids(self.alice.get_visible_expenses(), 'conference'), [own.id])
+        self.assertEqual(self.ids(self.outsider.get_visible_expenses(), 'conference'), [foreign.id])
+        self.assertEqual(sorted(self.ids(Expense.objects.filter(company=self.company), 'conference')),
+                         [own.id, colleague.id])
+        # FTS syntax in the query is treated as plain words.
+        self.assertEqual(self.ids(self.alice.get_visible_expenses(), 'conference OR NOT "x" *'), [])
+
+        self.client.force_login(self.alice)
+        results = self.client.get(reverse('search_expenses'), {'q': 'conference'}).json()['results']
+        self.assertEqual([row['id'] for row in results], [own.id])
+
+    def test_submitted_ocr_text_is_cleaned_and_capped(self):
+        self.assertEqual(clean_ocr_text('Total\x00 12.50\r\nThanks\x1b'), 'Total  12.50 \nThanks')
+        self.assertEqual(len(clean_ocr_text('x' * (OCR_TEXT_MAX_LENGTH + 10))), OCR_TEXT_MAX_LENGTH)
+
+
+@uncollected_static
+class AdminChangelistScaleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.admin_user = CustomUser.objects.create_superuser(
+            'root', 'root@example.com', 'pass', company=cls.company, role='admin'
+        )
+        cls.manager = CustomUser.objects.create_user(
+            'boss', password=None, company=cls.company, role='manager'
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def add_expenses(self, count):
+        for i in range(count):
+            employee = CustomUser.objects.create_user(
+                f'emp{CustomUser.objects.count()}', password=None,
+                company=self.company, role='employee', manager=self.manager,
+            )
+            expense = Expense.objects.create(
+                employee=employee, company=self.company, amount=10 + i, currency='INR',
+                category='food', description='Lunch', expense_date=date(2025, 1, 1),
+            )
+            ExpenseApproval.objects.create(expense=expense, approver=self.manager, step_number=1)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_expenses(2)
+        self.count_queries(url)  # Warm the cached identity so both runs are measured alike.
+        small = self.count_queries(url)
+        self.add_expenses(20)
+        large = self.count_queries(url)
+        self.assertEqual(small, large)
+
+    def test_expense_changelist_queries_do_not_grow_with_rows(self):
+        self.assertConstantQueries(reverse('admin:ExpenseManagement_app_expense_changelist'))
+
+    def test_expense_approval_changelist_queries_do_not_grow_with_rows(self):
+        self.assertConstantQueries(reverse('admin:ExpenseManagement_app_expenseapproval_changelist'))
+
+    def test_paginator_counts_exactly_below_threshold(self):
+        self.add_expenses(3)
+        paginator = EstimatedCountPaginator(Expense.objects.all(), 2)
+        self.assertEqual(paginator.count, 3)
+
+    def test_paginator_estimates_above_threshold(self):
+        self.add_expenses(8)
+        Expense.objects.filter(pk__in=Expense.objects.order_by('pk').values('pk')[:2]).delete()
+
+        class SmallThresholdPaginator(EstimatedCountPaginator):
+            threshold = 5
+
+        # Without statistics there is nothing to estimate from; the deleted ids
+        # must not be counted either way.
+        paginator = SmallThresholdPaginator(Expense.objects.all(), 2)
+        self.assertEqual(paginator.count, 6)
+        self.assertTrue(paginator.truncated)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator = SmallThresholdPaginator(Expense.objects.all(), 2)
+        self.assertEqual(paginator.count, 6)
+        self.assertFalse(paginator.truncated)
+        self.assertEqual(paginator.num_pages, 3)
+
+    def test_pages_past_an_inexact_count_stay_reachable(self):
+        self.add_expenses(20)
+
+        class SmallThresholdPaginator(EstimatedCountPaginator):
+            threshold = 5
+
+        paginator = SmallThresholdPaginator(Expense.objects.order_by('pk'), 2)
+        self.assertEqual((paginator.count, paginator.num_pages), (6, 3))
+        self.assertEqual(len(paginator.page(5)), 2)
+        self.assertTrue(paginator.has_next_page)
+        paginator.page(10)
+        self.assertFalse(paginator.has_next_page)
+        with self.assertRaises(EmptyPage):
+            paginator.page(11)
+
+        url = reverse('admin:ExpenseManagement_app_expense_changelist')
+        with mock.patch.object(EstimatedCountPaginator, 'threshold', 5), \
+                mock.patch.object(admin_site._registry[Expense], 'list_per_page', 2):
+            response = self.client.get(url, {'p': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+        self.assertEqual(response.context['cl'].next_page_url, '?p=6')
+        self.assertContains(response, 'href="?p=4"')
+
+    def test_filtered_changelist_over_threshold_is_open_ended(self):
+        self.add_expenses(8)
+        Expense.objects.filter(amount__lt=12).update(category='travel')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        url = reverse('admin:ExpenseManagement_app_expense_changelist')
+        with mock.patch.object(EstimatedCountPaginator, 'threshold', 5):
+            filtered = self.client.get(url, {'category__exact': 'food'})
+            unfiltered = self.client.get(url)
+        self.assertTrue(filtered.context['cl'].paginator.truncated)
+        self.assertContains(filtered, 'more than 5')
+        self.assertFalse(unfiltered.context['cl'].paginator.truncated)
+        self.assertNotContains(unfiltered, 'more than')
+
+
+class StartupBudgetTests(SimpleTestCase):
+    def test_heavy_dependencies_are_not_imported_by_a_fresh_worker(self):
+        report = measure_first_response('/')
+        self.assertEqual(report['status'], '200 OK')
+        self.assertEqual(report['heavy_modules'], [])
+
+    def test_cold_start_within_budget(self):
+        self.assertLess(measure_import_time('/')['total_ms'], IMPORT_BUDGET_MS)
+        self.assertLess(measure_first_response('/')['first_response_ms'], FIRST_RESPONSE_BUDGET_MS)
+
+
+class RefusingEmailBackend(locmem.EmailBackend):
+    """Reports messages to mgr1 as not delivered, like a backend with fail_silently set."""
+
+    def send_messages(self, messages):
+        return super().send_messages([m for m in messages if 'mgr1@example.com' not in m.to])
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class ApprovalDigestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.managers = [
+            CustomUser.objects.create_user(
+                f'mgr{i}', email=f'mgr{i}@example.com', password=None, company=cls.company, role='manager'
+            )
+            for i in range(2)
+        ]
+        cls.employee = CustomUser.objects.create_user('emp', password=None, company=cls.company)
+
+    def create_approvals(self, approver, count):
+        approvals = []
+        for i in range(count):
+            expense = Expense.objects.create(
+                employee=self.employee, company=self.company, amount=100 + i, currency='INR',
+                category='food', description=f'Team lunch {i}', expense_date=date(2025, 1, 1),
+            )
+            approvals.append(ExpenseApproval.objects.create(expense=expense, approver=approver, step_number=1))
+        return approvals
+
+    def test_events_are_batched_into_one_digest_per_approver(self):
+        notify_pending_approvals(self.create_approvals(self.managers[0], 3))
+        notify_pending_approvals(self.create_approvals(self.managers[1], 1))
+
+        with mock.patch('ExpenseManagement_app.notifications.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(send_approval_digests(), 2)
+        self.assertEqual(get_connection.call_count, 1)
+
+        self.assertEqual(len(mail.outbox), 2)
+        digest = next(m for m in mail.outbox if m.to == ['mgr0@example.com'])
+        self.assertEqual(digest.subject, '3 expenses awaiting your approval')
+        self.assertFalse(ApprovalNotification.objects.filter(sent_at__isnull=True).exists())
+
+        self.assertEqual(send_approval_digests(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_decided_approvals_are_not_announced(self):
+        approvals = self.create_approvals(self.managers[0], 3)
+        notify_pending_approvals(approvals)
+        ExpenseApproval.objects.filter(id=approvals[0].id).update(status='approved')
+        ExpenseApproval.objects.filter(id=approvals[1].id).update(status='escalated')
+
+        self.assertEqual(send_approval_digests(), 1)
+        self.assertEqual(mail.outbox[0].subject, '1 expense awaiting your approval')
+        self.assertIn('Team lunch 2', mail.outbox[0].body)
+        self.assertNotIn('Team lunch 0', mail.outbox[0].body)
+        self.assertFalse(ApprovalNotification.objects.filter(sent_at__isnull=True).exists())
+
+    @override_settings(EMAIL_BACKEND='ExpenseManagement_app.tests.RefusingEmailBackend')
+    def test_only_delivered_digests_are_marked_sent(self):
+        notify_pending_approvals(self.create_approvals(self.managers[0], 1))
+        notify_pending_approvals(self.create_approvals(self.managers[1], 2))
+
+        with mock.patch('ExpenseManagement_app.notifications.schedule_digest') as schedule_digest:
+            self.assertEqual(send_approval_digests(), 1)
+        self.assertEqual([m.to for m in mail.outbox], [['mgr0@example.com']])
+        unsent = ApprovalNotification.objects.filter(sent_at__isnull=True)
+        self.assertEqual(set(unsent.values_list('recipient', flat=True)), {self.managers[1].id})
+        self.assertEqual(unsent.count(), 2)
+        # Retried in the next window rather than lost.
+        schedule_digest.assert_called_once_with()
+
+    def test_one_digest_task_is_queued_per_window(self):
+        notify_pending_approvals(self.create_approvals(self.managers[0], 2))
+        notify_pending_approvals(self.create_approvals(self.managers[1], 2))
+        self.assertEqual(Task.objects.filter(name='notifications.send_approval_digests').count(), 1)
+
+
+def receipt_png(color='red', size=(800, 600)):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, 'PNG')
+    return out.getvalue()
+
+
+def use_temporary_receipt_storage(test):
+    """Point both receipt fields at a fresh storage in a temporary directory for the test."""
+    root = tempfile.TemporaryDirectory()
+    test.addCleanup(root.cleanup)
+    storage = ContentAddressedStorage(location=os.path.join(root.name, 'media'))
+    for model in (Expense, ArchivedExpense):
+        for name in ('receipt_image', 'receipt_thumbnail'):
+            patcher = mock.patch.object(model._meta.get_field(name), 'storage', storage)
+            patcher.start()
+            test.addCleanup(patcher.stop)
+    patcher = mock.patch('ExpenseManagement_app.views.receipt_storage', return_value=storage)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    return storage
+
+
+class ReceiptStorageTests(TestCase):
+    def setUp(self):
+        self.storage = use_temporary_receipt_storage(self)
+        self.location = self.storage.location
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('receipts/a.PNG', ContentFile(b'same bytes'))
+        second = self.storage.save('receipts/b.png', ContentFile(b'same bytes'))
+        other = self.storage.save('receipts/c.png', ContentFile(b'other bytes'))
+
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first, f'receipts/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        files = [name for _, _, names in os.walk(self.location) for name in names]
+        self.assertEqual(len(files), 2)
+
+    def test_large_upload_is_hashed_in_chunks_outside_the_media_root(self):
+        data = os.urandom(CHUNK_SIZE * 3 + 17)
+        upload = SimpleUploadedFile('scan.jpg', data)
+        with mock.patch.object(upload, 'chunks', wraps=upload.chunks) as chunks:
+            name = self.storage.save('receipts/scan.jpg', upload)
+        chunks.assert_called_once_with(CHUNK_SIZE)
+
+        self.assertEqual(name, self.storage.hashed_name('receipts/scan.jpg', hashlib.sha256(data).hexdigest()))
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertFalse(self.storage.temp_dir.startswith(os.path.join(self.location, '')))
+        self.assertEqual(os.listdir(self.storage.temp_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.location, 'tmp')))
+
+    def test_thumbnail_is_generated_once_and_shared(self):
+        company = Company.objects.create(name='Acme', country='India', currency='INR')
+        employee = CustomUser.objects.create_user('emp', password=None, company=company, role='employee')
+        expenses = [
+            Expense.objects.create(
+                employee=employee, company=company, amount=10, currency='INR', category='food',
+                description='Lunch', expense_date=date(2025, 1, 1),
+                receipt_image=SimpleUploadedFile('lunch.png', receipt_png()),
+            )
+            for _ in range(2)
+        ]
+        self.assertEqual(expenses[0].receipt_image.name, expenses[1].receipt_image.name)
+
+        self.assertTrue(generate_thumbnail(expenses[0]))
+        self.assertFalse(generate_thumbnail(expenses[0]))
+        self.assertTrue(generate_thumbnail(expenses[1]))
+        self.assertEqual(expenses[0].receipt_thumbnail.name, expenses[1].receipt_thumbnail.name)
+
+        from PIL import Image
+
+        with expenses[0].receipt_thumbnail.open('rb') as thumbnail, Image.open(thumbnail) as image:
+            self.assertLessEqual(max(image.size), 320)
+        self.assertLess(expenses[0].receipt_thumbnail.size, expenses[0].receipt_image.size)
+
+
+class ReceiptAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.other = Company.objects.create(name='Other', country='India', currency='INR')
+        cls.manager = CustomUser.objects.create_user('boss', password=None, company=cls.company, role='manager')
+        cls.approver = CustomUser.objects.create_user('cfo', password=None, company=cls.company, role='manager')
+        cls.owner = CustomUser.objects.create_user(
+            'emp', password=None, company=cls.company, role='employee', manager=cls.manager,
+        )
+        cls.colleague = CustomUser.objects.create_user('peer', password=None, company=cls.company, role='employee')
+        cls.admin_user = CustomUser.objects.create_user('root', password=None, company=cls.company, role='admin')
+        cls.foreign_admin = CustomUser.objects.create_user('intruder', password=None, company=cls.other, role='admin')
+
+    def setUp(self):
+        use_temporary_receipt_storage(self)
+
+    def add_expense(self, filename='receipt.png', content=None, status='pending'):
+        expense = Expense.objects.create(
+            employee=self.owner, company=self.company, amount=10, currency='INR', category='food',
+            description='Lunch', expense_date=date(2024, 1, 1), status=status,
+            receipt_image=SimpleUploadedFile(filename, content if content is not None else receipt_png()),
+        )
+        ExpenseApproval.objects.create(expense=expense, approver=self.approver, step_number=2, status=status)
+        return expense
+
+    def assertAccess(self, expense_id, allowed, denied):
+        for user in allowed:
+            self.assertTrue(can_view_expense(user, expense_id), user.username)
+        for user in denied:
+            self.assertFalse(can_view_expense(user, expense_id), user.username)
+
+    def test_owner_manager_approver_and_company_admin_only(self):
+        expense = self.add_expense()
+        allowed = [self.owner, self.manager, self.approver, self.admin_user]
+        denied = [self.colleague, self.foreign_admin]
+        self.assertAccess(expense.id, allowed, denied)
+
+        expense.status = 'approved'
+        expense.save()
+        archive_closed_expenses(timezone.now() + timedelta(seconds=1))
+        self.assertFalse(Expense.objects.filter(id=expense.id).exists())
+        self.assertAccess(expense.id, allowed, denied)
+
+        self.client.force_login(self.approver)
+        self.assertEqual(self.client.get(reverse('expense_receipt', args=[expense.id])).status_code, 200)
+        self.client.force_login(self.foreign_admin)
+        self.assertEqual(self.client.get(reverse('expense_receipt', args=[expense.id])).status_code, 404)
+
+    def test_only_images_and_pdfs_are_served_inline(self):
+        self.client.force_login(self.owner)
+        image = self.client.get(reverse('expense_receipt', args=[self.add_expense().id]))
+        self.assertEqual(image['Content-Type'], 'image/png')
+        self.assertEqual(image['Content-Disposition'], 'inline')
+        self.assertEqual(image['X-Content-Type-Options'], 'nosniff')
+
+        for filename in ('receipt.html', 'receipt.svg'):
+            markup = self.add_expense(filename, b'<svg onload="alert(1)"></svg>')
+            response = self.client.get(reverse('expense_receipt', args=[markup.id]))
+            self.assertEqual(response['Content-Type'], 'application/octet-stream')
+            self.assertTrue(response['Content-Disposition'].startswith('attachment;'))
+            self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_head_and_range_requests(self):
+        self.client.force_login(self.owner)
+        expense = self.add_expense()
+        url = reverse('expense_receipt', args=[expense.id])
+        size = expense.receipt_image.size
+
+        self.assertEqual(self.client.head(url).status_code, 200)
+        partial = self.client.get(url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual((partial.status_code, partial['Content-Range']), (206, f'bytes 0-9/{size}'))
+        self.assertEqual(len(b''.join(partial.streaming_content)), 10)
+        # last < first is invalid and ignored; starting past the end is unsatisfiable.
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=9-0').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+
+
+def blocks_png(seed, size=(640, 480)):
+    """A receipt stand-in: a fixed random pattern of grey blocks, scaled to ``size``."""
+    import random
+
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.new('L', (16, 12))
+    image.putdata([rng.randrange(256) for _ in range(16 * 12)])
+    out = io.BytesIO()
+    image.resize(size, Image.Resampling.BILINEAR).convert('RGB').save(out, 'PNG')
+    return out.getvalue()
+
+
+class DuplicateDetectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.other = Company.objects.create(name='Other', country='India', currency='INR')
+        cls.employee = CustomUser.objects.create_user('emp', password=None, company=cls.company, role='employee')
+        cls.outsider = CustomUser.objects.create_user('eve', password=None, company=cls.other, role='employee')
+
+    def add_expense(self, employee=None, amount='42.00', merchant='Cafe', day=1, **fields):
+        employee = employee or self.employee
+        return Expense.objects.create(
+            employee=employee, company_id=employee.company_id, amount=Decimal(amount), currency='INR',
+            category='food', description='Lunch', merchant_name=merchant, expense_date=date(2025, 1, day), **fields
+        )
+
+    def index(self, value, employee=None):
+        expense = self.add_expense(employee)
+        ReceiptFingerprint.objects.create(
+            expense=expense, company_id=expense.company_id, phash=to_signed(value),
+            **{f'band{i}': band for i, band in enumerate(bands(value))},
+        )
+        return expense
+
+    def test_dhash_is_stable_for_resized_copies_and_differs_for_other_images(self):
+        receipt = dhash(io.BytesIO(blocks_png(1)))
+        self.assertEqual(receipt, dhash(io.BytesIO(blocks_png(1))))
+        self.assertLessEqual(bin(receipt ^ dhash(io.BytesIO(blocks_png(1, size=(1280, 960))))).count('1'), MAX_DISTANCE)
+        self.assertGreater(bin(receipt ^ dhash(io.BytesIO(blocks_png(2)))).count('1'), MAX_DISTANCE * 4)
+
+    def test_band_lookup_finds_hashes_up_to_the_threshold(self):
+        base = 0xF0E1D2C3B4A59687  # Top bit set: stored as a negative BigIntegerField.
+        # One differing bit in each of three bands still leaves one band equal.
+        three_apart = self.index(base ^ (1 | 1 << 16 | 1 << 32))
+        # One bit in every band: no band matches, so it is never a candidate.
+        self.index(base ^ (1 | 1 << 16 | 1 << 32 | 1 << 48))
+        # Four bits in one band share the other three bands but exceed the threshold.
+        self.index(base ^ 0b1111)
+        identical = self.index(base)
+
+        self.assertEqual(find_similar(self.company.id, base), [(identical.id, 0), (three_apart.id, 3)])
+        self.assertEqual(find_similar(self.company.id, base, exclude_expense_id=identical.id), [(three_apart.id, 3)])
+        self.assertEqual(len(find_similar(self.company.id, base, max_distance=4)), 3)
+
+    def test_no_matches_across_companies(self):
+        value = 0x0123456789ABCDEF
+        self.index(value, employee=self.outsider)
+        self.assertEqual(find_similar(self.company.id, value), [])
+
+        use_temporary_receipt_storage(self)
+        image = blocks_png(3)
+        foreign = self.add_expense(self.outsider, receipt_image=SimpleUploadedFile('r.png', image))
+        first = self.add_expense(receipt_image=SimpleUploadedFile('r.png', image))
+        second = self.add_expense(amount='13.00', receipt_image=SimpleUploadedFile('r.png', image))
+        fingerprint_receipt(foreign)
+        # The identical receipt in the other company is indexed but never matched.
+        self.assertEqual(fingerprint_receipt(first), [])
+        self.assertEqual(fingerprint_receipt(second), [(first.id, 0)])
+        self.assertEqual(fingerprint_receipt(second), [(first.id, 0)])
+        self.assertEqual(
+            list(DuplicateFlag.objects.values_list('expense', 'duplicate_of', 'reason')),
+            [(second.id, first.id, 'similar_receipt')],
+        )
+
+    def test_same_details_flags_only_earlier_claims_by_the_same_employee(self):
+        original = self.add_expense(merchant='Cafe')
+        self.add_expense(amount='41.99')
+        self.add_expense(day=2)
+        self.add_expense(self.outsider)
+        repeat = self.add_expense(merchant='CAFE')
+
+        self.assertEqual(check_same_details(repeat), [original.id])
+        self.assertEqual(check_same_details(original), [])
+        check_same_details(repeat)
+        self.assertEqual(
+            list(DuplicateFlag.objects.values_list('expense', 'duplicate_of', 'reason')),
+            [(repeat.id, original.id, 'same_details')],
+        )
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path.startswith('/v4/latest/'):
+            self.reply(200, {'base': self.path.rsplit('/', 1)[-1], 'rates': {'INR': 83.5}})
+        elif self.path == '/error':
+            self.reply(500, {'error': 'internal'})
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            self.reply(200, {})
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up first, which is what the timeout tests want.
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboundHTTPClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubProviderHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        http_client.reset()
+        StubProviderHandler.hits = []
+        endpoints = {'exchange_rates': {'base_url': self.base_url, 'connect_timeout': 0.5, 'read_timeout': 0.2}}
+        self.settings_override = self.settings(OUTBOUND_HTTP_ENDPOINTS=endpoints)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.addCleanup(http_client.reset)
+
+    def test_convert_currency_uses_provider_and_records_latency(self):
+        self.assertEqual(convert_currency(10, 'USD', 'INR'), Decimal('835.0'))
+        self.assertEqual(convert_currency(10, 'EUR', 'INR'), Decimal('835.0'))
+
+        metrics = http_client.get_metrics()[self.base_url.split('//')[1]]
+        self.assertEqual(metrics['calls'], 2)
+        self.assertEqual(metrics['errors'], 0)
+
+    def test_read_timeout_fails_fast(self):
+        started = time.monotonic()
+        with self.assertRaises(http_client.OutboundHTTPError):
+            http_client.get_json('exchange_rates', '/slow')
+        # Read timeout plus bounded retries, nowhere near the 0.5s per slow response.
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        for _ in range(http_client.BREAKER_FAILURE_THRESHOLD):
+            with self.assertRaises(http_client.OutboundHTTPError):
+                http_client.get_json('exchange_rates', '/error')
+        hits = len(StubProviderHandler.hits)
+
+        with self.assertRaises(http_client.CircuitOpenError):
+            http_client.get_json('exchange_rates', '/v4/latest/USD')
+        self.assertEqual(len(StubProviderHandler.hits), hits)
+        # Conversion degrades to the unconverted amount instead of blocking.
+        self.assertEqual(convert_currency(10, 'USD', 'INR'), Decimal(10))
+
+    def test_client_errors_and_bad_currency_codes_do_not_trip_the_breaker(self):
+        for _ in range(http_client.BREAKER_FAILURE_THRESHOLD * 2):
+            with self.assertRaises(http_client.OutboundHTTPError):
+                http_client.get_json('exchange_rates', '/missing')
+        self.assertEqual(convert_currency(10, 'USD', 'INR'), Decimal('835.0'))
+
+        hits = len(StubProviderHandler.hits)
+        for bogus in ('usd', 'US/../missing', 'USD?x=1', '', None):
+            with self.assertRaises(ValueError):
+                convert_currency_strict(10, bogus, 'INR')
+            self.assertEqual(convert_currency(10, bogus, 'INR'), Decimal(10))
+        self.assertEqual(len(StubProviderHandler.hits), hits)
+
+    def test_half_open_trial_is_released_after_an_unexpected_error(self):
+        for _ in range(http_client.BREAKER_FAILURE_THRESHOLD):
+            with self.assertRaises(http_client.OutboundHTTPError):
+                http_client.get_json('exchange_rates', '/error')
+        breaker, _ = http_client._host_state(self.base_url.split('//')[1])
+        breaker.opened_at -= breaker.reset_seconds
+
+        with mock.patch.object(http_client.get_session(), 'get', side_effect=RuntimeError('bug')):
+            with self.assertRaises(RuntimeError):
+                http_client.get_json('exchange_rates', '/v4/latest/USD')
+        self.assertEqual(breaker.state, 'half-open')
+        # The next call is allowed to be the trial, and closes the breaker.
+        self.assertEqual(convert_currency(10, 'USD', 'INR'), Decimal('835.0'))
+        self.assertEqual(breaker.state, 'closed')
+
+    async def test_async_client_shares_breaker_and_defers_conversion(self):
+        self.assertEqual(await aconvert_currency(10, 'USD', 'INR'), Decimal('835.0'))
+
+        for _ in range(http_client.BREAKER_FAILURE_THRESHOLD):
+            with self.assertRaises(http_client.OutboundHTTPError):
+                await http_client.aget_json('exchange_rates', '/error')
+        # The sync client sees the same open breaker, and async conversion
+        # returns None so the worker converts later.
+        with self.assertRaises(http_client.CircuitOpenError):
+            http_client.get_json('exchange_rates', '/v4/latest/USD')
+        self.assertIsNone(await aconvert_currency(10, 'USD', 'INR'))
+
+    def test_async_client_is_closed_with_its_loop(self):
+        async def call():
+            await http_client.aget_json('exchange_rates', '/v4/latest/USD')
+            return http_client._async_clients[asyncio.get_running_loop()][0]
+
+        client = asyncio.run(call())
+        self.assertTrue(client.is_closed)
+        self.assertEqual(http_client._async_clients, {})
+
+
+class AsyncSubmitExpenseTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubProviderHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.employee = CustomUser.objects.create_user('emp', password=None, company=cls.company, role='employee')
+
+    def setUp(self):
+        http_client.reset()
+        self.addCleanup(http_client.reset)
+        self.client.force_login(self.employee)
+
+    def submit(self):
+        return self.client.post(reverse('submit_expense'), {
+            'amount': '10', 'currency': 'USD', 'category': 'travel', 'description': 'Taxi',
+            'merchant_name': 'Cabs', 'expense_date': '2025-01-15',
+        })
+
+    def test_converts_inline_and_queues_follow_up(self):
+        endpoints = {'exchange_rates': {'base_url': self.base_url}}
+        with self.settings(OUTBOUND_HTTP_ENDPOINTS=endpoints):
+            response = self.submit()
+
+        self.assertRedirects(response, reverse('employee_dashboard'), fetch_redirect_response=False)
+        expense = Expense.objects.get()
+        self.assertEqual(expense.amount_in_company_currency, Decimal('835.00'))
+        self.assertTrue(Task.objects.filter(name='expenses.process_submitted').exists())
+
+    def test_unknown_currency_is_rejected(self):
+        response = self.client.post(reverse('submit_expense'), {
+            'amount': '10', 'currency': 'US/../x', 'category': 'travel', 'description': 'Taxi',
+            'merchant_name': 'Cabs', 'expense_date': '2025-01-15',
+        })
+        self.assertRedirects(response, reverse('submit_expense'), fetch_redirect_response=False)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_provider_failure_leaves_conversion_to_worker(self):
+        endpoints = {'exchange_rates': {'base_url': self.base_url + '/missing'}}
+        with self.settings(OUTBOUND_HTTP_ENDPOINTS=endpoints):
+            self.submit()
+
+        self.assertIsNone(Expense.objects.get().amount_in_company_currency)
+
+        # The worker keeps retrying while the provider is down, then converts.
+        with self.settings(OUTBOUND_HTTP_ENDPOINTS=endpoints):
+            run_pending()
+        task_obj = Task.objects.get(name='expenses.process_submitted')
+        self.assertEqual((task_obj.status, task_obj.attempts), ('queued', 1))
+        self.assertIsNone(Expense.objects.get().amount_in_company_currency)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.settings(OUTBOUND_HTTP_ENDPOINTS={'exchange_rates': {'base_url': self.base_url}}):
+            run_pending()
+        self.assertEqual(Task.objects.get(pk=task_obj.pk).status, 'done')
+        self.assertEqual(Expense.objects.get().amount_in_company_currency, Decimal('835.00'))
+
+
+class TaskQueueTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubProviderHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        http_client.reset()
+        self.addCleanup(http_client.reset)
+        self.calls = []
+        handlers = {'tests.record': lambda **kwargs: self.calls.append(kwargs), 'tests.fail': self.fail_task}
+        patcher = mock.patch.dict(_registry, handlers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail_task(self):
+        raise RuntimeError('boom')
+
+    def test_idempotency_key_returns_the_existing_task(self):
+        first = enqueue('tests.record', {'n': 1}, idempotency_key='once')
+        second = enqueue('tests.record', {'n': 2}, idempotency_key='once')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(Task.objects.get().payload, {'n': 1})
+
+    def test_claim_takes_due_tasks_once(self):
+        due = enqueue('tests.record', {'n': 1})
+        enqueue('tests.record', {'n': 2}, run_at=timezone.now() + timedelta(hours=1))
+
+        claimed = claim('a', limit=5)
+        self.assertEqual(claimed, [due])
+        self.assertEqual(claim('b', limit=5), [])
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.locked_by), ('running', 'a'))
+
+        self.assertEqual(run(claimed[0]), 'done')
+        self.assertEqual(self.calls, [{'n': 1}])
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.attempts, due.locked_by, due.locked_at), ('done', 1, '', None))
+
+    def test_failures_back_off_then_fail_permanently(self):
+        enqueue('tests.fail', max_attempts=2)
+        before = timezone.now()
+        self.assertEqual(run(claim('a')[0]), 'queued')
+        failed = Task.objects.get()
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('RuntimeError: boom', failed.last_error)
+        self.assertGreaterEqual(failed.run_at, before + backoff(1))
+        self.assertEqual(claim('a'), [])
+
+        Task.objects.update(run_at=timezone.now())
+        self.assertEqual(run(claim('a')[0]), 'failed')
+        self.assertEqual(backoff(1), timedelta(seconds=10))
+        self.assertEqual(backoff(30), timedelta(hours=1))
+
+        enqueue('tests.unknown')
+        self.assertEqual(run(claim('a')[0]), 'failed')
+
+    def test_stale_lock_is_released_and_the_old_worker_cannot_finish(self):
+        enqueue('tests.record', {'n': 1})
+        slow = claim('slow')[0]
+        Task.objects.update(locked_at=timezone.now() - LOCK_TIMEOUT - timedelta(seconds=1))
+        slow.locked_at = Task.objects.get().locked_at
+
+        fresh = claim('fresh')[0]
+        self.assertEqual(fresh.locked_by, 'fresh')
+        self.assertEqual(run(slow), 'lost')
+        self.assertEqual(Task.objects.get().status, 'running')
+        self.assertEqual(run(fresh), 'done')
+        self.assertEqual(Task.objects.get().attempts, 1)
+
+    def test_submitted_expense_is_retried_until_converted(self):
+        company = Company.objects.create(name='Acme', country='India', currency='INR')
+        manager = CustomUser.objects.create_user('boss', password=None, company=company, role='manager')
+        employee = CustomUser.objects.create_user(
+            'emp', password=None, company=company, role='employee', manager=manager,
+        )
+        expense, _ = create_submitted_expense(
+            employee, amount=Decimal('10'), currency='USD', amount_in_company_currency=None,
+            category='travel', description='Taxi', expense_date=date(2025, 1, 15),
+        )
+        task_filter = Task.objects.filter(name='expenses.process_submitted')
+
+        with self.settings(OUTBOUND_HTTP_ENDPOINTS={'exchange_rates': {'base_url': self.base_url + '/missing'}}):
+            run_pending()
+        task_obj = task_filter.get()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('queued', 1))
+        self.assertIn('OutboundHTTPError', task_obj.last_error)
+        expense.refresh_from_db()
+        self.assertIsNone(expense.amount_in_company_currency)
+
+        task_filter.update(run_at=timezone.now())
+        with self.settings(OUTBOUND_HTTP_ENDPOINTS={'exchange_rates': {'base_url': self.base_url}}):
+            run_pending()
+        self.assertEqual(task_filter.get().status, 'done')
+        expense.refresh_from_db()
+        self.assertEqual(expense.amount_in_company_currency, Decimal('835.00'))
+        self.assertEqual(expense.current_step, 1)
+        self.assertTrue(ExpenseApproval.objects.filter(expense=expense, approver=manager).exists())
+
+
+class SpendPolicyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.employee = CustomUser.objects.create_user('emp', password=None, company=cls.company, role='employee')
+        cls.policy = SpendPolicy.objects.create(
+            company=cls.company, name='Food', category='food', period='month', limit_amount=Decimal('5000'),
+        )
+
+    def setUp(self):
+        self.client.force_login(self.employee)
+
+    def submit(self, amount, expense_date='2025-03-10', category='food'):
+        self.client.post(reverse('submit_expense'), {
+            'amount': amount, 'currency': 'INR', 'category': category, 'description': 'Lunch',
+            'merchant_name': 'Cafe', 'expense_date': expense_date,
+        })
+        return Expense.objects.latest('id')
+
+    def test_violation_recorded_without_aggregating_history(self):
+        self.submit('3000')
+        self.submit('1500', expense_date='2025-02-27')
+        self.submit('1000', category='travel')
+        with CaptureQueriesContext(connection) as queries:
+            over = self.submit('2500')
+
+        self.assertFalse(any('SUM(' in query['sql'].upper() for query in queries.captured_queries))
+        violation = PolicyViolation.objects.get()
+        self.assertEqual(violation.expense, over)
+        self.assertEqual(violation.period_total, Decimal('5500'))
+        month = SpendCounter.objects.get(employee=self.employee, category='food', period='month', period_start=date(2025, 3, 1))
+        self.assertEqual((month.total, month.count), (Decimal('5500'), 2))
+
+    def test_rejection_releases_spend_and_rebuild_matches(self):
+        first = self.submit('4000')
+        first.status = 'rejected'
+        first.save()
+        release_spend(first)
+        release_spend(first)
+        self.submit('4000')
+        self.assertFalse(PolicyViolation.objects.exists())
+
+        live = {(c.category, c.period, c.period_start): (c.total, c.count) for c in SpendCounter.objects.exclude(count=0)}
+        rebuild_counters()
+        rebuilt = {(c.category, c.period, c.period_start): (c.total, c.count) for c in SpendCounter.objects.all()}
+        self.assertEqual(live, rebuilt)
+
+
+class ExpenseArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.manager = CustomUser.objects.create_user('boss', password=None, company=cls.company, role='manager')
+        cls.employee = CustomUser.objects.create_user(
+            'emp', password=None, company=cls.company, role='employee', manager=cls.manager,
+        )
+
+    def add_expense(self, status, day, amount='100'):
+        expense = Expense.objects.create(
+            employee=self.employee, company=self.company, amount=Decimal(amount), currency='INR',
+            amount_in_company_currency=Decimal(amount), category='food', description='Lunch',
+            expense_date=date(2024, 1, day), status=status,
+        )
+        ExpenseApproval.objects.create(expense=expense, approver=self.manager, step_number=1, status=status)
+        return expense
+
+    def test_archives_closed_expenses_in_batches_and_keeps_totals(self):
+        for day in range(1, 6):
+            self.add_expense('approved', day)
+        self.add_expense('rejected', 6, amount='40')
+        pending = self.add_expense('pending', 7)
+        before = spend_summary(self.company.id)
+        batches = []
+
+        moved = archive_closed_expenses(
+            timezone.now() + timedelta(seconds=1), batch_size=4, on_batch=lambda n, count: batches.append(count),
+        )
+
+        self.assertEqual((moved, batches), (6, [4, 2]))
+        self.assertEqual(list(Expense.objects.values_list('id', flat=True)), [pending.id])
+        self.assertEqual(ArchivedExpenseApproval.objects.count(), 6)
+        self.assertEqual(spend_summary(self.company.id), before)
+        self.assertEqual(spend_summary(self.company.id)[('food', 'approved')], (5, Decimal('500')))
+
+    def test_history_and_receipts_cover_archived_expenses(self):
+        old = self.add_expense('approved', 1)
+        self.add_expense('pending', 2)
+        archive_closed_expenses(timezone.now() + timedelta(seconds=1))
+        self.assertTrue(ArchivedExpense.objects.filter(id=old.id).exists())
+
+        history = expense_history(self.manager, limit=1)
+        self.assertEqual([row['archived'] for row in history], [False])
+        history = expense_history(self.manager, limit=1, before=(history[0]['expense_date'], history[0]['id']))
+        self.assertEqual([(row['id'], row['archived']) for row in history], [(old.id, True)])
+
+        self.client.force_login(self.employee)
+        response = self.client.get(reverse('expense_history'))
+        self.assertEqual([row['archived'] for row in response.json()['results']], [False, True])
+        # Access is still checked for archived rows; there is just no file here.
+        self.assertEqual(self.client.get(reverse('expense_receipt', args=[old.id])).status_code, 404)
+
+    def test_rollups_without_an_employee_are_not_duplicated(self):
+        for day in (1, 2):
+            Expense.objects.create(
+                company=self.company, amount=Decimal('10'), currency='INR', amount_in_company_currency=Decimal('10'),
+                category='food', description='Lunch', expense_date=date(2024, 1, day), status='approved',
+            )
+            archive_closed_expenses(timezone.now() + timedelta(seconds=1))
+
+        self.assertEqual(ExpenseRollup.objects.filter(employee=None).count(), 1)
+        self.assertEqual(spend_summary(self.company.id)[('food', 'approved')], (2, Decimal('20')))
+
+    def test_violations_and_duplicate_flags_are_archived(self):
+        original = self.add_expense('approved', 1)
+        copy = self.add_expense('rejected', 2)
+        flag = DuplicateFlag.objects.create(expense=copy, duplicate_of=original, reason='same_details')
+        # Closed expenses flagging each other do not hold each other back.
+        back = DuplicateFlag.objects.create(expense=original, duplicate_of=copy, reason='similar_receipt')
+        policy = SpendPolicy.objects.create(company=self.company, name='Food', category='food', limit_amount=50)
+        PolicyViolation.objects.create(
+            expense=original, policy=policy, period_start=date(2024, 1, 1), limit_amount=50, period_total=100,
+        )
+
+        batches = []
+        archive_closed_expenses(timezone.now() + timedelta(seconds=1), on_batch=lambda n, count: batches.append(count))
+
+        self.assertEqual(batches, [2])
+        self.assertFalse(Expense.objects.exists())
+        self.assertEqual(
+            list(ArchivedExpense.objects.get(id=copy.id).duplicate_flags.values_list('id', 'duplicate_of_id')),
+            [(flag.id, original.id)],
+        )
+        self.assertEqual(
+            list(ArchivedExpense.objects.get(id=original.id).duplicate_flags.values_list('id', 'duplicate_of_id')),
+            [(back.id, copy.id)],
+        )
+        self.assertEqual(
+            list(ArchivedExpense.objects.get(id=original.id).policy_violations.values_list('policy', 'period_total')),
+            [(policy.id, Decimal('100'))],
+        )
+
+    @uncollected_static
+    def test_flags_and_fingerprints_outlive_the_archived_original(self):
+        value = 0x0123456789ABCDEF
+        original = self.add_expense('approved', 1)
+        ReceiptFingerprint.objects.create(
+            expense=original, company=self.company, phash=to_signed(value),
+            **{f'band{i}': band for i, band in enumerate(bands(value))},
+        )
+        pending = self.add_expense('pending', 2)
+        flag = DuplicateFlag.objects.create(expense=pending, duplicate_of=original, reason='same_details')
+
+        archive_closed_expenses(timezone.now() + timedelta(seconds=1))
+
+        flag.refresh_from_db()
+        self.assertEqual((flag.duplicate_of_id, flag.archived_duplicate_of_id), (None, original.id))
+        self.assertEqual(flag.original, ArchivedExpense.objects.get(id=original.id))
+        self.assertEqual(find_similar(self.company.id, value), [(original.id, 0)])
+
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('approve_expense', args=[pending.id]))
+        self.assertContains(response, f'expense #{original.id}')
+
+
+@override_settings(CHANGE_FEED_SETTLE_SECONDS=0)
+class ChangeFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.other = Company.objects.create(name='Other', country='India', currency='INR')
+        cls.admin_user = CustomUser.objects.create_user('root', password=None, company=cls.company, role='admin')
+        cls.manager = CustomUser.objects.create_user('boss', password=None, company=cls.company, role='manager')
+
+    def add_expense(self, company=None, status='pending'):
+        return Expense.objects.create(
+            company=company or self.company, amount=Decimal('10'), currency='INR', category='food',
+            description='Lunch', expense_date=date(2024, 1, 1), status=status,
+        )
+
+    def test_pages_through_changes_after_cursor(self):
+        expense = self.add_expense()
+        approval = ExpenseApproval.objects.create(expense=expense, approver=self.manager, step_number=1)
+        self.add_expense(company=self.other)
+        approval.status = 'approved'
+        approval.save()
+
+        events, cursor, has_more = changes_since(self.company.id, 0, limit=2)
+        self.assertEqual([(e.entity, e.action) for e in events], [('expense', 'created'), ('approval', 'created')])
+        self.assertTrue(has_more)
+        self.assertEqual(events[0].data['amount'], '10')
+
+        events, cursor, has_more = changes_since(self.company.id, cursor, limit=2)
+        self.assertEqual([(e.object_id, e.action, e.data['status']) for e in events], [(approval.id, 'updated', 'approved')])
+        self.assertFalse(has_more)
+        self.assertEqual(changes_since(self.company.id, cursor), ([], cursor, False))
+
+    def test_archival_is_reported_once_per_row(self):
+        expense = self.add_expense(status='approved')
+        ExpenseApproval.objects.create(expense=expense, approver=self.manager, step_number=1, status='approved')
+        _, cursor, _ = changes_since(self.company.id)
+
+        archive_closed_expenses(timezone.now() + timedelta(seconds=1))
+
+        events, _, _ = changes_since(self.company.id, cursor)
+        self.assertEqual(sorted((e.entity, e.action) for e in events), [('approval', 'archived'), ('expense', 'archived')])
+
+    def test_view_is_admin_only_and_query_count_is_bounded(self):
+        for _ in range(5):
+            self.add_expense()
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get(reverse('change_feed')).status_code, 403)
+
+        self.client.force_login(self.admin_user)
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get(reverse('change_feed'), {'limit': 3}).json()
+        self.assertEqual(len(body['events']), 3)
+        self.assertTrue(body['has_more'])
+        next_page = self.client.get(reverse('change_feed'), {'cursor': body['next_cursor'], 'limit': 3}).json()
+        self.assertEqual(len(next_page['events']), 2)
+        self.assertLessEqual(len(queries), 4)
+
+
+@uncollected_static
+class BuildCSSTests(SimpleTestCase):
+    def test_committed_stylesheet_matches_templates(self):
+        call_command('build_css', '--check', stdout=mock.Mock())
+
+    def test_every_template_class_is_emitted_or_allowed(self):
+        _, names = cssbuild.build()
+        known = set(names) | cssbuild.UNSTYLED
+        for path in cssbuild.template_files():
+            for attribute in re.findall(r'class="([^"]*)"', path.read_text(encoding='utf-8')):
+                for name in re.sub(r'{%.*?%}|{{.*?}}', ' ', attribute, flags=re.S).split():
+                    with self.subTest(template=path.name, name=name):
+                        self.assertIn(name, known)
+
+    def test_generates_only_used_utilities_with_variants(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.html') as template:
+            template.write('''<div class="sm:px-6 hover:bg-blue-700 bg-white/80 -mt-8 no-such-utility"></div>''')
+            template.flush()
+            css, names = cssbuild.build([template.name])
+        self.assertEqual(names, ['-mt-8', 'bg-white/80', 'hover:bg-blue-700', 'sm:px-6'])
+        self.assertIn('.hover\\:bg-blue-700:hover{background-color:#1d4ed8}', css)
+        self.assertIn('.bg-white\\/80{background-color:rgb(255 255 255 / 0.8)}', css)
+        self.assertIn('@media (min-width:640px){.sm\\:px-6{padding-left:1.5rem;padding-right:1.5rem}}', css)
+        self.assertNotIn('bg-red-500', css)
+
+    def test_pages_use_the_static_stylesheet(self):
+        body = self.client.get(reverse('login')).content.decode()
+        self.assertIn('css/app.css', body)
+        self.assertNotIn('cdn.tailwindcss.com', body)
+
+    def test_collectstatic_writes_hashed_and_compressed_copies(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = PrecompressedManifestStaticFilesStorage(location=root)
+            with open(cssbuild.output_path(), 'rb') as source:
+                storage.save('css/app.css', source)
+            processed = list(storage.post_process({'css/app.css': (storage, 'css/app.css')}))
+            hashed_name = processed[-1][1]
+            self.assertRegex(hashed_name, r'^css/app\.[0-9a-f]{12}\.css$')
+            with storage.open(hashed_name + '.gz') as compressed:
+                self.assertEqual(gzip.decompress(compressed.read()), cssbuild.output_path().read_bytes())
+
+
+@uncollected_static
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ProvisioningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.boss = CustomUser.objects.create_user('boss', password=None, company=cls.company, role='manager')
+
+    def rows(self, text):
+        return read_rows(io.StringIO(text))
+
+    def test_creates_users_resolving_managers_in_batch_and_existing(self):
+        csv_text = 'username,email,role,manager,password\nlead,lead@x.io,manager,,\n' + ''.join(
+            f'emp{i},emp{i}@x.io,employee,{"lead" if i % 2 else "boss"},Sturdy-Pass-{i}\n' for i in range(10)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            users = provision_users(self.company, self.rows(csv_text), workers=2)
+        self.assertLessEqual(len(queries), 8)
+
+        self.assertEqual(len(users), 11)
+        emp1 = CustomUser.objects.select_related('manager').get(username='emp1')
+        self.assertEqual((emp1.manager.username, emp1.company_id), ('lead', self.company.id))
+        self.assertEqual(CustomUser.objects.get(username='emp2').manager, self.boss)
+        self.assertTrue(emp1.check_password('Sturdy-Pass-1'))
+        self.assertEqual([user.username for user, _ in invite_links(users)], ['lead'])
+
+    def test_invalid_file_creates_nothing(self):
+        csv_text = 'username,role,manager\nnew,employee,ghost\nnew,employee,\nboss,employee,\nx,owner,\n'
+        with self.assertRaises(ProvisioningError) as raised:
+            provision_users(self.company, self.rows(csv_text))
+        self.assertEqual([row for row, _ in raised.exception.errors], [1, 2, 3, 4])
+        self.assertEqual(CustomUser.objects.count(), 1)
+
+    def test_file_passwords_must_pass_the_validators(self):
+        csv_text = 'username,password\nann,password\nbob,12345678901\ncarolsmith,carolsmith1\ndan,Sturdy-Pass-1\n'
+        with self.assertRaises(ProvisioningError) as raised:
+            provision_users(self.company, self.rows(csv_text))
+        self.assertEqual([row for row, _ in raised.exception.errors], [1, 2, 3])
+        self.assertIn('too common', raised.exception.errors[0][1])
+        self.assertEqual(CustomUser.objects.count(), 1)
+
+    def test_manager_column_is_normalized_like_usernames(self):
+        # Fullwidth letters normalize (NFKC) to the plain username.
+        lead, boss = '\uff4c\uff45\uff41\uff44', '\uff42\uff4f\uff53\uff53'
+        csv_text = f'username,role,manager\n{lead},manager,\nann,employee,{lead}\nbob,employee,{boss}\n'
+        provision_users(self.company, self.rows(csv_text))
+        self.assertEqual(CustomUser.objects.get(username='ann').manager.username, 'lead')
+        self.assertEqual(CustomUser.objects.get(username='bob').manager, self.boss)
+
+    def test_json_must_be_a_list_of_objects(self):
+        for text, errors in (
+            ('{"username": "ann"}', [(0, 'expected a JSON list of objects')]),
+            ('[{"username": "ann"}, "bob", [1]]', [(2, 'expected an object'), (3, 'expected an object')]),
+        ):
+            with self.assertRaises(ProvisioningError) as caught:
+                read_rows(io.StringIO(text), 'json')
+            self.assertEqual(caught.exception.errors, errors)
+
+    def test_invite_link_sets_password_once(self):
+        users = provision_users(self.company, read_rows(io.StringIO('[{"username": "newbie"}]'), 'json'))
+        (user, path), = invite_links(users)
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(self.client.get(path).status_code, 200)
+
+        response = self.client.post(path, {'new_password1': 'Correct-Horse-9', 'new_password2': 'Correct-Horse-9'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('Correct-Horse-9'))
+        self.client.logout()
+        self.assertRedirects(self.client.get(path), reverse('login'))
+
+    def test_admin_action_returns_invite_csv(self):
+        admin_user = CustomUser.objects.create_superuser('root', 'root@example.com', 'pass', role='admin')
+        self.client.force_login(admin_user)
+        upload = SimpleUploadedFile('staff.csv', b'username,email,manager\nann,ann@x.io,boss\n')
+        response = self.client.post(reverse('admin:ExpenseManagement_app_company_changelist'), {
+            'action': 'provision_users', '_selected_action': [self.company.id], 'apply': 'yes', 'file': upload,
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[0], 'username,email,invite_url')
+        self.assertTrue(lines[1].startswith('ann,ann@x.io,http://testserver/invite/'))
+        self.assertEqual(CustomUser.objects.get(username='ann').manager, self.boss)
+
+
+@uncollected_static
+@override_settings(SINGLE_PROCESS=True)
+class CachedIdentityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR')
+        cls.boss = CustomUser.objects.create_user('boss', password=None, company=cls.company, role='manager')
+        cls.employee = CustomUser.objects.create_user(
+            'emp', password=None, company=cls.company, role='employee', manager=cls.boss,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.backend = CachedIdentityBackend()
+
+    def test_one_query_cold_none_warm(self):
+        with self.assertNumQueries(1):
+            user = self.backend.get_user(self.employee.id)
+            self.assertEqual((user.company.currency, user.manager.username), ('INR', 'boss'))
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.employee.id)
+            self.assertEqual((user.company.currency, user.manager.username), ('INR', 'boss'))
+
+    def test_saving_user_company_or_manager_invalidates(self):
+        self.backend.get_user(self.employee.id)
+        self.company.currency = 'EUR'
+        self.company.save()
+        self.assertEqual(self.backend.get_user(self.employee.id).company.currency, 'EUR')
+
+        self.boss.username = 'chief'
+        self.boss.save()
+        self.assertEqual(self.backend.get_user(self.employee.id).manager.username, 'chief')
+
+        self.employee.is_active = False
+        self.employee.save()
+        self.assertIsNone(self.backend.get_user(self.employee.id))
+
+    @override_settings(SINGLE_PROCESS=False)
+    def test_local_memory_cache_is_bypassed_with_several_processes(self):
+        self.backend.get_user(self.employee.id)
+        with self.assertNumQueries(1):
+            self.backend.get_user(self.employee.id)
+        # A change made elsewhere (no signal here) is seen at once.
+        CustomUser.objects.filter(id=self.employee.id).update(is_active=False)
+        self.assertIsNone(self.backend.get_user(self.employee.id))
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_warm_request_runs_no_auth_queries(self):
+        self.client.force_login(self.employee)
+        self.client.get(reverse('submit_expense'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('submit_expense'))
+        self.assertEqual(response.status_code, 200)
+
+
+class ApprovalEscalationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name='Acme', country='India', currency='INR', approval_sla_hours=24)
+        cls.director = CustomUser.objects.create_user('director', password=None, company=cls.company, role='manager')
+        cls.boss = CustomUser.objects.create_user(
+            'boss', password=None, company=cls.company, role='manager', manager=cls.director,
+        )
+        cls.employee = CustomUser.objects.create_user(
+            'emp', password=None, company=cls.company, role='employee', manager=cls.boss,
+        )
+
+    def add_approval(self, hours_old, approver=None, company=None, rule=None):
+        expense = Expense.objects.create(
+            employee=self.employee, company=company or self.company, amount=Decimal('10'), currency='INR',
+            category='food', description='Lunch', expense_date=date(2025, 1, 1), approval_rule=rule,
+        )
+        return ExpenseApproval.objects.create(
+            expense=expense, approver=approver or self.boss, step_number=1,
+            sla_started_at=timezone.now() - timedelta(hours=hours_old),
+        )
+
+    def test_overdue_approval_moves_to_the_approvers_manager(self):
+        stale = self.add_approval(30)
+        fresh = self.add_approval(2)
+        last_event = ChangeEvent.objects.latest('id')
+
+        self.assertEqual(escalate_stale_approvals(), 1)
+
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'escalated')
+        replacement = stale.escalated_to
+        self.assertEqual((replacement.approver, replacement.status, replacement.step_number), (self.director, 'pending', 1))
+        self.assertTrue(ApprovalNotification.objects.filter(approval=replacement, recipient=self.director).exists())
+        self.assertEqual(
+            list(ChangeEvent.objects.filter(id__gt=last_event.id).values_list('object_id', 'action')),
+            [(stale.id, 'updated'), (replacement.id, 'created')],
+        )
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, 'pending')
+        self.assertEqual(escalate_stale_approvals(), 0)
+
+    def test_falls_back_to_rule_approver_and_respects_company_sla(self):
+        relaxed = Company.objects.create(name='Slow', country='India', currency='INR', approval_sla_hours=72)
+        rule = ApprovalRule.objects.create(
+            company=self.company, name='CFO', rule_type='specific', specific_approver=self.boss,
+        )
+        top = self.add_approval(30, approver=self.director, rule=rule)
+        stuck = self.add_approval(30, approver=self.director)
+        not_due = self.add_approval(30, company=relaxed)
+
+        self.assertEqual(escalate_stale_approvals(), 1)
+        self.assertEqual(top.escalated_to.approver, self.boss)
+        for approval in (stuck, not_due):
+            approval.refresh_from_db()
+            self.assertEqual(approval.status, 'pending')
+
+    def test_rows_nobody_can_take_are_parked_for_one_sla(self):
+        stuck = self.add_approval(30, approver=self.director)
+        last_event = ChangeEvent.objects.latest('id')
+
+        self.assertEqual(escalate_stale_approvals(), 0)
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'pending')
+        (event,) = ChangeEvent.objects.filter(id__gt=last_event.id)
+        self.assertEqual((event.object_id, event.action), (stuck.id, 'updated'))
+        # Snapshots are JSON, which keeps milliseconds.
+        self.assertAlmostEqual(
+            parse_datetime(event.data['sla_started_at']), stuck.sla_started_at, delta=timedelta(milliseconds=1),
+        )
+        self.assertFalse(overdue_approvals(24).exists())
+        self.assertTrue(overdue_approvals(24, now=timezone.now() + timedelta(hours=25)).exists())
+
+    def test_sequential_steps_wait_for_the_step_before(self):
+        rule = ApprovalRule.objects.create(company=self.company, name='Chain', rule_type='sequential')
+        cfo = CustomUser.objects.create_user(
+            'cfo', password=None, company=self.company, role='manager', manager=self.director,
+        )
+        first = self.add_approval(30, rule=rule)
+        second = ExpenseApproval.objects.create(
+            expense=first.expense, approver=cfo, step_number=2, sla_started_at=first.sla_started_at,
+        )
+
+        self.assertEqual(escalate_stale_approvals(), 1)
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'pending')
+        self.assertGreater(second.sla_started_at, first.sla_started_at)
+
+        # Approving step 1 (now the director's) starts step 2's clock.
+        self.client.force_login(self.director)
+        last_event = ChangeEvent.objects.latest('id')
+        self.client.post(reverse('approve_expense', args=[first.expense_id]), {'action': 'approve'})
+        self.assertTrue(
+            ChangeEvent.objects.filter(id__gt=last_event.id, object_id=second.id, action='updated').exists()
+        )
+        self.assertEqual(escalate_stale_approvals(now=timezone.now() + timedelta(hours=23)), 0)
+        self.assertEqual(escalate_stale_approvals(now=timezone.now() + timedelta(hours=25)), 1)
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.escalated_to.approver), ('escalated', self.director))
+
+    def test_queries_do_not_grow_with_pending_backlog(self):
+        def run():
+            self.add_approval(30)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(escalate_stale_approvals(batch_size=10), 1)
+            return len(queries)
+
+        run()  # The first run also queues the digest task.
+        small = run()
+        for _ in range(20):
+            self.add_approval(1)
+        large = run()
+        self.assertEqual(large, small)
+
+
+@override_settings(
+    TENANT_SHARDS=['default', 'shard_a', 'shard_b'],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    CHANGE_FEED_SETTLE_SECONDS=0,
+)
+@uncollected_static
+class TenantShardingTests(TestCase):
+    # shard_a and shard_b are separate databases (see test_settings.py).
+    databases = {'default', 'shard_a', 'shard_b'}
+
+    def setUp(self):
+        cache.clear()
+
+    def add_company(self, name, shard):
+        with sharding.using_shard(shard):
+            company = Company.objects.create(name=name, country='India', currency='INR')
+        sharding.assign_shard(company.id, shard)
+        with sharding.tenant(company.id):
+            boss = CustomUser.objects.create_user(f'{name}-boss', password='pw', company=company, role='manager')
+            employee = CustomUser.objects.create_user(
+                f'{name}-emp', password='pw', company=company, role='employee', manager=boss,
+            )
+            expense = Expense.objects.create(
+                employee=employee, company=company, amount=Decimal('10'), currency='INR',
+                category='food', description=f'{name} lunch', expense_date=date(2025, 1, 1),
+            )
+            ExpenseApproval.objects.create(expense=expense, approver=boss, step_number=1)
+        return company, employee, expense
+
+    def test_company_rows_live_on_its_shard(self):
+        acme, _, acme_expense = self.add_company('acme', 'shard_a')
+        globex, globex_employee, globex_expense = self.add_company('globex', 'shard_b')
+
+        self.assertEqual(count_rows(acme.id, 'shard_a')['ExpenseManagement_app.ExpenseApproval'], 1)
+        self.assertFalse(Expense.objects.using('shard_b').filter(id=acme_expense.id).exists())
+        self.assertFalse(Expense.objects.using('default').exists())
+        self.assertEqual(TenantShard.objects.using('default').count(), 2)
+        # Ids come from shared blocks, so they never repeat across shards.
+        self.assertNotEqual(acme.id, globex.id)
+        self.assertNotEqual(acme_expense.id, globex_expense.id)
+
+        with sharding.tenant(globex.id):
+            self.assertEqual(list(Expense.objects.all()), [globex_expense])
+            self.assertFalse(Expense.objects.filter(id=acme_expense.id).exists())
+        # Loaded rows keep using their shard for related lookups.
+        self.assertEqual(Expense.objects.using('shard_b').get(id=globex_expense.id).employee, globex_employee)
+
+    def test_requests_use_the_signed_in_users_shard(self):
+        _, employee, expense = self.add_company('globex', 'shard_b')
+
+        response = self.client.post(reverse('login'), {'username': 'globex-emp', 'password': 'pw'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        response = self.client.get(reverse('employee_dashboard'))
+        self.assertEqual(list(response.context['my_expenses']), [expense])
+
+        with override_settings(TENANT_NEW_COMPANY_SHARD='shard_a'):
+            self.client.post(reverse('signup'), {
+                'username': 'initech-admin', 'password': 'pw', 'company_name': 'Initech',
+                'country': 'India', 'currency': 'INR', 'role': 'admin',
+            })
+        company = Company.objects.using('shard_a').get(name='Initech')
+        self.assertEqual(sharding.shard_for(company.id), 'shard_a')
+        self.assertTrue(CustomUser.objects.using('shard_a').filter(username='initech-admin', company=company).exists())
+
+    def test_rebalance_moves_a_company_with_its_ids(self):
+        acme, employee, expense = self.add_company('acme', 'shard_a')
+        globex, _, _ = self.add_company('globex', 'shard_b')
+        with sharding.tenant(acme.id):
+            task = enqueue('receipts.fingerprint', {'expense_id': expense.id})
+        events_before = list(ChangeEvent.objects.using('shard_a').filter(company=acme))
+
+        call_command('rebalance_company', acme.id, 'shard_b', drain_seconds=0, stdout=io.StringIO())
+
+        self.assertEqual(set(count_rows(acme.id, 'shard_a').values()), {0})
+        moved = count_rows(acme.id, 'shard_b')
+        self.assertEqual(moved['ExpenseManagement_app.CustomUser'], 2)
+        self.assertEqual(moved['ExpenseManagement_app.Task'], 1)
+        self.assertEqual(sharding.directory_entry(acme.id), ('shard_b', False))
+        copy = Expense.objects.using('shard_b').get(id=expense.id)
+        self.assertEqual((copy.created_at, copy.employee_id), (expense.created_at, employee.id))
+        self.assertTrue(Task.objects.using('shard_b').filter(id=task.id).exists())
+
+        with sharding.tenant(acme.id):
+            events, _, _ = changes_since(acme.id)
+        # Events are renumbered above every id a feed consumer could have seen.
+        self.assertEqual(len(events), len(events_before))
+        self.assertGreater(events[0].id, max(event.id for event in events_before))
+        self.assertEqual(count_rows(globex.id, 'shard_b')['ExpenseManagement_app.Expense'], 1)
+
+    def test_company_being_moved_is_read_only(self):
+        acme, _, expense = self.add_company('acme', 'shard_a')
+        sharding.assign_shard(acme.id, 'shard_a', read_only=True)
+
+        with sharding.tenant(acme.id), self.assertRaises(sharding.TenantReadOnly):
+            Expense.objects.filter(id=expense.id).update(description='changed')
+        with self.assertRaises(sharding.TenantReadOnly):
+            expense.save()
+        with sharding.tenant(acme.id):
+            self.assertEqual(Expense.objects.get(id=expense.id).description, 'acme lunch')
+
+
+    @override_settings(TENANT_SHARDS=['default'])
+    def test_unsharded_save_with_an_explicit_pk_updates(self):
+        _, employee, expense = self.add_company('acme', 'default')
+        approval = ExpenseApproval.objects.get()
+        ExpenseApproval(
+            id=approval.id, expense=expense, approver=employee.manager, step_number=1, status='approved',
+        ).save()
+        self.assertEqual(list(ExpenseApproval.objects.values_list('id', 'status')), [(approval.id, 'approved')])
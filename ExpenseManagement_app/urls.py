@@ -1,7 +1,5 @@
 from django.contrib import admin
 from django.urls import path
-from django.conf import settings
-from django.conf.urls.static import static
 # from expenses import views
 from . import views
 
@@ -10,6 +8,7 @@ urlpatterns = [
     path('', views.login_view, name='login'),
     path('signup/', views.signup_view, name='signup'),
     path('logout/', views.logout_view, name='logout'),
+    path('invite/<uidb64>/<token>/', views.accept_invite, name='accept_invite'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('manager-dashboard/', views.manager_dashboard, name='manager_dashboard'),
@@ -19,8 +18,13 @@ urlpatterns = [
     path('approve-expense/<int:expense_id>/', views.approve_expense, name='approve_expense'),
     path('create-approval-rule/', views.create_approval_rule, name='create_approval_rule'),
     path('api/countries/', views.get_countries, name='get_countries'),
+    path('api/managers/', views.manager_autocomplete, name='manager_autocomplete'),
     path('api/ocr-scan/', views.ocr_scan, name='ocr_scan'),
+    path('api/expenses/search/', views.search_expenses_view, name='search_expenses'),
+    path('api/expenses/history/', views.expense_history_view, name='expense_history'),
+    path('api/changes/', views.change_feed_view, name='change_feed'),
     path('approve/<int:expense_id>/', views.approve_expense, name='approve_expense'),
-
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('receipts/<int:expense_id>/', views.expense_receipt, name='expense_receipt'),
+    path('receipts/<int:expense_id>/thumbnail/', views.expense_receipt, {'variant': 'thumbnail'}, name='expense_receipt_thumbnail'),
+]
 
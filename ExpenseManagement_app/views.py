@@ -1,18 +1,51 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.forms import SetPasswordForm
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, Http404
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, urlsafe_base64_decode
+from django.views.decorators.http import require_GET, require_safe
 from django.db.models import Q
 from django.utils import timezone
-from .models import Company, CustomUser, Expense, ApprovalRule, ApprovalStep, ExpenseApproval
-import requests
-import pytesseract
-from PIL import Image
+from . import changefeed, sharding
+from .models import (
+    Company, CustomUser, Expense, ApprovalRule, ApprovalStep, ExpenseApproval, ArchivedExpense,
+    ArchivedExpenseApproval,
+)
+from .countries import load_dataset, currency_for_country
+from .search import search_expenses
+from .ocr import aimage_to_text, clean_ocr_text
+from .currency import aconvert_currency
+from .policies import record_spend, release_spend
+from .archive import expense_history
+from .changefeed import changes_since
+from .provisioning import invite_token_generator
+from .taskqueue import enqueue
+from .sendfile import serve_protected
+from .storage import receipt_storage
 from decimal import Decimal
 import json
 from datetime import datetime
 
+# The country list only changes when refresh_countries ships a new file, so a
+# URL pinned to the file version (?v=...) can be cached for a year.
+COUNTRIES_MAX_AGE = 60 * 60 * 24
+COUNTRIES_VERSIONED_MAX_AGE = 60 * 60 * 24 * 365
+
+MANAGER_AUTOCOMPLETE_LIMIT = 20
+EXPENSE_SEARCH_LIMIT = 50
+EXPENSE_HISTORY_PAGE_SIZE = 50
+CHANGE_FEED_PAGE_SIZE = 100
+
+def _render_signup(request):
+    # Managers are looked up on demand through manager_autocomplete, never listed here.
+    return render(request, 'signup.html', {
+        'countries_version': load_dataset().version,
+    })
+
 def signup_view(request):
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -20,35 +53,39 @@ def signup_view(request):
         password = request.POST.get('password')
         company_name = request.POST.get('company_name')
         country = request.POST.get('country')
-        currency = request.POST.get('currency')
+        currency = request.POST.get('currency') or currency_for_country(country)
         role = request.POST.get('role')
         manager_id = request.POST.get('manager_id')  # Add manager selection
 
         valid_roles = ['employee', 'manager', 'admin']
         if role not in valid_roles:
             messages.error(request, 'Invalid role selected.')
-            return render(request, 'signup.html')
+            return _render_signup(request)
 
-        if CustomUser.objects.filter(username=username).exists():
+        if sharding.find_user(username=username) is not None:
             messages.error(request, f'Username "{username}" already exists. Choose a different one.')
-            return render(request, 'signup.html')
-
-        company = Company.objects.create(
-            name=company_name,
-            country=country,
-            currency=currency
-        )
-
-        # Fetch manager only if role is employee and manager_id is provided
-        manager = CustomUser.objects.filter(id=manager_id).first() if manager_id and role == 'employee' else None
-        user = CustomUser.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            company=company,
-            role=role,
-            manager=manager
-        )
+            return _render_signup(request)
+
+        # The new company and its first user go to the shard picked for it.
+        with sharding.using_shard(sharding.place_new_company()) as shard, sharding.atomic():
+            company = Company.objects.create(
+                name=company_name,
+                country=country,
+                currency=currency
+            )
+            if sharding.is_sharded():
+                sharding.assign_shard(company.id, shard)
+
+            # Fetch manager only if role is employee and manager_id is provided
+            manager = CustomUser.objects.filter(id=manager_id).first() if manager_id and role == 'employee' else None
+            user = CustomUser.objects.create_user(
+                username=username,
+                email=email,
+                password=password,
+                company=company,
+                role=role,
+                manager=manager
+            )
 
         login(request, user)
         messages.success(request, 'Account created successfully!')
@@ -60,11 +97,7 @@ def signup_view(request):
         else:
             return redirect('employee_dashboard')
 
-    # Fetch managers from the same company if user is logged in, otherwise all managers
-    managers = CustomUser.objects.filter(role='manager')
-    if request.user.is_authenticated:
-        managers = managers.filter(company=request.user.company)
-    return render(request, 'signup.html', {'managers': managers})
+    return _render_signup(request)
 
 def login_view(request):
     if request.method == 'POST':
@@ -80,6 +113,25 @@ def login_view(request):
     
     return render(request, 'login.html')
 
+def accept_invite(request, uidb64, token):
+    """Let a bulk-provisioned user choose their password from the invite link."""
+    try:
+        # The link names no company, so look on every shard.
+        user = sharding.find_user(pk=urlsafe_base64_decode(uidb64).decode())
+    except ValueError:
+        user = None
+    if user is None or not invite_token_generator.check_token(user, token):
+        messages.error(request, 'This invite link is invalid or has already been used.')
+        return redirect('login')
+
+    form = SetPasswordForm(user, request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        form.save()
+        login(request, user)
+        messages.success(request, f'Welcome, {user.username}! Your password is set.')
+        return redirect('dashboard')
+    return render(request, 'accept_invite.html', {'form': form, 'invited_user': user})
+
 @login_required
 def logout_view(request):
     logout(request)
@@ -169,11 +221,18 @@ def create_employee(request):
         role = request.POST.get('role')
         manager_id = request.POST.get('manager_id')
 
-        if CustomUser.objects.filter(username=username).exists():
+        if sharding.find_user(username=username) is not None:
             messages.error(request, f'Username "{username}" already exists. Choose a different one.')
             return redirect('create_employee')
         
-        manager = CustomUser.objects.get(id=manager_id) if manager_id and role == 'employee' else None
+        manager = None
+        if manager_id and role == 'employee':
+            manager = CustomUser.objects.filter(
+                id=manager_id, company=request.user.company, role='manager'
+            ).first() if manager_id.isdigit() else None
+            if manager is None:
+                messages.error(request, 'Selected manager was not found in your company.')
+                return redirect('create_employee')
         
         user = CustomUser.objects.create_user(
             username=username,
@@ -187,75 +246,241 @@ def create_employee(request):
         messages.success(request, f'User {username} created successfully')
         return redirect('admin_dashboard')
     
-    managers = CustomUser.objects.filter(company=request.user.company, role='manager')
-    return render(request, 'create_employee.html', {'managers': managers})
+    return render(request, 'create_employee.html')
+
+@login_required
+@require_GET
+def manager_autocomplete(request):
+    """Prefix search over the caller's company managers, one keyset page at a time."""
+    if not request.user.company_id:
+        return JsonResponse({'results': [], 'next': None})
+
+    prefix = request.GET.get('q', '').strip()
+    after = request.GET.get('after', '')
+
+    # A username range instead of LIKE keeps the lookup on user_company_role_name_idx.
+    managers = CustomUser.objects.filter(company_id=request.user.company_id, role='manager')
+    if prefix:
+        managers = managers.filter(username__gte=prefix, username__lt=prefix + '\U0010ffff')
+    if after:
+        managers = managers.filter(username__gt=after)
+
+    rows = list(
+        managers.order_by('username').values('id', 'username')[:MANAGER_AUTOCOMPLETE_LIMIT + 1]
+    )
+    has_more = len(rows) > MANAGER_AUTOCOMPLETE_LIMIT
+    rows = rows[:MANAGER_AUTOCOMPLETE_LIMIT]
+    return JsonResponse({
+        'results': rows,
+        'next': rows[-1]['username'] if has_more else None,
+    })
+
+def create_submitted_expense(user, **fields):
+    """
+    Save a submitted expense and queue its follow-up work in one transaction.
+    Returns the expense and any spend policy violations found.
+    """
+    with sharding.atomic():
+        expense = Expense.objects.create(
+            employee=user,
+            company_id=user.company_id,
+            status='pending',
+            current_step=0,
+            **fields
+        )
+        # Approval rows (and any conversion that couldn't be done inline) are handled by the task worker.
+        enqueue(
+            'expenses.process_submitted',
+            {'expense_id': expense.id},
+            idempotency_key=f'expense-submitted:{expense.id}',
+        )
+        if expense.receipt_image:
+            enqueue(
+                'receipts.generate_thumbnail',
+                {'expense_id': expense.id},
+                idempotency_key=f'receipt-thumbnail:{expense.id}',
+            )
+            enqueue(
+                'receipts.fingerprint',
+                {'expense_id': expense.id},
+                idempotency_key=f'receipt-fingerprint:{expense.id}',
+            )
+        # Checked now if the amount is already in company currency, otherwise by the worker.
+        violations = record_spend(expense)
+    return expense, violations
 
 @login_required
-def submit_expense(request):
-    if not request.user.company:
+async def submit_expense(request):
+    user = await request.auser()
+    if not user.company_id:
         messages.error(request, '❌ You are not assigned to any company.')
         return redirect('dashboard')
 
     if request.method == 'POST':
         amount = request.POST.get('amount')
         currency = request.POST.get('currency')
-        category = request.POST.get('category')
-        description = request.POST.get('description')
-        merchant_name = request.POST.get('merchant_name', '')
-        expense_date = request.POST.get('expense_date')
-        receipt_image = request.FILES.get('receipt_image')
+        company_currency = await Company.objects.filter(id=user.company_id).values_list('currency', flat=True).afirst()
+        if currency != company_currency and currency not in load_dataset().currencies:
+            messages.error(request, '❌ Please choose a valid currency.')
+            return redirect('submit_expense')
 
-        company_currency = request.user.company.currency
-        amount_in_company_currency = convert_currency(float(amount), currency, company_currency)
+        # Under ASGI the FX call only suspends this request; if the provider is
+        # slow or down it returns None and the worker converts later.
+        amount_in_company_currency = await aconvert_currency(amount, currency, company_currency)
 
-        expense = Expense.objects.create(
-            employee=request.user,
-            company=request.user.company,
+        expense, violations = await sync_to_async(create_submitted_expense)(
+            user,
             amount=amount,
             currency=currency,
             amount_in_company_currency=amount_in_company_currency,
-            category=category,
-            description=description,
-            merchant_name=merchant_name,
-            expense_date=expense_date,
-            receipt_image=receipt_image,
-            status='pending',
-            current_step=0
+            category=request.POST.get('category'),
+            description=request.POST.get('description'),
+            merchant_name=request.POST.get('merchant_name', ''),
+            expense_date=request.POST.get('expense_date'),
+            receipt_image=request.FILES.get('receipt_image'),
+            ocr_text=clean_ocr_text(request.POST.get('ocr_text', '')),
         )
 
-        # Ensure approval workflow is created even if manager is not set initially
-        if request.user.manager:
-            ExpenseApproval.objects.create(
-                expense=expense,
-                approver=request.user.manager,
-                step_number=1,
-                status='pending'
-            )
-            expense.current_step = 1
-            expense.save()
-        else:
+        if not user.manager_id:
             messages.warning(request, 'No manager assigned. Contact admin to assign a manager.')
+        for violation in violations:
+            messages.warning(
+                request,
+                f'This expense exceeds the "{violation.policy.name}" limit '
+                f'({violation.period_total} of {violation.limit_amount}); your approver will see this.',
+            )
 
         messages.success(request, '✅ Expense submitted successfully and is now pending approval.')
         return redirect('employee_dashboard')
 
-    return render(request, 'submit_expense.html')
+    # Template context processors read request.user, which is a sync lookup.
+    return await sync_to_async(render)(request, 'submit_expense.html')
 
 @login_required
-def ocr_scan(request):
+async def ocr_scan(request):
     if request.method == 'POST' and request.FILES.get('receipt'):
         try:
             receipt = request.FILES['receipt']
-            image = Image.open(receipt)
-            text = pytesseract.image_to_string(image)
+            text = await aimage_to_text(receipt)
             
             expense_data = parse_receipt_text(text)
+            expense_data['ocr_text'] = text
             return JsonResponse(expense_data)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     
     return JsonResponse({'error': 'No receipt provided'}, status=400)
 
+@login_required
+@require_GET
+def search_expenses_view(request):
+    query = request.GET.get('q', '').strip()
+    expenses = search_expenses(request.user.get_visible_expenses(), query, limit=EXPENSE_SEARCH_LIMIT)
+    return JsonResponse({
+        'query': query,
+        'results': [
+            {
+                'id': expense.id,
+                'employee': expense.employee.username if expense.employee else None,
+                'amount': str(expense.amount),
+                'currency': expense.currency,
+                'category': expense.category,
+                'merchant_name': expense.merchant_name,
+                'description': expense.description[:200],
+                'expense_date': expense.expense_date.isoformat(),
+                'status': expense.status,
+            }
+            for expense in expenses
+        ],
+    })
+
+def can_view_expense(user, expense_id):
+    """Owners, their manager, company admins and any assigned approver may see an expense, archived or not."""
+    return (
+        user.get_visible_expenses().filter(id=expense_id).exists()
+        or ExpenseApproval.objects.filter(expense_id=expense_id, approver=user).exists()
+        or user.get_visible_expenses(ArchivedExpense).filter(id=expense_id).exists()
+        or ArchivedExpenseApproval.objects.filter(expense_id=expense_id, approver=user).exists()
+    )
+
+@login_required
+@require_safe
+def expense_receipt(request, expense_id, variant='original'):
+    if not can_view_expense(request.user, expense_id):
+        raise Http404('Receipt not found')
+
+    field = 'receipt_thumbnail' if variant == 'thumbnail' else 'receipt_image'
+    name = (
+        Expense.objects.filter(id=expense_id).values_list(field, flat=True).first()
+        or ArchivedExpense.objects.filter(id=expense_id).values_list(field, flat=True).first()
+    )
+    return serve_protected(request, receipt_storage(), name)
+
+@login_required
+@require_GET
+def expense_history_view(request):
+    """Visible expenses from the hot and archive tables, newest first, keyset-paged by (date, id)."""
+    before = None
+    if request.GET.get('before_date') and request.GET.get('before_id'):
+        try:
+            before = (
+                datetime.strptime(request.GET['before_date'], '%Y-%m-%d').date(),
+                int(request.GET['before_id']),
+            )
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    rows = expense_history(request.user, limit=EXPENSE_HISTORY_PAGE_SIZE, before=before)
+    results = [
+        {
+            'id': row['id'],
+            'amount': str(row['amount']),
+            'currency': row['currency'],
+            'category': row['category'],
+            'merchant_name': row['merchant_name'],
+            'expense_date': row['expense_date'].isoformat(),
+            'status': row['status'],
+            'archived': bool(row['archived']),
+        }
+        for row in rows
+    ]
+    next_cursor = None
+    if len(rows) == EXPENSE_HISTORY_PAGE_SIZE:
+        next_cursor = {'before_date': results[-1]['expense_date'], 'before_id': results[-1]['id']}
+    return JsonResponse({'results': results, 'next': next_cursor})
+
+@login_required
+@require_GET
+def change_feed_view(request):
+    """
+    Expense and approval changes for the admin's company after ``cursor``.
+    Store ``next_cursor`` and pass it back; keep paging while ``has_more``.
+    """
+    if request.user.role != 'admin' or not request.user.company_id:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    try:
+        cursor = int(request.GET.get('cursor', 0))
+        limit = int(request.GET.get('limit', CHANGE_FEED_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'cursor and limit must be integers'}, status=400)
+
+    events, next_cursor, has_more = changes_since(request.user.company_id, cursor, limit)
+    return JsonResponse({
+        'events': [
+            {
+                'id': event.id,
+                'entity': event.entity,
+                'object_id': event.object_id,
+                'action': event.action,
+                'data': event.data,
+                'at': event.created_at.isoformat(),
+            }
+            for event in events
+        ],
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+    })
+
 @login_required
 def approve_expense(request, expense_id):
     if request.user.role not in ['manager', 'admin']:
@@ -278,7 +503,8 @@ def approve_expense(request, expense_id):
             expense=expense,
             step_number__lt=approval.step_number
         )
-        if previous_approvals.exclude(status='approved').exists():
+        # An escalated row was replaced by its escalation, which is checked instead.
+        if previous_approvals.exclude(status__in=['approved', 'escalated']).exists():
             messages.error(request, 'All previous approval steps must be approved first')
             return redirect('manager_dashboard')
     
@@ -290,6 +516,16 @@ def approve_expense(request, expense_id):
             approval.status = 'approved'
             approval.comments = comments
             approval.save()
+            if expense.approval_rule and expense.approval_rule.rule_type == 'sequential':
+                # Later steps could not be acted on until now, so their SLA starts now.
+                later_steps = list(ExpenseApproval.objects.filter(
+                    expense=expense, status='pending', step_number__gt=approval.step_number,
+                ).select_related('expense'))
+                now = timezone.now()
+                for later_step in later_steps:
+                    later_step.sla_started_at = now
+                ExpenseApproval.objects.bulk_update(later_steps, ['sla_started_at'])
+                changefeed.record_many(later_steps, 'updated')
             
             process_approval_workflow(expense)
             messages.success(request, 'Expense approved')
@@ -300,6 +536,7 @@ def approve_expense(request, expense_id):
             
             expense.status = 'rejected'
             expense.save()
+            release_spend(expense)
             messages.success(request, 'Expense rejected')
         
         return redirect('manager_dashboard')
@@ -307,6 +544,10 @@ def approve_expense(request, expense_id):
     context = {
         'expense': expense,
         'approval': approval,
+        'duplicate_flags': expense.duplicate_flags.select_related(
+            'duplicate_of__employee', 'archived_duplicate_of__employee',
+        ),
+        'policy_violations': expense.policy_violations.select_related('policy'),
     }
     return render(request, 'approve_expense.html', context)
 
@@ -346,25 +587,43 @@ def create_approval_rule(request):
     employees = CustomUser.objects.filter(company=request.user.company, role__in=['manager', 'admin'])
     return render(request, 'create_approval_rule.html', {'employees': employees})
 
-@login_required
+def accepts_gzip(header):
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (``gzip;q=0`` refuses it)."""
+    qualities = {}
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+@require_GET
 def get_countries(request):
-    try:
-        response = requests.get('https://restcountries.com/v3.1/all?fields=name,currencies')
-        return JsonResponse(response.json(), safe=False)
-    except:
-        return JsonResponse({'error': 'Could not fetch countries'}, status=500)
-
-def convert_currency(amount, from_currency, to_currency):
-    if from_currency == to_currency:
-        return Decimal(amount)
-    
-    try:
-        response = requests.get(f'https://api.exchangerate-api.com/v4/latest/{from_currency}')
-        data = response.json()
-        rate = data['rates'].get(to_currency, 1)
-        return Decimal(amount) * Decimal(str(rate))
-    except:
-        return Decimal(amount)
+    dataset = load_dataset()
+    gzipped = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    etag = dataset.gzip_etag if gzipped else dataset.etag
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(dataset.gzip_body if gzipped else dataset.body, content_type='application/json')
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    if request.GET.get('v') == dataset.version:
+        patch_cache_control(response, public=True, immutable=True, max_age=COUNTRIES_VERSIONED_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True, max_age=COUNTRIES_MAX_AGE)
+    return response
 
 def create_approval_workflow(expense):
     if expense.employee.manager:
@@ -396,7 +655,7 @@ def create_approval_workflow(expense):
 
 def process_approval_workflow(expense):
     current_approvals = ExpenseApproval.objects.filter(expense=expense, status='approved')
-    total_approvals = ExpenseApproval.objects.filter(expense=expense).count()
+    total_approvals = ExpenseApproval.objects.filter(expense=expense).exclude(status='escalated').count()
     pending_approvals = ExpenseApproval.objects.filter(expense=expense, status='pending')
 
     if not pending_approvals.exists():
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import json
 import os
 from pathlib import Path
 
@@ -94,6 +95,7 @@ JAZZMIN_UI_TWEAKS = {
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'ExpenseManagement_app.sharding.TenantMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -127,10 +129,33 @@ WSGI_APPLICATION = 'ExpenseManagement_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # EXPENSE_DB_NAME lets the load test run against a scratch database.
+        'NAME': os.environ.get('EXPENSE_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'OPTIONS': {
+            # Take the write lock when a transaction starts. With concurrent
+            # requests (ASGI, threaded workers) a deferred transaction that has
+            # to upgrade fails immediately with "database is locked".
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# Company shards (see ExpenseManagement_app/sharding.py). Each extra alias is a
+# database with the full schema: run `migrate --database <alias>` for it too.
+# EXPENSE_SHARDS='eu=/srv/expenses/eu.sqlite3,us=/srv/expenses/us.sqlite3'
+EXPENSE_SHARDS = dict(
+    entry.split('=', 1) for entry in os.environ.get('EXPENSE_SHARDS', '').split(',') if entry
+)
+for _alias, _path in EXPENSE_SHARDS.items():
+    DATABASES[_alias] = {**DATABASES['default'], 'NAME': _path}
+TENANT_SHARDS = ['default', *EXPENSE_SHARDS]
+DATABASE_ROUTERS = ['ExpenseManagement_app.sharding.TenantRouter']
+# How long a process may use a cached company -> shard entry; rebalance_company
+# waits this long after marking a company read-only before copying it.
+TENANT_DIRECTORY_TIMEOUT = 30
+# Where signups go; None picks the shard with the fewest companies.
+TENANT_NEW_COMPANY_SHARD = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -173,9 +198,36 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Everything under STATIC_ROOT has a content hash in its name, so the web server
+# can cache it forever and serve the precompressed copies. nginx:
+#   location /static/ { alias <STATIC_ROOT>/; gzip_static on; brotli_static on;
+#                       expires max; add_header Cache-Control "public, immutable"; }
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Hashed names plus .gz/.br copies; css/app.css is generated by `manage.py build_css`.
+    'staticfiles': {
+        'BACKEND': 'ExpenseManagement_app.storage.PrecompressedManifestStaticFilesStorage',
+    },
+    # Receipts are stored once per distinct content (see ExpenseManagement_app/storage.py).
+    # Uploads in progress go to OPTIONS['temp_dir'], by default <MEDIA_ROOT>.tmp.
+    'receipts': {
+        'BACKEND': 'ExpenseManagement_app.storage.ContentAddressedStorage',
+    },
+}
+
+# Receipts are only served through the access-checked receipt view. In production
+# set this to 'nginx' (X-Accel-Redirect) or 'apache' (X-Sendfile) so the web
+# server streams the bytes; None makes Django stream them (development only).
+RECEIPT_SENDFILE_BACKEND = None
+# nginx: location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+RECEIPT_ACCEL_PREFIX = '/protected-media/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -183,7 +235,43 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'ExpenseManagement_app.CustomUser'
 
+# The session user is loaded with company and manager in one query and then
+# served from the cache until it (or its company/manager) is saved again; see
+# ExpenseManagement_app/identity.py. That, and caching sessions, needs a cache
+# every process shares: set REDIS_URL (e.g. redis://localhost:6379/0). Without
+# it the cache is per-process local memory, where a logout or a password change
+# in one process would not reach the others, so sessions stay in the database
+# and the identity cache is only used if SINGLE_PROCESS says this is the only
+# process serving requests (runserver, or WEB_CONCURRENCY=1).
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+    # Session rows are read from the cache too, falling back to the database.
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SINGLE_PROCESS = DEBUG or os.environ.get('WEB_CONCURRENCY') == '1'
+AUTHENTICATION_BACKENDS = ['ExpenseManagement_app.identity.CachedIdentityBackend']
+IDENTITY_CACHE_TIMEOUT = 300
+
 # Authentication URLs
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
-LOGOUT_REDIRECT_URL = 'login'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'login'
+
+# Approval notifications are collected and sent as one digest per approver per window.
+APPROVAL_DIGEST_WINDOW_MINUTES = 60
+DEFAULT_FROM_EMAIL = 'SpendSensei <no-reply@spendsensei.local>'
+
+# Per-endpoint overrides for outbound HTTP calls (see ExpenseManagement_app/http_client.py),
+# e.g. {'exchange_rates': {'base_url': 'http://fx.internal', 'read_timeout': 2.0}}
+OUTBOUND_HTTP_ENDPOINTS = json.loads(os.environ.get('OUTBOUND_HTTP_ENDPOINTS', '{}'))
+
+# The change feed holds back events this young so slow transactions can't commit behind a consumer's cursor.
+CHANGE_FEED_SETTLE_SECONDS = 5
+
+# Threads available to receipt OCR when running under ASGI (see ExpenseManagement_app/ocr.py).
+OCR_MAX_WORKERS = 2
@@ -0,0 +1,12 @@
+"""
+Settings for the test suite: the project settings plus two shard databases.
+
+``manage.py test`` picks this module unless DJANGO_SETTINGS_MODULE is set.
+The sharding tests list ``shard_a`` and ``shard_b`` in ``TENANT_SHARDS``. Their
+test databases are in memory, so concurrent runs never share them.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+for _alias in ('shard_a', 'shard_b'):
+    DATABASES[_alias] = {**DATABASES['default'], 'NAME': ':memory:'}